@@ -1,8 +1,14 @@
 from daf_virtual_rasp.com.enquadramento import Enquadramento
 from daf_virtual_rasp.com.arq import Arq
 from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.com.poller_asyncio import PollerAsyncio
 from daf_virtual_rasp.com.enq_enum import TIPO_t
 from daf_virtual_rasp.daf.daf import DAF
+from daf_virtual_rasp.daf.pool_chaves import PoolChavesEC
+from daf_virtual_rasp.hospedeiro import HospedeiroDAF
+from daf_virtual_rasp.frota import FrotaDAF
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento
+from concurrent.futures import ThreadPoolExecutor
 import sys, time, os
 import serial
 
@@ -12,33 +18,83 @@ max_tentativas_arq = 3
 timeout_enq = 0.5
 timeout_arq = 2
 
-# obtém porta serial 
-ser = serial.Serial(
-            port='/dev/pts/0',
-            baudrate = 115200,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.EIGHTBITS,
-            timeout= None
-        )
-
-ser.flush()
-
-
-# cria os objetos das camadas ARQ, Enquadramento e DAF
-e = Enquadramento(ser, timeout_enq)
-a = Arq(max_tentativas_arq, timeout_arq)
-daf = DAF()
-
-# define organização das subcamadas
-daf.set_inferior(a)
-a.set_superior(daf)
-a.set_inferior(e)
-e.set_superior(a)
-
-# despacha as camadas
-pol = Poller()
-pol.adiciona(daf)
-pol.adiciona(e)
-pol.adiciona(a)
-pol.despache()
\ No newline at end of file
+# despachante das camadas (com --asyncio, usa um laço asyncio no lugar do Poller),
+# criado apenas no processo que despacha (no modo frota, cada processo cria o seu)
+usa_asyncio = '--asyncio' in sys.argv
+
+# --pool-chaves N mantém N pares de chaves gerados com antecedência, nos intervalos ociosos, para o registro
+pool_chaves = 0
+if '--pool-chaves' in sys.argv:
+    pool_chaves = int(sys.argv[sys.argv.index('--pool-chaves') + 1])
+
+# --executor trata os pedidos em uma thread, para que o laço siga atendendo o enquadramento e o ARQ
+usa_executor = '--executor' in sys.argv
+
+if '--dispositivos' in sys.argv:
+    arquivo = sys.argv[sys.argv.index('--dispositivos') + 1]
+    especificacoes = HospedeiroDAF.carrega_especificacoes(arquivo)
+
+    if '--processos' in sys.argv:
+        # modo frota: reparte os DAFs descritos no arquivo JSON entre vários processos
+        processos = int(sys.argv[sys.argv.index('--processos') + 1])
+        FrotaDAF(especificacoes, processos, usa_asyncio, max_tentativas_arq, timeout_enq, timeout_arq, pool_chaves, usa_executor).executa()
+    else:
+        # modo hospedeiro: executa no mesmo processo todos os DAFs descritos no arquivo JSON
+        pol = PollerAsyncio() if usa_asyncio else Poller()
+        HospedeiroDAF(especificacoes, pol, max_tentativas_arq, timeout_enq, timeout_arq, pool_chaves, ThreadPoolExecutor(1) if usa_executor else None).despache()
+
+else:
+    # obtém porta serial
+    ser = serial.Serial(
+                port='/dev/pts/0',
+                baudrate = 115200,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize=serial.EIGHTBITS,
+                timeout= None
+            )
+
+    ser.flush()
+
+
+    # banco das memórias (--armazenamento sqlite usa ms.db e mt.db no lugar dos arquivos JSON)
+    armazenamento = TipoArmazenamento.tinydb
+    if '--armazenamento' in sys.argv:
+        armazenamento = TipoArmazenamento(sys.argv[sys.argv.index('--armazenamento') + 1])
+    extensao = {TipoArmazenamento.sqlite: '.db', TipoArmazenamento.mmap: '.bin'}.get(armazenamento, '.json')
+
+    # --armazenamento-mt log mantém a memória de trabalho em um log de acréscimos (mt.log)
+    # (com --armazenamento mmap, que serve apenas à memória segura, a MT fica no TinyDB)
+    armazenamento_mt = armazenamento if armazenamento != TipoArmazenamento.mmap else TipoArmazenamento.tinydb
+    if '--armazenamento-mt' in sys.argv:
+        armazenamento_mt = TipoArmazenamento(sys.argv[sys.argv.index('--armazenamento-mt') + 1])
+    extensao_mt = {TipoArmazenamento.sqlite: '.db', TipoArmazenamento.log: '.log'}.get(armazenamento_mt, '.json')
+
+    # ajustes do log da memória de trabalho: --registros-por-sync N agrupa N registros por fsync
+    # (o lote em aberto é sincronizado antes de cada resposta), --limiar-compactacao F e
+    # --minimo-compactacao N definem quando o log é compactado
+    opcoes_mt = {}
+    for opcao, conversao in (('--registros-por-sync', int), ('--limiar-compactacao', float), ('--minimo-compactacao', int)):
+        if opcao in sys.argv:
+            opcoes_mt[opcao[2:].replace('-', '_')] = conversao(sys.argv[sys.argv.index(opcao) + 1])
+
+    # cria os objetos das camadas ARQ, Enquadramento e DAF (o Enquadramento grava as imagens do SB na partição candidata à medida que chegam)
+    pool = PoolChavesEC(pool_chaves) if pool_chaves > 0 else None
+    daf = DAF('./ms' + extensao, './mt' + extensao_mt, armazenamento=armazenamento, armazenamento_mt=armazenamento_mt, opcoes_armazenamento_mt=opcoes_mt, pool_chaves=pool, executor=ThreadPoolExecutor(1) if usa_executor else None)
+    a = Arq(max_tentativas_arq, timeout_arq)
+    e = Enquadramento(ser, timeout_enq, leitura_em_bloco=True, receptor_binario=daf.nova_recepcao_sb)
+
+    # define organização das subcamadas
+    daf.set_inferior(a)
+    a.set_superior(daf)
+    a.set_inferior(e)
+    e.set_superior(a)
+
+    # despacha as camadas
+    pol = PollerAsyncio() if usa_asyncio else Poller()
+    pol.adiciona(daf)
+    pol.adiciona(e)
+    pol.adiciona(a)
+    if pool != None:
+        pol.adiciona(pool)
+    pol.despache()
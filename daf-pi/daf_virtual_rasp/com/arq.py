@@ -20,6 +20,7 @@ class Arq(Layer):
         self.inferior = None    # Camada Enquadramento
         self.campo_dados = bytearray()
         self.comando = None
+        self.entregue = False   # Indica se o último quadro recebido foi entregue à camada superior
 
         Layer.__init__(self, None, timeout)
 
@@ -78,7 +79,7 @@ class Arq(Layer):
                     self.inferior.envia(self.msg, TIPO_t.PING.value) 
                 else:
                     print("Recebido pelo DAF:", self.campo_dados, "\n")
-                    self.superior.notifica(self.comando, self.campo_dados) 
+                    self.__entrega() 
 
             # Recebe uma mensagem já recebida e reenvia um ACK
             elif ((self.seq_rx == 0) and (campo_controle == CONTROLE_t.DATA_1.value)) or ((self.seq_rx == 1) and (campo_controle == CONTROLE_t.DATA_0.value)):
@@ -104,7 +105,7 @@ class Arq(Layer):
                  self.estado = ESTADO_t.WAIT.value
                  self.__ack(False)
                  print("Recebido pelo DAF:", self.campo_dados, "\n")
-                 self.superior.notifica(self.comando, self.campo_dados)
+                 self.__entrega()
 
             # Recebe uma mensagem já recebida e reenvia um ACK
             elif ((self.seq_rx == 0) and (campo_controle == CONTROLE_t.DATA_1.value)) or ((self.seq_rx == 1) and (campo_controle == CONTROLE_t.DATA_0.value)):
@@ -121,6 +122,12 @@ class Arq(Layer):
                 else:
                     self.__reenvia()             
 
+    def __entrega(self):
+        """ Entrega o quadro recebido à camada superior (API-DAF).
+        """
+        self.entregue = True
+        self.superior.notifica(self.comando, self.campo_dados)
+
     def monta_quadro(self, campo_controle:int, campo_dados:Union[int, bytes]):
         """ Monta o quadro com as características do ARQ_MAC.
 
@@ -212,7 +219,11 @@ class Arq(Layer):
             tipo (int): campo tipo
         """
         self.comando = campo_tipo
+        self.entregue = False
         self.handle_fsm(campo_controle, campo_dados)
+        # Uma imagem recebida em blocos que não foi entregue (ex: quadro repetido) é descartada
+        if not self.entregue and hasattr(campo_dados, 'descarta'):
+            campo_dados.descarta()
     
     def retorna_dados(self):
         return self.campo_dados
\ No newline at end of file
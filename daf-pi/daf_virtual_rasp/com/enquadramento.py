@@ -5,8 +5,10 @@ import serial
 from typing import Union
 
 class Enquadramento(Layer):
-    
-    def __init__(self, fd, timeout):
+
+    TAMANHO_BLOCO = 4096    # Bytes lidos por evento quando a porta não informa quantos estão disponíveis
+
+    def __init__(self, fd, timeout, leitura_em_bloco:bool = False, receptor_binario = None):
         self.estado = ESTADO_t.IDLE.value        # Estado inicial da FSM
         self.msg = bytearray()
 
@@ -22,6 +24,14 @@ class Enquadramento(Layer):
         self.campo_controle = 0
         self.campo_dados = bytearray()
         self.ser = fd
+        self.leitura_em_bloco = leitura_em_bloco    # Lê todos os bytes disponíveis a cada evento
+        # Cria o objeto que recebe em blocos o campo Dados de um enviarBinario (ex: DAF.nova_recepcao_sb),
+        # no lugar de acumulá-lo em campo_dados. O objeto deve ter adiciona(bloco), conclui(), descarta(),
+        # pausa_leitura(retomada, final) e tamanho
+        self.receptor_binario = receptor_binario
+        self.recepcao = None
+        self.pausada = False            # Leitura suspensa até o receptor tratar os blocos pendentes
+        self.retidos = b''              # Bytes lidos depois de um quadro cuja entrega aguarda o receptor
 
         Layer.__init__(self, fd, timeout)
 
@@ -31,10 +41,31 @@ class Enquadramento(Layer):
     def handle(self):
         """ Monitora a serial.
         """
-        byte_lido = self.ser.read(1)
-        self.handle_fsm(byte_lido)
+        if self.leitura_em_bloco:
+            dados = self.__le_disponivel()
+            if not dados:
+                # conexão encerrada pelo outro lado (ex: socket fechado)
+                self.disable()
+                return
+            self.handle_bloco(dados)
+        else:
+            byte_lido = self.ser.read(1)
+            self.handle_fsm(byte_lido)
+
+    def __le_disponivel(self) -> bytes:
+        """ Esvazia o buffer de recepção da porta, lendo todos os bytes disponíveis.
+
+        Returns:
+            bytes: bytes lidos (ao menos um, já que a porta sinalizou leitura)
+        """
+        if hasattr(self.ser, 'in_waiting'):
+            return self.ser.read(max(1, self.ser.in_waiting))
+        return self.ser.read(self.TAMANHO_BLOCO)
 
     def handle_timeout(self):
+        if self.recepcao != None:
+            # quadro incompleto: a recepção em blocos não será entregue
+            self.recepcao.descarta()
         self.__zera_variaveis()
         self.estado = ESTADO_t.IDLE.value
         self.disable_timeout()
@@ -54,6 +85,79 @@ class Enquadramento(Layer):
         else:
             self.__rx_dado(byte)
 
+    def handle_bloco(self, dados:bytes):
+        """ Trata de uma só vez um bloco de bytes recebidos, extraindo todos os
+        quadros completos nele contidos. Produz o mesmo resultado que chamar
+        handle_fsm para cada byte, mas copia os campos Tamanho e Dados em fatias.
+
+        Args:
+            dados (bytes): bytes recebidos.
+        """
+        rx = memoryview(dados)
+        pos = 0
+        fim = len(rx)
+        while pos < fim:
+            if self.estado == ESTADO_t.IDLE.value:
+                self.__idle(bytes(rx[pos:pos+1]))
+                pos += 1
+            elif self.estado == ESTADO_t.RX_TAMANHO.value:
+                falta = self.tamanho_comando - len(self.campo_tamanho)
+                self.campo_tamanho += rx[pos:pos+falta]
+                pos += falta
+                if len(self.campo_tamanho) == self.tamanho_comando:
+                    self.valor_tamanho = self.__extrai_tamanho(self.campo_tamanho)
+                    self.estado = ESTADO_t.RX_DADO.value
+            else:
+                falta = self.valor_tamanho - self.__recebidos()
+                if falta <= 0:
+                    # quadro sem campo Dados: assim como na FSM byte a byte,
+                    # os bytes seguintes são descartados até o timeout
+                    break
+                self.__acumula(rx[pos:pos+falta])
+                pos += falta
+                if self.__recebidos() == self.valor_tamanho:
+                    if self.__pausa(final=True):
+                        self.retidos = bytes(rx[pos:])
+                        break
+                    self.__entrega_quadro()
+                elif self.__pausa():
+                    break
+        rx.release()
+
+        if self.estado != ESTADO_t.IDLE.value and not self.pausada:
+            self.recarrega_timeout(self.tout)
+
+    def __pausa(self, final:bool = False) -> bool:
+        """ Suspende a leitura da serial se o receptor em blocos ainda estiver tratando
+        os blocos recebidos. A leitura é retomada por __retoma, chamado no laço.
+
+        Args:
+            final (bool): o campo Dados terminou e o quadro aguarda o receptor para ser entregue.
+
+        Returns:
+            bool: Verdadeiro se a leitura foi suspensa
+        """
+        if self.recepcao == None or not self.recepcao.pausa_leitura(self.__retoma, final):
+            return False
+        self.pausada = True
+        self.disable()
+        self.disable_timeout()
+        return True
+
+    def __retoma(self):
+        """ Retoma a leitura suspensa por __pausa, entregando o quadro que aguardava o
+        receptor e tratando os bytes lidos depois dele.
+        """
+        self.pausada = False
+        self.enable()
+        if self.recepcao != None and self.__recebidos() == self.valor_tamanho:
+            self.__entrega_quadro()
+        else:
+            self.recarrega_timeout(self.tout)
+        retidos, self.retidos = self.retidos, b''
+        if retidos:
+            self.handle_bloco(retidos)
+
     def __idle(self, byte:bytes):
         """ Estado inicial de transmissão e para recepção da Garantia de Entrega.
 
@@ -68,6 +172,8 @@ class Enquadramento(Layer):
         elif byte == TIPO_t.ENVIARBINARIO.value:
             self.campo_tipo = byte
             self.tamanho_comando = TAMANHO_t.TAM_4.value
+            if self.receptor_binario != None:
+                self.recepcao = self.receptor_binario()
             self.recarrega_timeout(self.tout)
             self.estado = ESTADO_t.RX_TAMANHO.value
         elif byte == TIPO_t.PING.value:
@@ -114,16 +220,51 @@ class Enquadramento(Layer):
             byte (bytes): byte a ser tratado.
         """
 
-        if len(self.campo_dados) < self.valor_tamanho - 1:
-            self.campo_dados += byte
+        if self.__recebidos() < self.valor_tamanho - 1:
+            self.__acumula(byte)
             self.recarrega_timeout(self.tout)
             self.estado = ESTADO_t.RX_DADO.value
-        elif len(self.campo_dados) == self.valor_tamanho -1:
-            self.campo_dados += byte
-            self.estado = ESTADO_t.IDLE.value
-            self.superior.notifica(self.campo_dados[0], self.campo_dados[1:],self.campo_tipo)
-            self.disable_timeout()
-            self.__zera_variaveis()
+            self.__pausa()
+        elif self.__recebidos() == self.valor_tamanho -1:
+            self.__acumula(byte)
+            if not self.__pausa(final=True):
+                self.__entrega_quadro()
+
+    def __recebidos(self) -> int:
+        """ Quantidade de bytes do campo Dados já recebidos
+        """
+        if self.recepcao == None:
+            return len(self.campo_dados)
+        return len(self.campo_dados) + self.recepcao.tamanho
+
+    def __acumula(self, dados:bytes):
+        """ Acumula bytes do campo Dados. Com uma recepção em blocos, apenas o
+        primeiro byte (campo Controle do ARQ) fica em campo_dados.
+
+        Args:
+            dados (bytes): bytes recebidos do campo Dados.
+        """
+        if self.recepcao == None:
+            self.campo_dados += dados
+            return
+        if len(self.campo_dados) == 0:
+            self.campo_dados += dados[:1]
+            dados = dados[1:]
+        if len(dados) > 0:
+            self.recepcao.adiciona(dados)
+
+    def __entrega_quadro(self):
+        """ Entrega o quadro completo à camada superior (ARQ) e volta ao estado inicial.
+        """
+        self.estado = ESTADO_t.IDLE.value
+        if self.recepcao != None:
+            dados = self.recepcao
+            dados.conclui()
+        else:
+            dados = self.campo_dados[1:]
+        self.superior.notifica(self.campo_dados[0], dados,self.campo_tipo)
+        self.disable_timeout()
+        self.__zera_variaveis()
 
 
     def __zera_variaveis(self):
@@ -135,6 +276,7 @@ class Enquadramento(Layer):
         self.campo_tamanho.clear()
         self.campo_controle = 0
         self.campo_dados.clear()
+        self.recepcao = None
 
     def __enviar_mensagem(self, dados:str):
         """ Cria e envia um comando do tipo enviarMensagem pela serial
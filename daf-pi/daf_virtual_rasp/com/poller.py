@@ -1,7 +1,12 @@
 #!/usr/bin/python3
 
 import selectors
+import heapq
+import itertools
+import os
+import threading
 import time
+from collections import deque
 
 
 class Callback:
@@ -24,11 +29,12 @@ class Callback:
         decimal para expressar fração de segundo'''
         if timeout < 0: raise ValueError('timeout negativo')
         self.fd = fileobj
-        self._timeout = timeout
         self.base_timeout = timeout
+        self._deadline = time.monotonic() + timeout  # instante do timeout (relógio monotônico)
         self._enabled = True
         self._enabled_to = True
-        self._reloaded = False
+        self._agendamento = None    # entrada do timeout na fila do Poller
+        self._poller = None
 
     def handle(self):
         '''Trata o evento associado a este callback. Tipicamente
@@ -41,42 +47,45 @@ class Callback:
         derivadas devem sobrescrever este método.'''
         pass
 
-    def update(self, dt):
-        'Atualiza o tempo restante de timeout'
-        if not self._reloaded:
-            self._timeout = max(0, self._timeout - dt)
-        else:
-            self._reloaded = False
-
     def reload_timeout(self):
         'Recarrega o valor de timeout'
-        self._timeout = self.base_timeout
-        self._reloaded = True
+        self._deadline = time.monotonic() + self.base_timeout
+        self._arma()
 
     def disable_timeout(self):
         'Desativa o timeout'
         self._enabled_to = False
+        if self._poller != None: self._poller._cancela(self)
 
     def enable_timeout(self):
         'Reativa o timeout'
         self._enabled_to = True
+        self._arma()
+
+    def _arma(self):
+        'Agenda o timeout no Poller, se estiver ativado'
+        if self._enabled_to and self._poller != None:
+            self._poller._agenda(self)
 
     def enable(self):
         'Reativa o monitoramento do descritor neste callback'
         self._enabled = True
+        if self._poller != None: self._poller._registra(self)
 
     def disable(self):
         'Desativa o monitoramento do descritor neste callback'
         self._enabled = False
+        if self._poller != None: self._poller._desregistra(self)
 
     @property
     def timeout(self):
-        return self._timeout
+        'tempo restante até o timeout'
+        return max(0, self._deadline - time.monotonic())
 
     @timeout.setter
     def timeout(self, tout):
-        self._timeout = tout
-        self._reloaded = True
+        self._deadline = time.monotonic() + tout
+        self._arma()
 
     @property
     def timeout_enabled(self):
@@ -93,38 +102,168 @@ class Callback:
         return self._enabled
 
 
-class Poller:
-    '''Classe Poller: um agendador de eventos que monitora objetos
-    do tipo arquivo e executa callbacks quando tiverem dados para
-    serem lidos. Callbacks devem ser registrados para que
-    seus fileobj sejam monitorados. Callbacks que não possuem
-    fileobj são tratados como timers'''
+class PollerBase:
+    '''Classe PollerBase: base dos despachantes de callbacks (Poller e
+    PollerAsyncio). Mantém os callbacks registrados e leva para a thread
+    do laço as alterações de monitoramento e timeout feitas por outras
+    threads. Classes derivadas implementam chama_no_laco e as operações
+    _monitora, _ignora, _insere_timeout e _remove_timeout, que são sempre
+    executadas na thread do laço.'''
 
     def __init__(self):
         self.cbs_to = []
         self.cbs = set()
+        self._thread = None         # thread que executa o laço
+        self._tarefas = 0           # trabalhos submetidos que ainda não foram concluídos no laço
 
     def adiciona(self, cb):
         'Registra um callback'
+        cb._poller = self
         if cb.isTimer and not cb in self.cbs_to:
             self.cbs_to.append(cb)
         else:
             self.cbs.add(cb)
+            if cb.isEnabled: self._registra(cb)
+        cb._arma()
+
+    def _fora_do_laco(self):
+        'true se chamado por uma thread que não é a que executa o laço'
+        return self._thread != None and threading.get_ident() != self._thread
+
+    def chama_no_laco(self, func, *args):
+        'Agenda func(*args) para ser executada pela thread do laço'
+        raise NotImplementedError
+
+    def _registra(self, cb):
+        'Passa a monitorar o descritor do callback'
+        if self._fora_do_laco(): return self.chama_no_laco(self._registra, cb)
+        if not cb.isTimer: self._monitora(cb)
+
+    def _desregistra(self, cb):
+        'Deixa de monitorar o descritor do callback'
+        if self._fora_do_laco(): return self.chama_no_laco(self._desregistra, cb)
+        if not cb.isTimer: self._ignora(cb)
+
+    def _agenda(self, cb):
+        'Agenda (ou reagenda) o timeout do callback'
+        if self._fora_do_laco(): return self.chama_no_laco(self._agenda, cb)
+        self._cancela(cb)
+        self._insere_timeout(cb)
+
+    def _cancela(self, cb):
+        'Cancela o timeout do callback'
+        if self._fora_do_laco(): return self.chama_no_laco(self._cancela, cb)
+        if cb._agendamento == None: return
+        self._remove_timeout(cb)
+        cb._agendamento = None
+
+
+class Poller(PollerBase):
+    '''Classe Poller: um agendador de eventos que monitora objetos
+    do tipo arquivo e executa callbacks quando tiverem dados para
+    serem lidos. Callbacks devem ser registrados para que
+    seus fileobj sejam monitorados. Callbacks que não possuem
+    fileobj são tratados como timers. Os timeouts ativos ficam
+    em um heap ordenado pelo instante de expiração.
+    Trabalhos demorados podem ser executados fora do laço com submete;
+    enquanto houver trabalhos pendentes, outras threads podem agendar
+    chamadas no laço com chama_no_laco, que o desperta por um pipe.'''
+
+    def __init__(self):
+        PollerBase.__init__(self)
+        self.sched = selectors.DefaultSelector()
+        self.timers = []            # heap de entradas [deadline, seq, cb]
+        self._seq = itertools.count()
+        self._cancelados = 0        # entradas canceladas que ainda estão no heap
+        self._chamadas = deque()    # chamadas agendadas por outras threads
+        self._trava = threading.Lock()
+        self._despertador = None    # pipe (leitura, escrita) usado para despertar o laço
+
+    def chama_no_laco(self, func, *args):
+        '''Agenda func(*args) para ser executada pela thread do laço. Pode ser
+        chamado de qualquer thread enquanto houver trabalhos submetidos pendentes'''
+        with self._trava:
+            self._chamadas.append((func, args))
+        if self._despertador != None:
+            try:
+                os.write(self._despertador[1], b'\x00')
+            except BlockingIOError:
+                pass  # o pipe já tem bytes suficientes para despertar o laço
+
+    def _executa_chamadas(self):
+        'Executa as chamadas agendadas por outras threads'
+        while True:
+            with self._trava:
+                if not self._chamadas: return
+                func, args = self._chamadas.popleft()
+            func(*args)
+
+    def submete(self, executor, func, *args, concluida=None):
+        '''Executa func(*args) no executor (ex: ThreadPoolExecutor), fora do laço.
+        Ao terminar, concluida(futuro) é chamada na thread do laço. Enquanto
+        houver trabalhos pendentes o despacho não termina'''
+        if self._despertador == None:
+            self._despertador = os.pipe()
+            os.set_blocking(self._despertador[0], False)
+            os.set_blocking(self._despertador[1], False)
+        if self._tarefas == 0:
+            self.sched.register(self._despertador[0], selectors.EVENT_READ, None)
+        self._tarefas += 1
+        futuro = executor.submit(func, *args)
+        futuro.add_done_callback(lambda f: self.chama_no_laco(self._conclui, f, concluida))
+        return futuro
+
+    def _conclui(self, futuro, concluida):
+        self._tarefas -= 1
+        if self._tarefas == 0:
+            self.sched.unregister(self._despertador[0])
+        if concluida != None: concluida(futuro)
+
+    def _monitora(self, cb):
+        'Registra o descritor do callback no seletor'
+        try:
+            self.sched.register(cb.fd, selectors.EVENT_READ, cb)
+        except KeyError:
+            pass  # já registrado
+
+    def _ignora(self, cb):
+        'Remove o descritor do callback do seletor'
+        try:
+            self.sched.unregister(cb.fd)
+        except KeyError:
+            pass  # não estava registrado
+
+    def _insere_timeout(self, cb):
+        'Insere o timeout do callback no heap'
+        entrada = [cb._deadline, next(self._seq), cb]
+        cb._agendamento = entrada
+        heapq.heappush(self.timers, entrada)
+
+    def _remove_timeout(self, cb):
+        '''Remove o timeout do callback do heap. A entrada só é marcada, sendo
+        descartada ao chegar no topo do heap'''
+        cb._agendamento[-1] = None
+        self._cancelados += 1
+        if self._cancelados > 64 and self._cancelados > len(self.timers) // 2:
+            self.timers = [e for e in self.timers if e[-1] != None]
+            heapq.heapify(self.timers)
+            self._cancelados = 0
 
-    def _compareTimeout(self, cb, cb_to):
-        if not cb.timeout_enabled: return cb_to
-        if not cb_to:
-            cb_to = cb
-        elif cb_to.timeout > cb.timeout:
-            cb_to = cb
-        return cb_to
+    def fecha(self):
+        'Libera o seletor'
+        self.sched.close()
+        if self._despertador != None:
+            os.close(self._despertador[0])
+            os.close(self._despertador[1])
+            self._despertador = None
 
     def _timeout(self):
-        cb_to = None
-        for cb in self.cbs_to: cb_to = self._compareTimeout(cb, cb_to)
-        for cb in self.cbs:
-            cb_to = self._compareTimeout(cb, cb_to)
-        return cb_to
+        'Retorna o callback com o timeout mais próximo'
+        while self.timers and self.timers[0][-1] == None:
+            heapq.heappop(self.timers)
+            self._cancelados -= 1
+        if self.timers: return self.timers[0][-1]
+        return None
 
     def despache(self):
         '''Espera por eventos indefinidamente, tratando-os com seus
@@ -135,22 +274,17 @@ class Poller:
             pass
 
     def _get_events(self, timeout):
-        sched = selectors.DefaultSelector()
-        active = False
-        for cb in self.cbs:
-            if cb.isEnabled:
-                sched.register(cb.fd, selectors.EVENT_READ, cb)
-                active = True
-        if not active and timeout == None:
+        if not self.sched.get_map() and timeout == None:
             return None
-        eventos = sched.select(timeout)
+        eventos = self.sched.select(timeout)
         return eventos
 
     def despache_simples(self):
         '''Espera por um único evento, tratando-o com seu callback. Retorna True se
            tratou um evento, e False se nenhum evento foi gerado porque os callbacks
            estão desativados.'''
-        t1 = time.time()
+        self._thread = threading.get_ident()
+        if self._chamadas: self._executa_chamadas()
         cb_to = self._timeout()
         if cb_to != None:
             tout = cb_to.timeout
@@ -159,21 +293,22 @@ class Poller:
         eventos = self._get_events(tout)
         if eventos == None:  # fim: nada a fazer !!
             return False
-        fired = set()
         if not eventos:  # timeout !
-            if cb_to != None:
-                fired.add(cb_to)
+            if cb_to != None and cb_to._agendamento != None:
+                self._cancela(cb_to)
                 cb_to.handle_timeout()
                 cb_to.reload_timeout()
         else:
             for key, mask in eventos:
                 cb = key.data  # este é o callback !
-                fired.add(cb)
+                if cb == None:  # despertado por outra thread
+                    while True:
+                        try:
+                            if not os.read(key.fd, 512): break
+                        except BlockingIOError:
+                            break
+                    self._executa_chamadas()
+                    continue
                 cb.handle()
                 cb.reload_timeout()
-        dt = time.time() - t1
-        for cb in self.cbs_to:
-            if not cb in fired: cb.update(dt)
-        for cb in self.cbs:
-            if not cb in fired: cb.update(dt)
-        return True
\ No newline at end of file
+        return True
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+import asyncio
+import threading
+import time
+
+from daf_virtual_rasp.com.poller import PollerBase
+
+
+class PollerAsyncio(PollerBase):
+    '''Classe PollerAsyncio: alternativa ao Poller que executa os mesmos
+    objetos Callback (e portanto as camadas Layer) sobre um laço asyncio.
+    Descritores são monitorados com loop.add_reader e timeouts são
+    agendados com loop.call_later, de modo que o laço pode ser compartilhado
+    com outros serviços (ex: servidor de métricas, gateway TCP). Trabalhos
+    submetidos com submete e chamadas de outras threads (chama_no_laco)
+    voltam ao laço com loop.call_soon_threadsafe.'''
+
+    def __init__(self, loop=None):
+        '''Cria o despachante.
+        loop: laço asyncio a ser usado. Se None, um novo laço é criado'''
+        PollerBase.__init__(self)
+        self._loop_proprio = loop == None
+        self.loop = asyncio.new_event_loop() if loop == None else loop
+        self._leitores = set()      # callbacks com descritor monitorado
+        self._armados = set()       # callbacks com timeout agendado
+        self._fim = None
+
+    def chama_no_laco(self, func, *args):
+        'Agenda func(*args) para ser executada pela thread do laço. Pode ser chamado de qualquer thread'
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def submete(self, executor, func, *args, concluida=None):
+        '''Executa func(*args) no executor (ex: ThreadPoolExecutor), fora do laço.
+        Ao terminar, concluida(futuro) é chamada na thread do laço. Enquanto
+        houver trabalhos pendentes o despacho não termina'''
+        self._tarefas += 1
+        futuro = executor.submit(func, *args)
+        futuro.add_done_callback(lambda f: self.chama_no_laco(self._conclui, f, concluida))
+        return futuro
+
+    def _conclui(self, futuro, concluida):
+        self._tarefas -= 1
+        try:
+            if concluida != None: concluida(futuro)
+        except Exception as e:
+            self._encerra(e)
+        self._verifica_fim()
+
+    def _monitora(self, cb):
+        'Monitora o descritor do callback no laço'
+        if cb in self._leitores: return
+        self.loop.add_reader(cb.fd, self._trata_evento, cb)
+        self._leitores.add(cb)
+
+    def _ignora(self, cb):
+        'Remove o descritor do callback do laço'
+        if not cb in self._leitores: return
+        self.loop.remove_reader(cb.fd)
+        self._leitores.discard(cb)
+
+    def _insere_timeout(self, cb):
+        'Agenda o timeout do callback no laço'
+        atraso = max(0, cb._deadline - time.monotonic())
+        cb._agendamento = self.loop.call_later(atraso, self._trata_timeout, cb)
+        self._armados.add(cb)
+
+    def _remove_timeout(self, cb):
+        'Cancela o timeout do callback no laço'
+        cb._agendamento.cancel()
+        self._armados.discard(cb)
+
+    def _trata_evento(self, cb):
+        try:
+            cb.handle()
+            cb.reload_timeout()
+        except Exception as e:
+            self._encerra(e)
+        self._verifica_fim()
+
+    def _trata_timeout(self, cb):
+        cb._agendamento = None
+        self._armados.discard(cb)
+        try:
+            cb.handle_timeout()
+            cb.reload_timeout()
+        except Exception as e:
+            self._encerra(e)
+        self._verifica_fim()
+
+    def _encerra(self, erro=None):
+        if self._fim == None or self._fim.done(): return
+        if erro == None:
+            self._fim.set_result(True)
+        else:
+            self._fim.set_exception(erro)
+
+    def _verifica_fim(self):
+        'Encerra o despacho se nenhum evento puder mais ser gerado pelos callbacks'
+        if not self._leitores and not self._armados and not self._tarefas:
+            self._encerra()
+
+    async def executa(self):
+        '''Corrotina que trata os eventos até que todos os callbacks estejam
+        desativados (monitoramento do descritor e timeout). Deve ser usada
+        quando o laço é compartilhado com outras tarefas'''
+        self._thread = threading.get_ident()
+        self._fim = self.loop.create_future()
+        self._verifica_fim()
+        try:
+            await self._fim
+        finally:
+            self._fim = None
+
+    def despache(self):
+        '''Espera por eventos indefinidamente, tratando-os com seus
+        callbacks. Termina se nenhum evento puder ser gerado pelos callbacks,
+        assim como Poller.despache'''
+        self.loop.run_until_complete(self.executa())
+
+    def fecha(self):
+        'Remove todos os descritores e timeouts do laço'
+        for cb in list(self._leitores): self._desregistra(cb)
+        for cb in list(self._armados): self._cancela(cb)
+        if self._loop_proprio: self.loop.close()
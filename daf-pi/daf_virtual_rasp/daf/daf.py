@@ -1,12 +1,15 @@
 from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, Certificado, ChaveCripto
 from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
 from daf_virtual_rasp.utils.jwt_daf import JWTDAF
-from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura
+from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura, PoliticaEscrita
 from daf_virtual_rasp.memoria.mt import MemoriaDeTrabalho
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento
 from daf_virtual_rasp.daf.daf_enums import Estados, Respostas, Artefatos, Guardas, ParametrosAtualizacao
+from daf_virtual_rasp.daf.pool_chaves import PoolChavesEC
 import json
+from concurrent.futures import Executor
 from typing import Tuple, Union
-from daf_virtual_rasp.imagem import ImagemSB, ImagemSBCandidato
+from daf_virtual_rasp.imagem import ImagemSB, ImagemSBCandidato, RecepcaoImagemSB
 import uuid
 from daf_virtual_rasp.com.layer import Layer
 from daf_virtual_rasp.com.enq_enum import TIPO_t
@@ -14,19 +17,33 @@ from jwcrypto import jwk, jwe
 
 class DAF(Layer):
 
-    def __init__(self):
+    def __init__(self, path_ms: str = './ms.json', path_mt: str = './mt.json', path_sb: str = './daf_virtual_rasp/resources/imagem/sb', path_sb_candidato: str = './daf_virtual_rasp/resources/outra-imagem/sb', politica_escrita_ms: PoliticaEscrita = PoliticaEscrita.imediata, armazenamento: TipoArmazenamento = TipoArmazenamento.tinydb, armazenamento_mt: TipoArmazenamento = None, opcoes_armazenamento_mt: dict = None, pool_chaves: PoolChavesEC = None, executor: Executor = None):
         """ 
             Classe para representar um DAF. 
+
+        Args:
+            path_ms (str, optional): arquivo da memória segura. Defaults to './ms.json'.
+            path_mt (str, optional): arquivo da memória de trabalho. Defaults to './mt.json'.
+            path_sb (str, optional): partição do SB, um diretório ou um arquivo empacotado (extensão .sb). Defaults to './daf_virtual_rasp/resources/imagem/sb'.
+            path_sb_candidato (str, optional): local onde é gravada a imagem recebida em uma atualização do SB. Defaults to './daf_virtual_rasp/resources/outra-imagem/sb'.
+            politica_escrita_ms (PoliticaEscrita, optional): política de escrita da memória segura. Defaults to PoliticaEscrita.imediata.
+            armazenamento (TipoArmazenamento, optional): implementação do banco das memórias segura e de trabalho. Com TipoArmazenamento.mmap, que serve apenas à memória segura, informe armazenamento_mt. Defaults to TipoArmazenamento.tinydb.
+            armazenamento_mt (TipoArmazenamento, optional): implementação do banco da memória de trabalho, se diferente da memória segura (ex: TipoArmazenamento.log). Defaults to None.
+            opcoes_armazenamento_mt (dict, optional): opções do armazenamento da memória de trabalho, aceitas apenas pelo log (registros_por_sync, limiar_compactacao e minimo_compactacao). Defaults to None.
+            pool_chaves (PoolChavesEC, optional): reserva de pares de chaves gerados com antecedência, usada no registro. Defaults to None (o par é gerado durante o registro).
+            executor (Executor, optional): executor com uma única thread (ThreadPoolExecutor(1)) no qual os pedidos são tratados, fora do laço do despachante, que segue atendendo o enquadramento e o ARQ. A resposta é enviada pelo laço quando o tratamento termina. Defaults to None (pedidos tratados no próprio laço).
         """ 
         
-        self.ms = MemoriaSegura('./ms.json')        # adiciona arquivo de memoria segura
-        self.mt = MemoriaDeTrabalho('./mt.json')    # adiciona arquivo de memoria de trabalho
+        self.ms = MemoriaSegura(path_ms, path_sb, politica_escrita_ms, armazenamento)   # adiciona arquivo de memoria segura
+        self.mt = MemoriaDeTrabalho(path_mt, armazenamento_mt if armazenamento_mt != None else armazenamento, opcoes_armazenamento_mt)        # adiciona arquivo de memoria de trabalho
         self.operacao = False  
         self.nonce = None
-        self.imagem_atual = ImagemSB()
+        self.imagem_atual = ImagemSB(path_arquivos=path_sb)
+        self.path_sb_candidato = path_sb_candidato
+        self.pool_chaves = pool_chaves
+        self.executor = executor
         self.last_msg = None                        # ultima mensagem recebida pelo DAF
-        self.timeout = 120.0
-        Layer.__init__(self, None, self.timeout)
+        Layer.__init__(self, None, 120.0)
         self.enable()
         self.disable_timeout()          # Desativa o Timeout
         
@@ -196,13 +213,13 @@ class DAF(Layer):
                     Respostas.pedidoMalFormado.value)
            
             if cod == 1:
-                self.recarrega_timeout(self.timeout)
+                self.recarrega_timeout(self.base_timeout)
                 return self.__processa_registrar(msg)
             elif cod == 2:
                 self.disable_timeout()
                 return self.__processa_confirmarRegistro(msg)
             elif cod == 3:
-                self.recarrega_timeout(self.timeout)
+                self.recarrega_timeout(self.base_timeout)
                 return self.__processa_solicitarAutenticacao(msg)
             elif cod == 4:
                 self.disable_timeout()
@@ -210,7 +227,7 @@ class DAF(Layer):
             elif cod == 5:
                 return self.__processa_apagarAutorizacaoRetida(msg)
             elif cod == 6:
-                self.recarrega_timeout(self.timeout)
+                self.recarrega_timeout(self.base_timeout)
                 return self.__processa_removerRegistro(msg)
             elif cod == 7:
                 self.disable_timeout()
@@ -218,14 +235,14 @@ class DAF(Layer):
             elif cod == 8:
                 return self.__processa_consultarInformacoes()
             elif cod == 9:
-                self.recarrega_timeout(self.timeout)
+                self.recarrega_timeout(self.base_timeout)
                 return self.__processa_atualizarSB()
             elif cod == 10:
                 return self.__processa_atualizarCertificado(msg)
             elif cod == 11:
                 return self.__processa_descarregarRetidos(msg)
             elif cod == 12:
-                self.recarrega_timeout(self.timeout)
+                self.recarrega_timeout(self.base_timeout)
                 return self.__processa_alterarModoOperacao(msg)
             elif cod == 13:
                 self.disable_timeout()
@@ -293,7 +310,10 @@ class DAF(Layer):
             return self.__gera_json_resposta_insucesso(             Respostas.pedidoMalFormado.value)
             
         
-        priv, pub = CriptoDAF.gera_chave_EC_p256()
+        if self.pool_chaves != None:
+            priv, pub = self.pool_chaves.retira()
+        else:
+            priv, pub = CriptoDAF.gera_chave_EC_p256()
 
         self.ms.escrita(
             Artefatos.chavePrivada, priv)
@@ -402,7 +422,7 @@ class DAF(Layer):
         if not self.__valida_mensagem(msg):
             return self.__gera_json_resposta_insucesso(Respostas.pedidoMalFormado.value)
         
-        chPAF = self.ms.leitura(Artefatos.chavePAF)
+        chPAF = self.ms.contexto_HMAC(Artefatos.chavePAF)
 
         hashDFE = Base64URLDAF.base64URLDecode(
             msg['hdf'])
@@ -416,7 +436,7 @@ class DAF(Layer):
         
         self.nonce = ""
 
-        if not (self.mt.existe_autorizacao_DFE(msg['hdf'], 'hdf')):
+        if not (self.mt.existe_autorizacao_DFE(hashDFE, 'hdf')):
 
             cont = self.ms.leitura(Artefatos.contador)
 
@@ -438,16 +458,16 @@ class DAF(Layer):
 
             msg_para_hmac = cont.to_bytes(4,'big') + fragDFE_raw + hashDFE
 
-            chSEF = self.ms.leitura(Artefatos.chaveSEF)
+            chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
             idAut = CriptoDAF.gera_HMAC_SHA256(
                 chSEF, msg_para_hmac)
-            idAut = Base64URLDAF.base64URLEncode(idAut)
-            payload['aut'] = idAut
+            payload['aut'] = Base64URLDAF.base64URLEncode(idAut)
 
             token = JWTDAF.geraJWT(payload, 'HS256', chSEF)
 
+            # a MT guarda aut, fdf e hdf em bytes
             self.mt.add_autorizacao_DFE(self.ms.leitura(
-                Artefatos.IDDAF), self.ms.leitura(Artefatos.modoOperacao), msg['pdv'],  self.ms.leitura(ParametrosAtualizacao.versaoSB), cont, idAut, fragDFE, msg['hdf'])
+                Artefatos.IDDAF), self.ms.leitura(Artefatos.modoOperacao), msg['pdv'],  self.ms.leitura(ParametrosAtualizacao.versaoSB), cont, idAut, fragDFE_raw, hashDFE)
 
             NumDFe = self.ms.leitura(Guardas.NumDFe)
 
@@ -463,7 +483,7 @@ class DAF(Layer):
 
         else:
             aut = self.mt.get_autorizacao_DFE(
-                msg['hdf'], 'hdf')
+                hashDFE, 'hdf')
             payload = {}
 
             payload['daf'] = aut['daf']
@@ -473,7 +493,7 @@ class DAF(Layer):
             payload['cnt'] = aut['cnt']                      
             payload['aut'] = aut['aut']
 
-            chSEF = self.ms.leitura(Artefatos.chaveSEF)
+            chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
             token = JWTDAF.geraJWT(payload, 'HS256', chSEF)
 
             self.last_msg = 4
@@ -500,7 +520,7 @@ class DAF(Layer):
         if not self.mt.existe_autorizacao_DFE(msg['aut'], 'aut'):
             return self.__gera_json_resposta_insucesso(                       Respostas.autorizacaoNaoEncontrada.value)
         
-        chSEF = self.ms.leitura(Artefatos.chaveSEF)
+        chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
         
         autApag = Base64URLDAF.base64URLDecode(
             msg['apg'])
@@ -608,7 +628,7 @@ class DAF(Layer):
         if not self.ms.leitura(Guardas.Estado) == Estados.inativo.value and not self.ms.leitura(Guardas.Estado) == Estados.pronto.value and not self.ms.leitura(Guardas.Estado) == Estados.bloqueado.value:
             return self.__gera_json_resposta_insucesso(Respostas.estadoIncorreto.value)
 
-        certificado = Certificado(self.ms.leitura(Artefatos.certificado).certificado_str) 
+        certificado = self.ms.leitura(Artefatos.certificado)
 
         res = {}
         res['res'] = 0
@@ -709,7 +729,7 @@ class DAF(Layer):
         payload['cnt'] = aut['cnt']                      
         payload['aut'] = aut['aut']
 
-        chSEF = self.ms.leitura(Artefatos.chaveSEF)
+        chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
         token = JWTDAF.geraJWT(payload, 'HS256', chSEF)
 
         res = {}
@@ -739,7 +759,7 @@ class DAF(Layer):
         if not self.ms.leitura(Guardas.NumDFe) == 0:
             return self.__gera_json_resposta_insucesso(Respostas.autorizacaoRetida.value)
         
-        chSEF = self.ms.leitura(Artefatos.chaveSEF)
+        chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
         payload = JWTDAF.verificaJWT(msg["jwt"],chSEF,'HS256')
 
         if not payload:
@@ -775,7 +795,7 @@ class DAF(Layer):
         if not self.__valida_mensagem(msg):
             return self.__gera_json_resposta_insucesso(Respostas.pedidoMalFormado.value)
         
-        chSEF = self.ms.leitura(Artefatos.chaveSEF)
+        chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
         payload = JWTDAF.verificaJWT(msg["jwt"],chSEF,'HS256')
         
         if not payload:
@@ -822,12 +842,12 @@ class DAF(Layer):
             return self.__gera_json_resposta_insucesso(Respostas.pedidoMalFormado.value)
         
         payload = {} 
-        certificado = Certificado(self.ms.leitura(Artefatos.certificado).certificado_str) 
+        certificado = self.ms.leitura(Artefatos.certificado)
         
         payload['daf'] = self.ms.leitura(
             Artefatos.IDDAF)
         payload['cfp'] = Base64URLDAF.base64URLEncode(certificado.fingerprint_SHA256)
-        chSEF = self.ms.leitura(Artefatos.chaveSEF)
+        chSEF = self.ms.contexto_HMAC(Artefatos.chaveSEF)
         
         token = JWTDAF.geraJWT(payload, 'HS256', chSEF)
         
@@ -860,10 +880,9 @@ class DAF(Layer):
             return self.__gera_json_resposta_insucesso(Respostas.pedidoMalFormado.value) 
         
         res = {}
-        autorizacoes = self.mt.get_autorizacoes_DFE()
         vetorIdAut = []
                 
-        for autorizacao in autorizacoes[msg['ini']-1:msg['fim']]:
+        for autorizacao in self.mt.itera_autorizacoes_DFE(msg['ini'], msg['fim']):
             vetorIdAut.append(autorizacao['aut'])
 
         res['res'] = 0
@@ -886,25 +905,39 @@ class DAF(Layer):
         self.disable_timeout()
         return json.dumps(resposta,separators=(',', ':'))
 
-    def atualizar_sb(self, novaImagem:bytes) -> str:
+    def nova_recepcao_sb(self) -> RecepcaoImagemSB:
+        """ Cria o receptor em blocos de uma nova imagem do SB, gravada na partição candidata.
+        Deve ser passado como receptor_binario ao Enquadramento. Com o DAF em um despachante,
+        a gravação e o resumo do código não bloqueiam o laço (ver RecepcaoImagemSB).
+
+        Returns:
+            RecepcaoImagemSB: receptor da imagem
+        """
+        return RecepcaoImagemSB(self.path_sb_candidato, self._poller)
+
+    def atualizar_sb(self, novaImagem: Union[bytes, RecepcaoImagemSB, ImagemSBCandidato], integro: bool = None) -> str:
         """ Método para "atualizar" o "SB" do DAF
 
         Args:
-            novaImagem (bytes): código da nova imagem recebido via USB
+            novaImagem (Union[bytes, RecepcaoImagemSB, ImagemSBCandidato]): código da nova imagem recebido via USB, inteiro, já recebido em blocos ou já gravado na partição candidata
+            integro (bool, optional): integridade da imagem já verificada. Defaults to None (verificada aqui).
 
         Returns:
             str: Resultado da atualização
         """
         certificado = self.ms.leitura(Artefatos.certificado)
         ateste = self.ms.leitura(Artefatos.chaveAtestePublica)
-        imagem_candidata = ImagemSBCandidato(novaImagem)
+        if isinstance(novaImagem, ImagemSBCandidato):
+            imagem_candidata = novaImagem
+        else:
+            imagem_candidata = ImagemSBCandidato(novaImagem, self.path_sb_candidato)
         resposta = None
         if (self.ms.leitura(ParametrosAtualizacao.falhasAtualizacao) <= 10 and not self.esta_violado()):
             if self.ms.leitura(Guardas.NumDFe) > 0:
                 resposta = self.__gera_json_resposta_insucesso(
                     Respostas.autorizacaoRetida.value)
             else:
-                resultado = self.imagem_atual.atualizar(imagem_candidata, certificado, ateste)
+                resultado = self.imagem_atual.atualizar(imagem_candidata, certificado, ateste, integro)
 
                 if resultado == 3:
                     resposta = self.__gera_json_resposta_insucesso(
@@ -989,17 +1022,57 @@ class DAF(Layer):
             comando(bytes): Campo tipo
             dados(bytes): Objeto JSON com mensagem do PAF ou binário do novo SB
         """
-        if comando == b'\x01':
-            resposta = self.processa_pedido(dados)
-            if resposta is not None:
-                self.inferior.envia(bytearray(resposta.encode()), TIPO_t.ENVIARMSG.value)
+        if self.executor != None and self._poller != None:
+            self._poller.submete(self.executor, self.__trata_pedido, comando, dados, concluida=self.__conclui_pedido)
+        elif comando != b'\x01' and self._poller != None:
+            self.__verifica_imagem(dados)
         else:
-            resposta = self.atualizar_sb(dados)
-            if resposta is not None:
-                self.inferior.envia(bytearray(resposta.encode()), TIPO_t.ENVIARMSG.value)
+            self.__envia_resposta(self.__trata_pedido(comando, dados))
+
+    def __verifica_imagem(self, dados: Union[bytes, RecepcaoImagemSB]):
+        # sem executor, a imagem candidata é gravada na partição candidata e resumida na
+        # thread dos resumos, e a atualização é concluída no laço quando ela termina
+        self._poller.submete(ImagemSB.resumidor(), self.__prepara_candidata, dados, concluida=self.__conclui_atualizacao)
+
+    def __prepara_candidata(self, dados: Union[bytes, RecepcaoImagemSB]) -> Tuple[ImagemSBCandidato, bool]:
+        imagem_candidata = ImagemSBCandidato(dados, self.path_sb_candidato)
+        return imagem_candidata, imagem_candidata.esta_integro()
+
+    def __conclui_atualizacao(self, futuro):
+        imagem_candidata, integro = futuro.result()
+        with self.ms.transacao():
+            resposta = self.atualizar_sb(imagem_candidata, integro)
+        self.mt.sincroniza()
+        self.__envia_resposta(resposta)
+
+    def __trata_pedido(self, comando, dados) -> Union[str, None]:
+        # as escritas do pedido são gravadas de uma só vez antes do envio da resposta,
+        # assim como as autorizações da MT que o log ainda não sincronizou com o disco
+        with self.ms.transacao():
+            if comando == b'\x01':
+                resposta = self.processa_pedido(dados)
+            else:
+                resposta = self.atualizar_sb(dados)
+        self.mt.sincroniza()
+        return resposta
+
+    def __conclui_pedido(self, futuro):
+        self.__envia_resposta(futuro.result())
+
+    def __envia_resposta(self, resposta: Union[str, None]):
+        if resposta is not None:
+            self.inferior.envia(bytearray(resposta.encode()), TIPO_t.ENVIARMSG.value)
 
     def handle_timeout(self):
-        self.__processa_cancelarProcesso()
+        # com executor, o cancelamento entra na fila depois do pedido em andamento
+        if self.executor != None and self._poller != None:
+            self._poller.submete(self.executor, self.__cancela_por_timeout)
+        else:
+            self.__cancela_por_timeout()
+
+    def __cancela_por_timeout(self):
+        with self.ms.transacao():
+            self.__processa_cancelarProcesso()
 
     def recarrega_timeout(self, timeout:int):
         """ Define um novo valor de timeout e o recarrega
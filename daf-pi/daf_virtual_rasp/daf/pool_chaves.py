@@ -0,0 +1,76 @@
+from collections import deque
+from typing import Tuple
+
+from daf_virtual_rasp.com.poller import Callback
+from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, ChaveCripto
+
+
+class PoolChavesEC(Callback):
+
+    def __init__(self, capacidade: int = 8, lote: int = 1, intervalo: float = 0.05, nivel_reposicao: int = None):
+        """ Reserva de pares de chaves EC P-256 gerados com antecedência para o registro
+        do DAF. É um timer do despachante: sempre que o laço fica ocioso por 'intervalo'
+        segundos, gera até 'lote' pares, até atingir a capacidade. Retirar um par que deixa
+        a reserva abaixo do nível de reposição volta a armar o timer.
+
+        Args:
+            capacidade (int, optional): número máximo de pares mantidos. Defaults to 8.
+            lote (int, optional): pares gerados a cada disparo do timer. Defaults to 1.
+            intervalo (float, optional): tempo ocioso, em segundos, antes de cada lote. Defaults to 0.05.
+            nivel_reposicao (int, optional): a reposição recomeça quando a reserva fica abaixo deste nível. Defaults to a capacidade.
+
+        Raises:
+            ValueError: se a capacidade ou o lote não forem positivos
+        """
+        if capacidade < 1 or lote < 1:
+            raise ValueError("Capacidade e lote da reserva de chaves devem ser positivos")
+        Callback.__init__(self, None, intervalo)
+        self.capacidade = capacidade
+        self.lote = lote
+        self.nivel_reposicao = capacidade if nivel_reposicao == None else min(nivel_reposicao, capacidade)
+        self.chaves = deque()
+        self.geradas = 0
+        self.retiradas = 0
+        self.faltas = 0         # retiradas com a reserva vazia, em que o par foi gerado na hora
+
+    def handle_timeout(self):
+        for _ in range(min(self.lote, self.capacidade - len(self.chaves))):
+            self.chaves.append(CriptoDAF.gera_chave_EC_p256())
+            self.geradas += 1
+        if len(self.chaves) >= self.capacidade:
+            self.disable_timeout()
+
+    def preenche(self):
+        """ Completa a reserva imediatamente, sem esperar pelo laço ocioso
+        """
+        while len(self.chaves) < self.capacidade:
+            self.chaves.append(CriptoDAF.gera_chave_EC_p256())
+            self.geradas += 1
+        self.disable_timeout()
+
+    def retira(self) -> Tuple[ChaveCripto, ChaveCripto]:
+        """ Retira um par de chaves da reserva. Com a reserva vazia, o par é gerado na hora.
+
+        Returns:
+            Tuple[ChaveCripto, ChaveCripto]: chave privada e chave pública
+        """
+        self.retiradas += 1
+        if self.chaves:
+            par = self.chaves.popleft()
+        else:
+            self.faltas += 1
+            par = CriptoDAF.gera_chave_EC_p256()
+
+        if len(self.chaves) < self.nivel_reposicao and not self.timeout_enabled:
+            self.enable_timeout()
+            self.reload_timeout()
+        return par
+
+    def estatisticas(self) -> dict:
+        return {
+            'capacidade': self.capacidade,
+            'disponiveis': len(self.chaves),
+            'geradas': self.geradas,
+            'retiradas': self.retiradas,
+            'faltas': self.faltas
+        }
@@ -0,0 +1,150 @@
+import fcntl
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.com.poller_asyncio import PollerAsyncio
+from daf_virtual_rasp.hospedeiro import EspecificacaoDAF, HospedeiroDAF
+
+
+def executa_trabalhador(especificacoes: List[dict], usa_asyncio: bool, max_tentativas_arq: int, timeout_enq: float, timeout_arq: float, pool_chaves: int = 0, usa_executor: bool = False):
+    """ Ponto de entrada de um processo da frota: trava as memórias de seus DAFs
+    e os executa com um HospedeiroDAF.
+
+    Args:
+        especificacoes (List[dict]): DAFs do processo, como dicionários de EspecificacaoDAF
+        usa_asyncio (bool): usa o PollerAsyncio no lugar do Poller
+        max_tentativas_arq (int): número máximo de retransmissões da camada ARQ
+        timeout_enq (float): timeout da camada de Enquadramento
+        timeout_arq (float): timeout da camada ARQ
+        pool_chaves (int, optional): capacidade da reserva de pares de chaves do processo. Defaults to 0.
+        usa_executor (bool, optional): trata os pedidos em uma thread do processo, fora do laço. Defaults to False.
+    """
+    especificacoes = [EspecificacaoDAF.de_dicionario(dic) for dic in especificacoes]
+
+    travas = []
+    for espec in especificacoes:
+        for arquivo in (espec.ms, espec.mt):
+            dirname = os.path.dirname(arquivo)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            trava = open(arquivo + '.lock', 'w')
+            # falha se outro processo ainda estiver usando a memória
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            travas.append(trava)
+
+    pol = PollerAsyncio() if usa_asyncio else Poller()
+    executor = ThreadPoolExecutor(1) if usa_executor else None
+    HospedeiroDAF(especificacoes, pol, max_tentativas_arq, timeout_enq, timeout_arq, pool_chaves, executor).despache()
+
+
+class FrotaDAF:
+
+    INTERVALO_REINICIO = 1.0        # espera inicial (s) antes de reiniciar um processo que falhou
+    INTERVALO_REINICIO_MAX = 30.0
+    TEMPO_ESTAVEL = 60.0            # processo que executou por mais tempo que isso zera a espera
+
+    def __init__(self, especificacoes: List[EspecificacaoDAF], processos: int = None, usa_asyncio: bool = False, max_tentativas_arq: int = 3, timeout_enq: float = 0.5, timeout_arq: float = 2, pool_chaves: int = 0, usa_executor: bool = False):
+        """ Distribui DAFs virtuais entre vários processos, para que as operações
+        criptográficas de DAFs diferentes sejam executadas em paralelo. Cada processo
+        executa um HospedeiroDAF com sua parcela dos DAFs e é o único a acessar as
+        memórias deles. Processos que terminarem com erro são reiniciados.
+
+        Args:
+            especificacoes (List[EspecificacaoDAF]): DAFs a serem executados
+            processos (int, optional): número de processos. Defaults to o número de CPUs.
+            usa_asyncio (bool, optional): usa o PollerAsyncio em cada processo. Defaults to False.
+            max_tentativas_arq (int, optional): número máximo de retransmissões da camada ARQ. Defaults to 3.
+            timeout_enq (float, optional): timeout da camada de Enquadramento. Defaults to 0.5.
+            timeout_arq (float, optional): timeout da camada ARQ. Defaults to 2.
+            pool_chaves (int, optional): capacidade da reserva de pares de chaves de cada processo. Defaults to 0 (sem reserva).
+            usa_executor (bool, optional): cada processo trata os pedidos em uma thread, fora do laço. Defaults to False.
+
+        Raises:
+            ValueError: se dois DAFs compartilharem porta, socket, memória ou partição do SB
+        """
+        HospedeiroDAF.verifica_isolamento(especificacoes)
+
+        if processos == None:
+            processos = os.cpu_count() or 1
+        processos = max(1, min(processos, len(especificacoes)))
+
+        self.parcelas = FrotaDAF.reparte(especificacoes, processos)
+        self.parametros = (usa_asyncio, max_tentativas_arq, timeout_enq, timeout_arq, pool_chaves, usa_executor)
+        self.trabalhadores = [None] * len(self.parcelas)
+        self.inicio = [0.0] * len(self.parcelas)
+        self.espera = [self.INTERVALO_REINICIO] * len(self.parcelas)
+
+    @staticmethod
+    def reparte(especificacoes: List[EspecificacaoDAF], processos: int) -> List[List[EspecificacaoDAF]]:
+        """ Reparte os DAFs entre os processos de forma alternada
+
+        Args:
+            especificacoes (List[EspecificacaoDAF]): DAFs a serem executados
+            processos (int): número de processos
+
+        Returns:
+            List[List[EspecificacaoDAF]]: DAFs de cada processo
+        """
+        return [especificacoes[i::processos] for i in range(processos)]
+
+    def __inicia(self, i: int):
+        dics = [espec.para_dicionario() for espec in self.parcelas[i]]
+        p = multiprocessing.Process(target=executa_trabalhador, args=(dics,) + self.parametros,
+                                    name=f"daf-frota-{i}", daemon=True)
+        p.start()
+        self.trabalhadores[i] = p
+        self.inicio[i] = time.monotonic()
+
+    def executa(self):
+        """ Inicia os processos e os supervisiona até que todos terminem sem erro.
+        Um processo que termina com erro é reiniciado após uma espera que dobra a cada
+        falha seguida.
+        """
+        for i in range(len(self.parcelas)):
+            self.__inicia(i)
+
+        reinicios = {}      # índice do processo -> instante do reinício
+        try:
+            while any(p != None for p in self.trabalhadores) or reinicios:
+                timeout = None
+                if reinicios:
+                    timeout = max(0, min(reinicios.values()) - time.monotonic())
+
+                sentinelas = {p.sentinel: i for i, p in enumerate(self.trabalhadores) if p != None}
+                prontos = multiprocessing.connection.wait(list(sentinelas), timeout)
+
+                for s in prontos:
+                    i = sentinelas[s]
+                    p = self.trabalhadores[i]
+                    p.join()
+                    self.trabalhadores[i] = None
+                    if p.exitcode == 0:
+                        continue
+                    if time.monotonic() - self.inicio[i] > self.TEMPO_ESTAVEL:
+                        self.espera[i] = self.INTERVALO_REINICIO
+                    print(f"Processo {p.name} terminou com código {p.exitcode}, reiniciando em {self.espera[i]}s\n")
+                    reinicios[i] = time.monotonic() + self.espera[i]
+                    self.espera[i] = min(self.espera[i] * 2, self.INTERVALO_REINICIO_MAX)
+
+                agora = time.monotonic()
+                for i, instante in list(reinicios.items()):
+                    if instante <= agora:
+                        del reinicios[i]
+                        self.__inicia(i)
+        finally:
+            self.encerra()
+
+    def encerra(self):
+        """ Termina todos os processos da frota
+        """
+        for p in self.trabalhadores:
+            if p != None and p.is_alive():
+                p.terminate()
+        for p in self.trabalhadores:
+            if p != None:
+                p.join()
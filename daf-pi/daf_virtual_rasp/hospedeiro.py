@@ -0,0 +1,230 @@
+import json
+import os
+import shutil
+import socket
+from concurrent.futures import Executor
+from typing import List, Union
+
+import serial
+
+from daf_virtual_rasp.com.enquadramento import Enquadramento
+from daf_virtual_rasp.com.arq import Arq
+from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.com.poller_asyncio import PollerAsyncio
+from daf_virtual_rasp.daf.daf import DAF
+from daf_virtual_rasp.daf.pool_chaves import PoolChavesEC
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento
+from daf_virtual_rasp.particao_sb import ParticaoEmpacotada, converte_particao
+
+
+class EspecificacaoDAF:
+
+    def __init__(self, ms: str, mt: str, sb: str, porta: str = None, socket: str = None, sb_candidato: str = None, nome: str = None, armazenamento: str = TipoArmazenamento.tinydb.value, armazenamento_mt: str = None, opcoes_armazenamento_mt: dict = None):
+        """ Descreve um DAF virtual a ser executado pelo HospedeiroDAF.
+
+        Args:
+            ms (str): arquivo da memória segura do DAF
+            mt (str): arquivo da memória de trabalho do DAF
+            sb (str): partição do SB do DAF, um diretório ou um arquivo empacotado (extensão .sb)
+            porta (str, optional): pseudoterminal (ou porta serial) usado pelo DAF. Defaults to None.
+            socket (str, optional): socket Unix ao qual o DAF deve se conectar, alternativo à porta. Defaults to None.
+            sb_candidato (str, optional): local da imagem recebida em atualizações do SB. Defaults to '<sb>-candidato' (ou '<sb>-candidato.sb', com a partição empacotada).
+            nome (str, optional): nome do DAF nos logs. Defaults to a porta ou o socket.
+            armazenamento (str, optional): implementação do banco das memórias ('tinydb', 'sqlite' ou 'mmap', este apenas para a memória segura). Defaults to 'tinydb'.
+            armazenamento_mt (str, optional): implementação do banco da memória de trabalho, se diferente ('tinydb', 'sqlite' ou 'log'). Defaults to None.
+            opcoes_armazenamento_mt (dict, optional): opções do log da memória de trabalho (registros_por_sync, limiar_compactacao e minimo_compactacao). Defaults to None.
+
+        Raises:
+            ValueError: se não for informada exatamente uma entre porta e socket, se o armazenamento for desconhecido ou se houver opções para um armazenamento da memória de trabalho que não seja o log
+        """
+        if (porta == None) == (socket == None):
+            raise ValueError("Informe a porta ou o socket do DAF (apenas um deles).")
+
+        self.ms = ms
+        self.mt = mt
+        self.sb = sb
+        self.porta = porta
+        self.socket = socket
+        if sb_candidato == None:
+            raiz, extensao = os.path.splitext(sb.rstrip('/'))
+            sb_candidato = raiz + '-candidato' + extensao if extensao == ParticaoEmpacotada.EXTENSAO else sb.rstrip('/') + '-candidato'
+        self.sb_candidato = sb_candidato
+        self.nome = nome if nome != None else (porta if porta != None else socket)
+        self.armazenamento = TipoArmazenamento(armazenamento)
+        self.armazenamento_mt = TipoArmazenamento(armazenamento_mt) if armazenamento_mt != None else None
+        if opcoes_armazenamento_mt and (self.armazenamento_mt if self.armazenamento_mt != None else self.armazenamento) != TipoArmazenamento.log:
+            raise ValueError(f"As opções do armazenamento da memória de trabalho do DAF {self.nome} exigem \"armazenamento_mt\": \"log\".")
+        self.opcoes_armazenamento_mt = opcoes_armazenamento_mt
+
+    @staticmethod
+    def de_dicionario(dic: dict) -> 'EspecificacaoDAF':
+        """ Cria a especificação a partir de um dicionário com as mesmas chaves dos argumentos do construtor
+
+        Args:
+            dic (dict): especificação do DAF
+
+        Returns:
+            EspecificacaoDAF: especificação do DAF
+        """
+        return EspecificacaoDAF(**dic)
+
+    def para_dicionario(self) -> dict:
+        return {
+            'ms': self.ms,
+            'mt': self.mt,
+            'sb': self.sb,
+            'porta': self.porta,
+            'socket': self.socket,
+            'sb_candidato': self.sb_candidato,
+            'nome': self.nome,
+            'armazenamento': self.armazenamento.value,
+            'armazenamento_mt': self.armazenamento_mt.value if self.armazenamento_mt != None else None,
+            'opcoes_armazenamento_mt': self.opcoes_armazenamento_mt
+        }
+
+
+class PilhaDAF:
+
+    PARTICAO_FABRICA = './daf_virtual_rasp/resources/imagem/sb'    # SB gravado "em tempo de manufatura"
+
+    def __init__(self, espec: EspecificacaoDAF, max_tentativas_arq: int = 3, timeout_enq: float = 0.5, timeout_arq: float = 2, pool_chaves: PoolChavesEC = None, executor: Executor = None):
+        """ Pilha Enquadramento/ARQ/DAF isolada de um DAF virtual
+
+        Args:
+            espec (EspecificacaoDAF): especificação do DAF
+            max_tentativas_arq (int, optional): número máximo de retransmissões da camada ARQ. Defaults to 3.
+            timeout_enq (float, optional): timeout da camada de Enquadramento. Defaults to 0.5.
+            timeout_arq (float, optional): timeout da camada ARQ. Defaults to 2.
+            pool_chaves (PoolChavesEC, optional): reserva de pares de chaves usada no registro do DAF. Defaults to None.
+            executor (Executor, optional): executor no qual o DAF trata seus pedidos, fora do laço. Defaults to None.
+        """
+        self.espec = espec
+        self.__prepara_particao(espec.sb)
+        self.conexao = self.__abre_conexao(espec)
+
+        self.daf = DAF(espec.ms, espec.mt, espec.sb, espec.sb_candidato, armazenamento=espec.armazenamento, armazenamento_mt=espec.armazenamento_mt, opcoes_armazenamento_mt=espec.opcoes_armazenamento_mt, pool_chaves=pool_chaves, executor=executor)
+        self.arq = Arq(max_tentativas_arq, timeout_arq)
+        # imagens do SB são gravadas na partição candidata à medida que chegam
+        self.enquadramento = Enquadramento(self.conexao, timeout_enq, leitura_em_bloco=True, receptor_binario=self.daf.nova_recepcao_sb)
+
+        # define organização das subcamadas
+        self.daf.set_inferior(self.arq)
+        self.arq.set_superior(self.daf)
+        self.arq.set_inferior(self.enquadramento)
+        self.enquadramento.set_superior(self.arq)
+
+    def __prepara_particao(self, path_sb: str):
+        """ Grava a imagem de fábrica na partição do SB caso ela ainda não exista
+
+        Args:
+            path_sb (str): partição do SB do DAF
+        """
+        if ParticaoEmpacotada.eh_empacotada(path_sb):
+            if not os.path.isfile(path_sb):
+                converte_particao(self.PARTICAO_FABRICA, path_sb)
+        elif not os.path.isfile(os.path.join(path_sb, 'codigo.bin')):
+            shutil.copytree(self.PARTICAO_FABRICA, path_sb, dirs_exist_ok=True)
+
+    def __abre_conexao(self, espec: EspecificacaoDAF):
+        if espec.porta != None:
+            ser = serial.Serial(
+                port=espec.porta,
+                baudrate=115200,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize=serial.EIGHTBITS,
+                timeout=None
+            )
+            ser.flush()
+            return ser
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(espec.socket)
+        return sock.makefile('rwb', buffering=0)
+
+    def adiciona(self, pol: Union[Poller, PollerAsyncio]):
+        """ Registra as camadas da pilha no despachante
+
+        Args:
+            pol (Union[Poller, PollerAsyncio]): despachante compartilhado
+        """
+        pol.adiciona(self.daf)
+        pol.adiciona(self.enquadramento)
+        pol.adiciona(self.arq)
+
+    def fecha(self):
+        self.conexao.close()
+
+
+class HospedeiroDAF:
+
+    def __init__(self, especificacoes: List[EspecificacaoDAF], pol: Union[Poller, PollerAsyncio] = None, max_tentativas_arq: int = 3, timeout_enq: float = 0.5, timeout_arq: float = 2, pool_chaves: int = 0, executor: Executor = None):
+        """ Executa vários DAF virtuais em um único processo, cada um com sua
+        própria pilha de camadas, memórias e partição do SB, todos sobre o mesmo despachante.
+
+        Args:
+            especificacoes (List[EspecificacaoDAF]): DAFs a serem executados
+            pol (Union[Poller, PollerAsyncio], optional): despachante compartilhado. Defaults to um novo Poller.
+            max_tentativas_arq (int, optional): número máximo de retransmissões da camada ARQ. Defaults to 3.
+            timeout_enq (float, optional): timeout da camada de Enquadramento. Defaults to 0.5.
+            timeout_arq (float, optional): timeout da camada ARQ. Defaults to 2.
+            pool_chaves (int, optional): capacidade da reserva de pares de chaves, compartilhada pelos DAFs e reposta quando o despachante está ocioso. Defaults to 0 (sem reserva).
+            executor (Executor, optional): executor com uma única thread, compartilhado pelos DAFs, no qual os pedidos são tratados enquanto o despachante segue atendendo o enquadramento e o ARQ. Defaults to None.
+
+        Raises:
+            ValueError: se dois DAFs compartilharem porta, socket, memória ou partição do SB
+        """
+        HospedeiroDAF.verifica_isolamento(especificacoes)
+
+        self.pol = pol if pol != None else Poller()
+        self.pool_chaves = None
+        if pool_chaves > 0:
+            self.pool_chaves = PoolChavesEC(pool_chaves)
+            self.pol.adiciona(self.pool_chaves)
+        self.pilhas = []
+        for espec in especificacoes:
+            pilha = PilhaDAF(espec, max_tentativas_arq, timeout_enq, timeout_arq, self.pool_chaves, executor)
+            pilha.adiciona(self.pol)
+            self.pilhas.append(pilha)
+
+    @staticmethod
+    def verifica_isolamento(especificacoes: List[EspecificacaoDAF]):
+        """ Garante que nenhum recurso (porta, socket, MS, MT e SB) seja usado por mais de um DAF
+
+        Args:
+            especificacoes (List[EspecificacaoDAF]): DAFs a serem executados
+
+        Raises:
+            ValueError: se algum recurso for compartilhado
+        """
+        em_uso = {}
+        for espec in especificacoes:
+            for recurso in (espec.porta, espec.socket, espec.ms, espec.mt, espec.sb, espec.sb_candidato):
+                if recurso == None:
+                    continue
+                if recurso in em_uso:
+                    raise ValueError(f"{recurso} usado por {em_uso[recurso]} e {espec.nome}")
+                em_uso[recurso] = espec.nome
+
+    @staticmethod
+    def carrega_especificacoes(arquivo: str) -> List[EspecificacaoDAF]:
+        """ Lê as especificações dos DAFs de um arquivo JSON contendo uma lista de objetos
+
+        Args:
+            arquivo (str): arquivo JSON
+
+        Returns:
+            List[EspecificacaoDAF]: especificações lidas
+        """
+        with open(arquivo) as f:
+            return [EspecificacaoDAF.de_dicionario(dic) for dic in json.load(f)]
+
+    def despache(self):
+        """ Despacha todas as pilhas até que nenhuma possa mais gerar eventos
+        """
+        self.pol.despache()
+
+    def fecha(self):
+        for pilha in self.pilhas:
+            pilha.fecha()
+        self.pol.fecha()
@@ -1,8 +1,16 @@
 import typing
 import os
+import hashlib
+import hmac
+import shutil
+import tempfile
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from daf_virtual_rasp.utils.cripto_daf import ChaveCripto, CriptoDAF
 from daf_virtual_rasp.daf.daf_enums import Artefatos
 from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
+from daf_virtual_rasp.particao_sb import ParticaoEmpacotada
 
 class ImagemSB:
 
@@ -14,21 +22,29 @@ class ImagemSB:
     ASSINATURA_ATESTE_TAMANHO = 103 #103
     CODIGO_TAMANHO = 2048 
 
+    # o código é resumido em blocos deste tamanho, sem montar a imagem inteira em memória
+    BLOCO_RESUMO = 1 << 20
+
+    # thread que calcula os resumos, criada no primeiro uso
+    RESUMIDOR = None
+
     def __init__(self, raw_binario: bytes = b'', path_arquivos: str = './daf_virtual_rasp/resources/imagem/sb'):
         """Inicialização da imagem do SB.
 
         Args:
             raw_binario (bytes, optional): Preencher com a imagem caso deseja-se inserir uma nova imagem na partição do SB. Defaults to b''.
-            path_arquivos (str, optional): Local da partição, isto é, onde a imagem será salva. Defaults to './daf_virtual_rasp/resources/imagem/sb'.
+            path_arquivos (str, optional): Local da partição, isto é, onde a imagem será salva. Um diretório (um arquivo por campo) ou um arquivo empacotado (extensão .sb, ver ParticaoEmpacotada). Defaults to './daf_virtual_rasp/resources/imagem/sb'.
 
         Raises:
             ValueError: Se a partição do SB estiver vazia e o parâmetro raw_binario não for especificado. Teoricamente, essa partição não deve estar vazia em nenhuma situação, pois o SB é inserido em tempo de manufatura e depois disso essa partição ou é apenas atualizada/sobreescrita.
         """
 
         self.path_arquivos = path_arquivos
+        self.empacotada = ParticaoEmpacotada.eh_empacotada(path_arquivos)
+        self.particao = None
 
         # cria pasta se nao existe ainda
-        if not os.path.isdir(self.path_arquivos):
+        if not self.empacotada and not os.path.isdir(self.path_arquivos):
             os.makedirs(self.path_arquivos)
 
         if len(raw_binario) == 0:
@@ -37,6 +53,20 @@ class ImagemSB:
             if self.particao_vazia() == True:
                 raise ValueError(
                     "Partição está vázia e parâmetro raw_binario está vázio.")
+            if self.empacotada:
+                self.particao = ParticaoEmpacotada(self.path_arquivos)
+
+        elif self.empacotada:
+            # imagem sendo adicionada agora, gravada de uma só vez no arquivo da partição
+            print("Versão recebida: " ,int.from_bytes(self._extrai_versao(raw_binario),byteorder='big'), "\n")
+            self._grava_particao({
+                'versao': self._extrai_versao(raw_binario),
+                'maxdfe': self._extrai_maxdfe(raw_binario),
+                'hash': self._extrai_hash(raw_binario),
+                'assinatura': self._extrai_assinatura(raw_binario),
+                'assinatura_ateste': self._extrai_assinatura_ateste(raw_binario),
+                'codigo': self._extrai_codigo(raw_binario)
+            })
 
         else:
             # imagem sendo adicionada agora
@@ -82,19 +112,40 @@ class ImagemSB:
         offset = self.VERSAO_TAMANHO + self.MAXDFE_TAMANHO + self.HASH_TAMANHO + self.ASSINATURA_TAMANHO + self.ASSINATURA_ATESTE_TAMANHO 
         return raw_binario[offset:]
 
+    # acesso aos campos na partição
+
+    def _grava_particao(self, campos: dict):
+        """ Grava a partição empacotada, mantendo os campos não informados
+        """
+        for campo in ParticaoEmpacotada.CAMPOS:
+            if not campo in campos:
+                campos[campo] = self.particao.campo(campo) if self.particao != None else b''
+        ParticaoEmpacotada.grava(self.path_arquivos, campos)
+        self.particao = ParticaoEmpacotada(self.path_arquivos)
+
+    def _grava_campo(self, campo: str, arquivo: str, valor: bytes) -> None:
+        if self.empacotada:
+            self._grava_particao({campo: valor})
+        else:
+            with open(arquivo, "wb") as f:
+                f.write(valor)
+
+    def _le_campo(self, campo: str, arquivo: str) -> bytes:
+        if self.particao != None:
+            return bytes(self.particao.campo(campo))
+        with open(arquivo, "rb") as f:
+            return f.read()
+
     # get/set versao
 
     def _arquivo_versao(self) -> str:
         return f"{self.path_arquivos}/versao.str"
 
     def _set_versao(self, versao: bytes) -> None:
-        with open(self._arquivo_versao(), "wb") as arquivo:
-            arquivo.write(versao)
+        self._grava_campo('versao', self._arquivo_versao(), versao)
 
     def get_versao_SB(self) -> bytes:
-        with open(self._arquivo_versao(), "rb") as arquivo:
-            versao = arquivo.read()
-        return versao
+        return self._le_campo('versao', self._arquivo_versao())
 
     # get/set maxfde
 
@@ -102,13 +153,10 @@ class ImagemSB:
         return f"{self.path_arquivos}/maxdfe.str"
 
     def _set_maxdfe(self, maxdfe: bytes) -> None:
-        with open(self._arquivo_maxdfe(), "wb") as arquivo:
-            arquivo.write(maxdfe)
+        self._grava_campo('maxdfe', self._arquivo_maxdfe(), maxdfe)
 
     def get_maxdfe(self) -> bytes:
-        with open(self._arquivo_maxdfe(), "rb") as arquivo:
-            maxdfe = arquivo.read()
-        return maxdfe        
+        return self._le_campo('maxdfe', self._arquivo_maxdfe())        
 
     # get/set hash
 
@@ -116,13 +164,10 @@ class ImagemSB:
         return f"{self.path_arquivos}/hash.bin"
 
     def _set_hash(self, hash: bytes) -> None:
-        with open(self._arquivo_hash(), "wb") as arquivo:
-            arquivo.write(hash)
+        self._grava_campo('hash', self._arquivo_hash(), hash)
 
     def get_hash_SB(self) -> bytes:
-        with open(self._arquivo_hash(), "rb") as arquivo:
-            hash = arquivo.read()
-        return hash
+        return self._le_campo('hash', self._arquivo_hash())
 
     # get/set assinatura
 
@@ -130,13 +175,10 @@ class ImagemSB:
         return f"{self.path_arquivos}/assinatura.bin"
 
     def _set_assinatura(self, assinatura: bytes) -> None:
-        with open(self._arquivo_assinatura(), "wb") as arquivo:
-            arquivo.write(assinatura)
+        self._grava_campo('assinatura', self._arquivo_assinatura(), assinatura)
 
     def get_assinatura(self) -> bytes:
-        with open(self._arquivo_assinatura(), "rb") as arquivo:
-            assinatura = arquivo.read()
-        return assinatura
+        return self._le_campo('assinatura', self._arquivo_assinatura())
 
     # get/set assinatura ateste
 
@@ -144,13 +186,10 @@ class ImagemSB:
         return f"{self.path_arquivos}/assinatura_ateste.bin"
 
     def _set_assinatura_ateste(self, assinatura: bytes)-> None:
-        with open(self._arquivo_assinatura_ateste(), "wb") as arquivo:
-            arquivo.write(assinatura)
+        self._grava_campo('assinatura_ateste', self._arquivo_assinatura_ateste(), assinatura)
     
     def get_assinatura_ateste(self)->bytes:
-        with open(self._arquivo_assinatura_ateste(), "rb") as arquivo:
-            assinatura = arquivo.read()
-        return assinatura
+        return self._le_campo('assinatura_ateste', self._arquivo_assinatura_ateste())
 
     # get/set codigo
 
@@ -158,30 +197,80 @@ class ImagemSB:
         return f"{self.path_arquivos}/codigo.bin"
 
     def _set_codigo(self, codigo: bytes) -> None:
-        with open(self._arquivo_codigo(), "wb") as arquivo:
-            arquivo.write(codigo)
+        self._grava_campo('codigo', self._arquivo_codigo(), codigo)
 
-    def get_codigo(self) -> bytes:
-        
-        with open(self._arquivo_codigo(), "rb") as arquivo:
-            codigo = arquivo.read()
-        
-        return codigo
+    def get_codigo(self) -> typing.Union[bytes, memoryview]:
+        # na partição empacotada, o código é uma fatia do arquivo mapeado, sem cópia
+        if self.particao != None:
+            return self.particao.campo('codigo')
+        return self._le_campo('codigo', self._arquivo_codigo())
 
     # particao
 
     def remove_particao(self) -> None:
-        os.remove(self._arquivo_codigo())
+        if self.empacotada:
+            self.particao = None
+            os.remove(self.path_arquivos)
+        else:
+            os.remove(self._arquivo_codigo())
 
     def particao_vazia(self) -> bool:
-        particaoExiste = os.path.isfile(self._arquivo_codigo())
+        particaoExiste = os.path.isfile(self.path_arquivos if self.empacotada else self._arquivo_codigo())
         return not particaoExiste
 
     # verificacoes
 
+    @staticmethod
+    def resumidor() -> ThreadPoolExecutor:
+        """ Thread única que calcula os resumos das imagens. O hashlib libera o GIL ao
+        resumir blocos grandes; submetido com Poller.submete, o resumo de uma imagem de
+        vários megabytes não bloqueia o laço do despachante (ver DAF.notifica).
+
+        Returns:
+            ThreadPoolExecutor: executor dos resumos
+        """
+        if ImagemSB.RESUMIDOR == None:
+            ImagemSB.RESUMIDOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='resumo-sb')
+        return ImagemSB.RESUMIDOR
+
+    def _blocos_codigo(self) -> typing.Iterator[typing.Union[bytes, memoryview]]:
+        """ Percorre o código em blocos de BLOCO_RESUMO bytes. Na partição empacotada os
+        blocos são fatias do arquivo mapeado; no diretório, o arquivo é lido sempre no
+        mesmo buffer.
+
+        Returns:
+            Iterator[Union[bytes, memoryview]]: blocos do código, válidos até o próximo
+        """
+        if self.particao != None:
+            codigo = self.particao.campo('codigo')
+            for inicio in range(0, len(codigo), self.BLOCO_RESUMO):
+                yield codigo[inicio: inicio + self.BLOCO_RESUMO]
+            return
+
+        buffer = bytearray(self.BLOCO_RESUMO)
+        visao = memoryview(buffer)
+        with open(self._arquivo_codigo(), 'rb', buffering=0) as f:
+            while True:
+                lidos = f.readinto(buffer)
+                if not lidos:
+                    break
+                yield visao[:lidos]
+
+    def resumo_SHA256(self) -> bytes:
+        """ Resumo SHA-256 de versão + código + maxdfe, calculado em blocos, de modo que a
+        memória usada não depende do tamanho do código
+
+        Returns:
+            bytes: resumo da imagem
+        """
+        resumo = hashlib.sha256(self.get_versao_SB())
+        for bloco in self._blocos_codigo():
+            resumo.update(bloco)
+        resumo.update(self.get_maxdfe())
+        return resumo.digest()
+
     def esta_integro(self) -> bool:
-        res = CriptoDAF.verifica_resumo_SHA256((self.get_versao_SB()+self.get_codigo()+self.get_maxdfe()) ,self.get_hash_SB())
-        return res
+        return hmac.compare_digest(self.resumo_SHA256(), self.get_hash_SB())
 
     def esta_autentico(self, certificado) -> bool:
         msg = self.get_assinatura_ateste()
@@ -193,9 +282,21 @@ class ImagemSB:
 
     # ---
 
-    def atualizar(self, novaImagem: 'ImagemSB', certificado, ateste) -> int:
-      
-        if not novaImagem.esta_integro() or not novaImagem.esta_autentico(certificado):
+    def atualizar(self, novaImagem: 'ImagemSB', certificado, ateste, integro: bool = None) -> int:
+        """ Valida a nova imagem
+
+        Args:
+            novaImagem (ImagemSB): imagem candidata
+            certificado: certificado da SEF
+            ateste: chave pública de ateste
+            integro (bool, optional): resultado de novaImagem.esta_integro() já calculado (ex: na thread dos resumos). Defaults to None (calculado aqui).
+
+        Returns:
+            int: 0 em caso de sucesso, ou o código do erro
+        """
+        if integro == None:
+            integro = novaImagem.esta_integro()
+        if not integro or not novaImagem.esta_autentico(certificado):
             return 3
 
         if not novaImagem.esta_autentico_ateste(ateste):
@@ -217,8 +318,237 @@ class ImagemSB:
         return 0
 
 
+class RecepcaoImagemSB:
+
+    # versão, maxdfe, hash, assinatura e assinatura do ateste, que precedem o código na imagem
+    CABECALHO_TAMANHO = ImagemSB.VERSAO_TAMANHO + ImagemSB.MAXDFE_TAMANHO + ImagemSB.HASH_TAMANHO + ImagemSB.ASSINATURA_TAMANHO + ImagemSB.ASSINATURA_ATESTE_TAMANHO
+
+    # os blocos da serial são acumulados até este tamanho antes de ir para a thread dos resumos
+    BLOCO_ENVIO = 64 * 1024
+    # blocos aguardando a thread dos resumos; acima disso, a leitura da serial é suspensa
+    LIMITE_PENDENTES = 8
+
+    def __init__(self, destino: str = './daf_virtual_rasp/resources/outra-imagem/sb', poller = None):
+        """ Recebe uma imagem do SB em blocos, à medida que chega pela serial. O cabeçalho
+        (menos de 300 bytes) fica em memória e o código é gravado em um arquivo temporário
+        na partição de destino, enquanto o resumo SHA-256 de versão + código + maxdfe é
+        calculado. A gravação e o resumo do código são feitos na thread dos resumos (ver
+        ImagemSB.resumidor()), fora do laço do despachante. Ao fim da recepção a integridade
+        já está calculada, e a memória usada não depende do tamanho da imagem.
+
+        Com um poller, a recepção nunca espera pela thread dos resumos no laço: quem lê a
+        serial consulta pausa_leitura() e suspende a leitura enquanto houver blocos demais
+        pendentes. Sem poller, a própria recepção espera pela thread.
+
+        Args:
+            destino (str, optional): partição onde a imagem candidata será gravada. Defaults to './daf_virtual_rasp/resources/outra-imagem/sb'.
+            poller (Poller, optional): despachante em cujo laço a recepção é feita. Defaults to None.
+        """
+        self.destino = destino
+        self.poller = poller
+        # com uma partição empacotada, o código é recebido no diretório do arquivo da partição
+        diretorio = (os.path.dirname(destino) or '.') if ParticaoEmpacotada.eh_empacotada(destino) else destino
+        if not os.path.isdir(diretorio):
+            os.makedirs(diretorio)
+
+        self.cabecalho = bytearray()
+        self.tamanho = 0
+        self.resumo_imagem = None
+        self.__resumo = hashlib.sha256()
+        self.__acumulado = bytearray()
+        self.__pendentes = deque()
+        self.__retomada = None      # (função, número de pendentes abaixo do qual a leitura é retomada)
+        self.__erro = None          # primeira falha da thread dos resumos
+
+        descritor, self.arquivo_codigo = tempfile.mkstemp(prefix='codigo.', suffix='.recebendo', dir=diretorio)
+        self.__codigo = os.fdopen(descritor, 'wb')
+        # o arquivo temporário é removido se a recepção for descartada (ex: quadro repetido)
+        self.__remocao = weakref.finalize(self, RecepcaoImagemSB.__descarta, self.__codigo, self.arquivo_codigo)
+
+    @staticmethod
+    def __descarta(codigo, arquivo: str):
+        codigo.close()
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+
+    @staticmethod
+    def __processa(resumo, codigo, bloco: bytes):
+        resumo.update(bloco)
+        codigo.write(bloco)
+
+    def __envia(self):
+        """ Entrega o código acumulado à thread dos resumos
+        """
+        if len(self.__acumulado) == 0:
+            return
+        bloco = bytes(self.__acumulado)
+        self.__acumulado.clear()
+        if self.poller != None:
+            self.__pendentes.append(self.poller.submete(ImagemSB.resumidor(), RecepcaoImagemSB.__processa, self.__resumo, self.__codigo, bloco, concluida=self.__bloco_tratado))
+            return
+        self.__pendentes.append(ImagemSB.resumidor().submit(RecepcaoImagemSB.__processa, self.__resumo, self.__codigo, bloco))
+        while len(self.__pendentes) > self.LIMITE_PENDENTES:
+            self.__recolhe(self.__pendentes.popleft())
+
+    def __recolhe(self, pendente: Future):
+        """ Espera um bloco pendente, guardando a primeira falha para conclui()
+        """
+        if not pendente.cancelled() and pendente.exception() != None and self.__erro == None:
+            self.__erro = pendente.exception()
+
+    def __bloco_tratado(self, futuro: Future):
+        """ Chamado no laço do despachante quando a thread dos resumos termina um bloco
+        """
+        while self.__pendentes and self.__pendentes[0].done():
+            self.__recolhe(self.__pendentes.popleft())
+        if self.__retomada != None and len(self.__pendentes) <= self.__retomada[1]:
+            retomada = self.__retomada[0]
+            self.__retomada = None
+            retomada()
+
+    def pausa_leitura(self, retomada: typing.Callable[[], None], final: bool = False) -> bool:
+        """ Indica se quem lê a serial deve suspender a leitura até que a thread dos resumos
+        trate os blocos pendentes. Nesse caso, retomada() é chamada no laço do despachante
+        quando a leitura puder continuar.
+
+        Args:
+            retomada (Callable[[], None]): função que retoma a leitura
+            final (bool, optional): a imagem terminou; espera todos os blocos antes de conclui(). Defaults to False.
+
+        Returns:
+            bool: Verdadeiro se a leitura deve ser suspensa
+        """
+        if self.poller == None:
+            return False
+        if final:
+            self.__envia()
+            limite = 0
+        else:
+            limite = self.LIMITE_PENDENTES
+        if len(self.__pendentes) <= limite:
+            return False
+        self.__retomada = (retomada, limite if final else self.LIMITE_PENDENTES // 2)
+        return True
+
+    def __aguarda(self):
+        """ Espera a thread dos resumos tratar todo o código já recebido
+        """
+        self.__envia()
+        while self.__pendentes:
+            self.__recolhe(self.__pendentes.popleft())
+        if self.__erro != None:
+            raise self.__erro
+
+    def adiciona(self, bloco: bytes):
+        """ Trata um bloco da imagem recebido
+
+        Args:
+            bloco (bytes): bytes seguintes da imagem
+        """
+        self.tamanho += len(bloco)
+        falta = self.CABECALHO_TAMANHO - len(self.cabecalho)
+        if falta > 0:
+            self.cabecalho += bloco[:falta]
+            bloco = bloco[falta:]
+            if len(self.cabecalho) == self.CABECALHO_TAMANHO:
+                self.__resumo.update(self.get_versao_SB())
+        if len(bloco) > 0:
+            self.__acumulado += bloco
+            if len(self.__acumulado) >= self.BLOCO_ENVIO:
+                self.__envia()
+
+    def conclui(self):
+        """ Encerra a recepção, fechando o arquivo do código e calculando o resumo da imagem
+        """
+        self.__aguarda()
+        self.__codigo.close()
+        if len(self.cabecalho) < self.CABECALHO_TAMANHO:
+            # imagem truncada: não tem código
+            self.__resumo.update(self.get_versao_SB())
+        self.__resumo.update(self.get_maxdfe())
+        self.resumo_imagem = self.__resumo.digest()
+
+    def __campo(self, offset: int, tamanho: int) -> bytes:
+        return bytes(self.cabecalho[offset: offset + tamanho])
+
+    def get_versao_SB(self) -> bytes:
+        return self.__campo(0, ImagemSB.VERSAO_TAMANHO)
+
+    def get_maxdfe(self) -> bytes:
+        return self.__campo(ImagemSB.VERSAO_TAMANHO, ImagemSB.MAXDFE_TAMANHO)
+
+    def get_hash_SB(self) -> bytes:
+        return self.__campo(ImagemSB.VERSAO_TAMANHO + ImagemSB.MAXDFE_TAMANHO, ImagemSB.HASH_TAMANHO)
+
+    def get_assinatura(self) -> bytes:
+        return self.__campo(ImagemSB.VERSAO_TAMANHO + ImagemSB.MAXDFE_TAMANHO + ImagemSB.HASH_TAMANHO, ImagemSB.ASSINATURA_TAMANHO)
+
+    def get_assinatura_ateste(self) -> bytes:
+        return self.__campo(self.CABECALHO_TAMANHO - ImagemSB.ASSINATURA_ATESTE_TAMANHO, ImagemSB.ASSINATURA_ATESTE_TAMANHO)
+
+    def move_codigo(self, arquivo: str):
+        """ Move o código recebido para o arquivo informado, sem copiá-lo quando ambos estão no mesmo sistema de arquivos
+
+        Args:
+            arquivo (str): arquivo de destino do código
+        """
+        shutil.move(self.arquivo_codigo, arquivo)
+        self.__remocao.detach()
+
+    def descarta(self):
+        """ Remove o arquivo temporário do código
+        """
+        self.__acumulado.clear()
+        self.__retomada = None
+        while self.__pendentes:
+            pendente = self.__pendentes.popleft()
+            if not pendente.cancel():
+                pendente.exception()
+        self.__remocao()
+
+
 class ImagemSBCandidato(ImagemSB):
 
-    def __init__(self, raw_binario: bytes = b'', pathArquivos: str = './daf_virtual_rasp/resources/outra-imagem/sb'):
+    def __init__(self, raw_binario: typing.Union[bytes, RecepcaoImagemSB] = b'', pathArquivos: str = './daf_virtual_rasp/resources/outra-imagem/sb'):
+        """ Imagem recebida em uma atualização do SB
+
+        Args:
+            raw_binario (Union[bytes, RecepcaoImagemSB], optional): imagem recebida, inteira ou já recebida em blocos. Defaults to b''.
+            pathArquivos (str, optional): local da partição candidata. Defaults to './daf_virtual_rasp/resources/outra-imagem/sb'.
+        """
+        self.resumo_recebido = None
+        if not isinstance(raw_binario, RecepcaoImagemSB):
+            super().__init__(raw_binario, pathArquivos)
+            return
+
+        # recebida em blocos: o código já está gravado e o resumo já foi calculado
+        self.path_arquivos = pathArquivos
+        self.empacotada = ParticaoEmpacotada.eh_empacotada(pathArquivos)
+        self.particao = None
+        print("Versão recebida: " ,int.from_bytes(raw_binario.get_versao_SB(),byteorder='big'), "\n")
+        if self.empacotada:
+            with open(raw_binario.arquivo_codigo, 'rb') as codigo:
+                self._grava_particao({
+                    'versao': raw_binario.get_versao_SB(),
+                    'maxdfe': raw_binario.get_maxdfe(),
+                    'hash': raw_binario.get_hash_SB(),
+                    'assinatura': raw_binario.get_assinatura(),
+                    'assinatura_ateste': raw_binario.get_assinatura_ateste(),
+                    'codigo': codigo
+                })
+            raw_binario.descarta()
+        else:
+            if not os.path.isdir(self.path_arquivos):
+                os.makedirs(self.path_arquivos)
+            self._set_versao(raw_binario.get_versao_SB())
+            self._set_maxdfe(raw_binario.get_maxdfe())
+            self._set_hash(raw_binario.get_hash_SB())
+            self._set_assinatura(raw_binario.get_assinatura())
+            self._set_assinatura_ateste(raw_binario.get_assinatura_ateste())
+            raw_binario.move_codigo(self._arquivo_codigo())
+        self.resumo_recebido = raw_binario.resumo_imagem
 
-        super().__init__(raw_binario, pathArquivos)
+    def esta_integro(self) -> bool:
+        if self.resumo_recebido != None:
+            return hmac.compare_digest(self.resumo_recebido, self.get_hash_SB())
+        return super().esta_integro()
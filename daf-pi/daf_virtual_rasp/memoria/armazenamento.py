@@ -0,0 +1,264 @@
+import json
+import os
+import tempfile
+from enum import Enum
+from typing import Dict, Any, List, Optional, Tuple
+
+from tinydb import TinyDB
+from tinydb.storages import Storage
+
+from daf_virtual_rasp.memoria.autorizacao import AutorizacaoDFE
+
+
+class TipoArmazenamento(Enum):
+    tinydb = "tinydb"       # arquivo JSON gerenciado pelo TinyDB
+    sqlite = "sqlite"       # banco sqlite3 em modo WAL
+    log = "log"             # log somente de acréscimos (apenas memória de trabalho)
+    mmap = "mmap"           # registro binário de leiaute fixo mapeado em memória (apenas memória segura)
+
+
+class ArmazenamentoAtomico(Storage):
+
+    def __init__(self, path: str, **kwargs):
+        """ Armazenamento do TinyDB em arquivo JSON que nunca deixa o arquivo
+        parcialmente gravado: cada escrita é feita em um arquivo temporário no mesmo
+        diretório, sincronizada com o disco e então renomeada sobre o arquivo original.
+
+        Args:
+            path (str): arquivo .json do banco
+            kwargs: argumentos repassados ao json.dumps
+        """
+        super().__init__()
+        self.path = path
+        self.kwargs = kwargs
+
+        if not os.path.exists(path):
+            with open(path, 'a'):
+                pass
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        with open(self.path) as arquivo:
+            conteudo = arquivo.read()
+
+        if not conteudo:
+            return None
+        return json.loads(conteudo)
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, temporario = tempfile.mkstemp(prefix='.' + os.path.basename(self.path) + '.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as arquivo:
+                arquivo.write(json.dumps(data, **self.kwargs))
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+            os.replace(temporario, self.path)
+        except:
+            os.unlink(temporario)
+            raise
+
+        # garante que a renomeação também chegou ao disco
+        fd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class ArmazenamentoMS:
+    """ Interface dos armazenamentos da memória segura, que guardam um único registro
+    (dicionário com todos os campos da MS)
+    """
+
+    def carrega(self) -> Optional[Dict[str, Any]]:
+        """ Lê o registro armazenado
+
+        Returns:
+            Optional[Dict[str, Any]]: registro, ou None se o armazenamento estiver vazio
+        """
+        raise NotImplementedError()
+
+    def inicia(self, registro: Dict[str, Any]):
+        """ Substitui todo o conteúdo do armazenamento pelo registro
+
+        Args:
+            registro (Dict[str, Any]): registro completo da MS
+        """
+        raise NotImplementedError()
+
+    def grava(self, campos: Dict[str, Any]):
+        """ Atualiza atomicamente um ou mais campos do registro
+
+        Args:
+            campos (Dict[str, Any]): campos alterados e seus novos valores
+        """
+        raise NotImplementedError()
+
+    def valida(self, campos: Dict[str, Any]):
+        """ Verifica, sem gravar, se os campos podem ser armazenados. Usado para recusar um
+        valor no momento da escrita quando sua gravação é adiada (transação ou escrita adiada)
+
+        Args:
+            campos (Dict[str, Any]): campos e seus novos valores
+
+        Raises:
+            ValueError: se algum valor não puder ser armazenado
+        """
+        pass
+
+    def fecha(self):
+        pass
+
+
+class ArmazenamentoMT:
+    """ Interface dos armazenamentos da memória de trabalho, que guardam as autorizações
+    identificadas por um inteiro crescente atribuído na inserção
+    """
+
+    def carrega(self) -> List[Tuple[int, AutorizacaoDFE]]:
+        """ Lê todas as autorizações armazenadas
+
+        Returns:
+            List[Tuple[int, AutorizacaoDFE]]: identificador e autorização, em ordem de inserção
+        """
+        raise NotImplementedError()
+
+    def insere(self, autorizacao: AutorizacaoDFE) -> int:
+        """ Armazena uma autorização
+
+        Args:
+            autorizacao (AutorizacaoDFE): autorização
+
+        Returns:
+            int: identificador atribuído à autorização
+        """
+        raise NotImplementedError()
+
+    def remove(self, doc_id: int):
+        raise NotImplementedError()
+
+    def limpa(self):
+        raise NotImplementedError()
+
+    def sincroniza(self):
+        """ Garante que as autorizações já inseridas ou removidas estão no disco. Os
+        armazenamentos que gravam cada alteração de imediato não precisam fazer nada.
+        """
+        pass
+
+    def fecha(self):
+        pass
+
+
+class ArmazenamentoMSTinyDB(ArmazenamentoMS):
+
+    def __init__(self, arquivo: str):
+        """ Memória segura em arquivo JSON do TinyDB, gravado com o ArmazenamentoAtomico
+
+        Args:
+            arquivo (str): arquivo .json do banco
+        """
+        self.banco = TinyDB(arquivo, storage=ArmazenamentoAtomico)
+
+    def carrega(self) -> Optional[Dict[str, Any]]:
+        data = self.banco.all()
+        if len(data) == 0:
+            return None
+        return dict(data[0])
+
+    def inicia(self, registro: Dict[str, Any]):
+        self.banco.truncate()
+        self.banco.insert(registro)
+
+    def grava(self, campos: Dict[str, Any]):
+        self.banco.update(campos)
+
+    def fecha(self):
+        self.banco.close()
+
+
+class ArmazenamentoMTTinyDB(ArmazenamentoMT):
+
+    def __init__(self, arquivo: str):
+        """ Memória de trabalho em arquivo JSON do TinyDB
+
+        Args:
+            arquivo (str): arquivo .json do banco
+        """
+        self.banco = TinyDB(arquivo)
+
+    def carrega(self) -> List[Tuple[int, AutorizacaoDFE]]:
+        return [(documento.doc_id, AutorizacaoDFE.de_documento(documento, documento.doc_id)) for documento in self.banco.all()]
+
+    def insere(self, autorizacao: AutorizacaoDFE) -> int:
+        return self.banco.insert(autorizacao.para_documento())
+
+    def remove(self, doc_id: int):
+        self.banco.remove(doc_ids=[doc_id])
+
+    def limpa(self):
+        self.banco.truncate()
+
+    def fecha(self):
+        self.banco.close()
+
+
+def abre_armazenamento_ms(arquivo: str, tipo: TipoArmazenamento = TipoArmazenamento.tinydb) -> ArmazenamentoMS:
+    """ Abre o armazenamento da memória segura, criando a pasta do arquivo se necessário
+
+    Args:
+        arquivo (str): arquivo do banco
+        tipo (TipoArmazenamento, optional): implementação do armazenamento. Defaults to TipoArmazenamento.tinydb.
+
+    Returns:
+        ArmazenamentoMS: armazenamento aberto
+
+    Raises:
+        ValueError: se o tipo de armazenamento não servir para a memória segura
+    """
+    if tipo == TipoArmazenamento.log:
+        raise ValueError("Armazenamento em log disponível apenas para a memória de trabalho")
+
+    _cria_pasta(arquivo)
+    if tipo == TipoArmazenamento.sqlite:
+        from daf_virtual_rasp.memoria.armazenamento_sqlite import ArmazenamentoMSSQLite
+        return ArmazenamentoMSSQLite(arquivo)
+    if tipo == TipoArmazenamento.mmap:
+        from daf_virtual_rasp.memoria.armazenamento_mmap import ArmazenamentoMSMmap
+        return ArmazenamentoMSMmap(arquivo)
+    return ArmazenamentoMSTinyDB(arquivo)
+
+
+def abre_armazenamento_mt(arquivo: str, tipo: TipoArmazenamento = TipoArmazenamento.tinydb, **opcoes) -> ArmazenamentoMT:
+    """ Abre o armazenamento da memória de trabalho, criando a pasta do arquivo se necessário
+
+    Args:
+        arquivo (str): arquivo do banco
+        tipo (TipoArmazenamento, optional): implementação do armazenamento. Defaults to TipoArmazenamento.tinydb.
+        opcoes: argumentos repassados ao construtor do armazenamento. Apenas o ArmazenamentoMTLog aceita opções (ex: registros_por_sync)
+
+    Returns:
+        ArmazenamentoMT: armazenamento aberto
+
+    Raises:
+        ValueError: se o tipo de armazenamento não servir para a memória de trabalho ou não aceitar as opções informadas
+    """
+    if tipo == TipoArmazenamento.mmap:
+        raise ValueError("Armazenamento mmap disponível apenas para a memória segura")
+    if opcoes and tipo != TipoArmazenamento.log:
+        raise ValueError(f"Armazenamento {tipo.value} não aceita as opções {', '.join(sorted(opcoes))}")
+
+    _cria_pasta(arquivo)
+    if tipo == TipoArmazenamento.sqlite:
+        from daf_virtual_rasp.memoria.armazenamento_sqlite import ArmazenamentoMTSQLite
+        return ArmazenamentoMTSQLite(arquivo)
+    if tipo == TipoArmazenamento.log:
+        from daf_virtual_rasp.memoria.armazenamento_log import ArmazenamentoMTLog
+        return ArmazenamentoMTLog(arquivo, **opcoes)
+    return ArmazenamentoMTTinyDB(arquivo)
+
+
+def _cria_pasta(arquivo: str):
+    dirname = os.path.dirname(arquivo)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
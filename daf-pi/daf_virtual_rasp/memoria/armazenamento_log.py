@@ -0,0 +1,246 @@
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, List, Tuple
+
+from daf_virtual_rasp.memoria.armazenamento import ArmazenamentoMT
+from daf_virtual_rasp.memoria.autorizacao import AutorizacaoDFE
+
+
+class ArmazenamentoMTLog(ArmazenamentoMT):
+
+    MAGICO = b'DAFMTLOG'
+    CABECALHO = struct.Struct('<cII')     # tipo (+ ou -), id, tamanho da autorização
+    CRC = struct.Struct('<I')             # crc32 do cabeçalho e da autorização
+    INSERCAO = b'+'
+    REMOCAO = b'-'
+
+    def __init__(self, arquivo: str, registros_por_sync: int = 1, limiar_compactacao: float = 0.5, minimo_compactacao: int = 256):
+        """ Memória de trabalho em um log somente de acréscimos. Cada inserção ou remoção
+        acrescenta um registro binário ao arquivo (a autorização empacotada por
+        AutorizacaoDFE.empacota()), de modo que o custo de uma escrita não depende do número
+        de autorizações retidas. Ao abrir, o estado é reconstruído relendo o log.
+
+        Quando a proporção de registros mortos (autorizações removidas e suas remoções)
+        passa do limiar, o log é compactado em uma thread: as autorizações vivas são
+        copiadas para um novo arquivo, que então substitui o antigo.
+
+        Args:
+            arquivo (str): arquivo do log
+            registros_por_sync (int, optional): quantidade de registros acrescentados entre duas sincronizações com o disco (fsync). Defaults to 1.
+            limiar_compactacao (float, optional): proporção de registros mortos a partir da qual o log é compactado. Defaults to 0.5.
+            minimo_compactacao (int, optional): tamanho mínimo do log, em registros, para que seja compactado. Defaults to 256.
+        """
+        self.arquivo = arquivo
+        self.registros_por_sync = max(1, registros_por_sync)
+        self.limiar_compactacao = limiar_compactacao
+        self.minimo_compactacao = minimo_compactacao
+
+        self.trava = threading.Lock()
+        self.documentos = []        # autorizações lidas ao abrir, entregues em carrega()
+        self.ids = set()            # identificadores das autorizações vivas
+        self.proximo_id = 1
+        self.registros = 0          # registros no arquivo
+        self.nao_sincronizados = 0
+        self.compactacao = None     # thread da compactação em andamento
+        self.acrescentados = None   # registros acrescentados durante a compactação
+        self.geracao = 0            # muda quando o arquivo é substituído ou esvaziado
+
+        self.__rele()
+        self.log = open(self.arquivo, 'ab')
+        if self.log.tell() == 0:
+            self.log.write(self.MAGICO)
+            self.__sincroniza()
+
+    @staticmethod
+    def __registros(conteudo: bytes) -> Iterator[Tuple[bytes, int, memoryview, int]]:
+        """ Percorre os registros íntegros do log, parando no primeiro incompleto ou corrompido
+
+        Args:
+            conteudo (bytes): conteúdo do arquivo, sem o número mágico
+
+        Returns:
+            Iterator[Tuple[bytes, int, memoryview, int]]: tipo, id, autorização empacotada e posição do fim do registro
+        """
+        cabecalho, crc = ArmazenamentoMTLog.CABECALHO, ArmazenamentoMTLog.CRC
+        visao = memoryview(conteudo)
+        posicao = 0
+        while posicao + cabecalho.size + crc.size <= len(conteudo):
+            tipo, doc_id, tamanho = cabecalho.unpack_from(conteudo, posicao)
+            inicio = posicao + cabecalho.size + crc.size
+            corpo = visao[inicio:inicio + tamanho]
+            esperado = zlib.crc32(corpo, zlib.crc32(visao[posicao:posicao + cabecalho.size]))
+            if len(corpo) != tamanho or crc.unpack_from(conteudo, posicao + cabecalho.size)[0] != esperado:
+                return
+            posicao = inicio + tamanho
+            yield tipo, doc_id, corpo, posicao
+
+    def __rele(self):
+        """ Reconstrói as autorizações vivas a partir do log. Um último registro incompleto
+        (escrita interrompida) é descartado.
+        """
+        vivos = {}
+        valido = 0
+        if os.path.exists(self.arquivo) and os.path.getsize(self.arquivo) > 0:
+            with open(self.arquivo, 'rb') as log:
+                if log.read(len(self.MAGICO)) != self.MAGICO:
+                    raise ValueError(f"{self.arquivo} não é um log da memória de trabalho")
+                conteudo = log.read()
+
+            valido = len(self.MAGICO)
+            for tipo, doc_id, corpo, fim in self.__registros(conteudo):
+                valido = len(self.MAGICO) + fim
+                self.registros += 1
+                if tipo == self.INSERCAO:
+                    vivos[doc_id] = corpo
+                    self.proximo_id = max(self.proximo_id, doc_id + 1)
+                else:
+                    vivos.pop(doc_id, None)
+
+            if valido != os.path.getsize(self.arquivo):
+                with open(self.arquivo, 'r+b') as log:
+                    log.truncate(valido)
+
+        self.documentos = [(doc_id, AutorizacaoDFE.desempacota(corpo, doc_id)) for doc_id, corpo in sorted(vivos.items())]
+        self.ids = set(vivos)
+
+    def carrega(self) -> List[Tuple[int, AutorizacaoDFE]]:
+        documentos = self.documentos
+        self.documentos = []
+        return documentos
+
+    def __acrescenta(self, tipo: bytes, doc_id: int, corpo: bytes = b''):
+        cabecalho = self.CABECALHO.pack(tipo, doc_id, len(corpo))
+        registro = cabecalho + self.CRC.pack(zlib.crc32(corpo, zlib.crc32(cabecalho))) + corpo
+        with self.trava:
+            self.log.write(registro)
+            self.registros += 1
+            if self.acrescentados != None:
+                self.acrescentados.append(registro)
+
+            self.nao_sincronizados += 1
+            if self.nao_sincronizados >= self.registros_por_sync:
+                self.__sincroniza()
+
+        self.__verifica_compactacao()
+
+    def __sincroniza(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.nao_sincronizados = 0
+
+    def insere(self, autorizacao: AutorizacaoDFE) -> int:
+        doc_id = self.proximo_id
+        self.proximo_id += 1
+        # o id entra nas vivas antes do acréscimo, que pode iniciar uma compactação
+        self.ids.add(doc_id)
+        self.__acrescenta(self.INSERCAO, doc_id, autorizacao.empacota())
+        return doc_id
+
+    def remove(self, doc_id: int):
+        if not doc_id in self.ids:
+            return
+        self.ids.discard(doc_id)
+        self.__acrescenta(self.REMOCAO, doc_id)
+
+    def limpa(self):
+        with self.trava:
+            self.log.truncate(0)
+            self.log.write(self.MAGICO)
+            self.__sincroniza()
+            self.ids.clear()
+            self.registros = 0
+            self.acrescentados = None
+            self.geracao += 1
+
+    def sincroniza(self):
+        """ Sincroniza com o disco os registros ainda pendentes do lote atual
+        """
+        with self.trava:
+            if self.nao_sincronizados > 0:
+                self.__sincroniza()
+
+    def __verifica_compactacao(self):
+        if self.compactacao != None or self.registros < self.minimo_compactacao:
+            return
+        mortos = self.registros - len(self.ids)
+        if mortos / self.registros > self.limiar_compactacao:
+            self.compacta(espera=False)
+
+    def compacta(self, espera: bool = True):
+        """ Reescreve o log apenas com as autorizações vivas
+
+        Args:
+            espera (bool, optional): espera o fim da compactação. Se uma compactação já estiver
+            em andamento, espera por ela e inicia outra. Defaults to True.
+        """
+        compactacao = self.compactacao
+        if compactacao != None:
+            if not espera:
+                return
+            compactacao.join()
+
+        with self.trava:
+            self.__sincroniza()
+            tamanho = self.log.tell()
+            vivos = set(self.ids)
+            geracao = self.geracao
+            self.acrescentados = []
+
+        compactacao = threading.Thread(target=self.__compacta, args=(tamanho, vivos, geracao),
+                                       name='compactacao-mt', daemon=True)
+        self.compactacao = compactacao
+        compactacao.start()
+
+        if espera:
+            compactacao.join()
+
+    def __compacta(self, tamanho: int, vivos: set, geracao: int):
+        temporario = self.arquivo + '.compactando'
+        registros = 0
+        try:
+            with open(self.arquivo, 'rb') as log, open(temporario, 'wb') as novo:
+                log.seek(len(self.MAGICO))
+                conteudo = log.read(tamanho - len(self.MAGICO))
+                novo.write(self.MAGICO)
+                inicio = 0
+                for tipo, doc_id, _, fim in self.__registros(conteudo):
+                    # apenas inserções de autorizações vivas no instante da cópia
+                    if tipo == self.INSERCAO and doc_id in vivos:
+                        novo.write(conteudo[inicio:fim])
+                        registros += 1
+                    inicio = fim
+
+                with self.trava:
+                    if geracao != self.geracao:
+                        # memória esvaziada durante a cópia: descarta o novo arquivo
+                        novo.close()
+                        os.unlink(temporario)
+                        return
+
+                    for registro in self.acrescentados:
+                        novo.write(registro)
+                    novo.flush()
+                    os.fsync(novo.fileno())
+                    novo.close()
+
+                    self.log.close()
+                    os.replace(temporario, self.arquivo)
+                    self.log = open(self.arquivo, 'ab')
+                    self.registros = registros + len(self.acrescentados)
+                    self.nao_sincronizados = 0
+                    self.geracao += 1
+        finally:
+            with self.trava:
+                self.acrescentados = None
+            self.compactacao = None
+
+    def fecha(self):
+        compactacao = self.compactacao
+        if compactacao != None:
+            compactacao.join()
+        with self.trava:
+            if not self.log.closed:
+                self.__sincroniza()
+                self.log.close()
@@ -0,0 +1,233 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, Any, Optional
+
+from daf_virtual_rasp.daf.daf_enums import Guardas, Artefatos, ParametrosAtualizacao
+from daf_virtual_rasp.memoria.armazenamento import ArmazenamentoMS
+
+
+class ArmazenamentoMSMmap(ArmazenamentoMS):
+
+    MAGICO = b'DAFMS\x00\x00\x01'
+    CABECALHO = struct.Struct('<8sI4x')         # mágico, capacidade de cada cópia
+    COPIA = struct.Struct('<QII')               # sequência, crc32, tamanho da cauda
+
+    # campos de tamanho fixo, na ordem em que aparecem em cada cópia do registro
+    CAMPOS_FIXOS = (
+        (Artefatos.contador.value, 'q'),
+        (Guardas.NumDFe.value, 'q'),
+        (Guardas.MaxDFe.value, 'q'),
+        (Guardas.MaxDFeModel.value, 'q'),
+        (Artefatos.modoOperacao.value, 'q'),
+        (ParametrosAtualizacao.falhasAtualizacao.value, 'q'),
+        (Guardas.REGOK.value, '?'),
+        (Guardas.Violado.value, '?'),
+        (Guardas.Estado.value, '16s'),
+        (Artefatos.IDDAF.value, '32s'),
+        (ParametrosAtualizacao.versaoSB.value, '16s'),
+    )
+
+    def __init__(self, arquivo: str, capacidade: int = 8192):
+        """ Memória segura em um arquivo binário de leiaute fixo, mapeado em memória (mmap).
+
+        O arquivo guarda duas cópias do registro. Cada cópia tem os campos de tamanho
+        fixo (contadores, guardas, estado, IDDAF e versão do SB) em posições conhecidas,
+        lidos e escritos diretamente com struct, seguidos de uma cauda de tamanho variável
+        com os demais campos (certificado, chaves, etc.) em JSON. Uma gravação copia a
+        cópia vigente sobre a outra, altera nela apenas os campos gravados e a torna
+        vigente ao incrementar sua sequência, de modo que uma gravação interrompida
+        nunca corrompe o registro. Ao abrir, vale a cópia íntegra (crc32) de maior sequência.
+
+        Args:
+            arquivo (str): arquivo da memória segura
+            capacidade (int, optional): tamanho inicial, em bytes, de cada cópia do registro. Cresce quando necessário. Defaults to 8192.
+        """
+        self.arquivo = arquivo
+        self.fixos = {}
+        posicao = self.COPIA.size
+        for campo, formato in self.CAMPOS_FIXOS:
+            estrutura = struct.Struct('<' + formato)
+            self.fixos[campo] = (posicao, estrutura)
+            posicao += estrutura.size
+        self.inicio_cauda = posicao
+
+        if not os.path.exists(arquivo) or os.path.getsize(arquivo) == 0:
+            self.__cria(max(capacidade, self.inicio_cauda), None)
+        self.__mapeia()
+
+    def __cria(self, capacidade: int, copia: Optional[bytes]):
+        """ Cria (ou substitui atomicamente) o arquivo, com a cópia informada na primeira posição
+
+        Args:
+            capacidade (int): tamanho de cada cópia do registro
+            copia (Optional[bytes]): conteúdo da primeira cópia, ou None para um arquivo vazio
+        """
+        conteudo = bytearray(self.CABECALHO.size + 2 * capacidade)
+        self.CABECALHO.pack_into(conteudo, 0, self.MAGICO, capacidade)
+        if copia != None:
+            conteudo[self.CABECALHO.size:self.CABECALHO.size + len(copia)] = copia
+
+        temporario = self.arquivo + '.novo'
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(conteudo)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, self.arquivo)
+
+    def __mapeia(self):
+        self.descritor = open(self.arquivo, 'r+b')
+        self.mm = mmap.mmap(self.descritor.fileno(), 0)
+
+        magico, self.capacidade = self.CABECALHO.unpack_from(self.mm, 0)
+        if magico != self.MAGICO:
+            raise ValueError(f"{self.arquivo} não é uma memória segura em leiaute fixo")
+
+        # cópia vigente: a íntegra com maior sequência
+        self.vigente = None
+        self.sequencia = 0
+        for i in (0, 1):
+            sequencia = self.__sequencia_valida(self.__base(i))
+            if sequencia > self.sequencia:
+                self.vigente, self.sequencia = i, sequencia
+
+        self.cauda = {}
+        if self.vigente != None:
+            self.cauda = self.__le_cauda(self.__base(self.vigente))
+
+    def __base(self, i: int) -> int:
+        return self.CABECALHO.size + i * self.capacidade
+
+    def __sequencia_valida(self, base: int) -> int:
+        sequencia, crc, tamanho_cauda = self.COPIA.unpack_from(self.mm, base)
+        fim = base + self.inicio_cauda + tamanho_cauda
+        if sequencia == 0 or fim > base + self.capacidade:
+            return 0
+        if zlib.crc32(self.mm[base + 12:fim]) != crc:
+            return 0
+        return sequencia
+
+    def __le_cauda(self, base: int) -> Dict[str, Any]:
+        tamanho_cauda = self.COPIA.unpack_from(self.mm, base)[2]
+        inicio = base + self.inicio_cauda
+        return json.loads(self.mm[inicio:inicio + tamanho_cauda])
+
+    def le(self, campo: str) -> Any:
+        """ Lê um campo diretamente da cópia vigente
+
+        Args:
+            campo (str): campo do registro
+
+        Returns:
+            Any: valor do campo
+        """
+        if campo in self.fixos:
+            posicao, estrutura = self.fixos[campo]
+            valor = estrutura.unpack_from(self.mm, self.__base(self.vigente) + posicao)[0]
+            if isinstance(valor, bytes):
+                return valor.rstrip(b'\x00').decode('utf-8')
+            return valor
+        return self.cauda[campo]
+
+    def carrega(self) -> Optional[Dict[str, Any]]:
+        if self.vigente == None:
+            return None
+        registro = {campo: self.le(campo) for campo in self.fixos}
+        registro.update(self.cauda)
+        return registro
+
+    def __escreve_fixo(self, destino, base: int, campo: str, valor: Any):
+        posicao, estrutura = self.fixos[campo]
+        if isinstance(valor, str):
+            valor = valor.encode('utf-8')
+            if len(valor) > estrutura.size:
+                raise ValueError(f"Valor de {campo} excede {estrutura.size} bytes")
+        elif estrutura.format.endswith('s') or isinstance(valor, bool) != estrutura.format.endswith('?'):
+            raise ValueError(f"Tipo inválido para {campo}")
+        estrutura.pack_into(destino, base + posicao, valor)
+
+    def inicia(self, registro: Dict[str, Any]):
+        self.__grava(registro, novo=True)
+
+    def grava(self, campos: Dict[str, Any]):
+        if self.vigente == None:
+            raise ValueError("Memória segura não iniciada")
+        self.__grava(campos, novo=False)
+
+    def valida(self, campos: Dict[str, Any]):
+        rascunho = bytearray(self.inicio_cauda)
+        for campo, valor in campos.items():
+            if campo in self.fixos:
+                self.__escreve_fixo(rascunho, 0, campo, valor)
+
+    def __grava(self, campos: Dict[str, Any], novo: bool):
+        """ Monta a nova versão do registro na cópia que não está vigente e a torna vigente
+
+        Args:
+            campos (Dict[str, Any]): campos alterados
+            novo (bool): se verdadeiro, a nova versão parte de um registro vazio
+        """
+        cauda_alterada = {campo: valor for campo, valor in campos.items() if not campo in self.fixos}
+        if cauda_alterada or novo:
+            cauda = {} if novo else dict(self.cauda)
+            cauda.update(cauda_alterada)
+            cauda_serializada = json.dumps(cauda, separators=(',', ':')).encode('utf-8')
+        else:
+            cauda_serializada = None
+
+        if novo:
+            origem = bytes(self.inicio_cauda)
+        else:
+            base_vigente = self.__base(self.vigente)
+            tamanho_cauda = self.COPIA.unpack_from(self.mm, base_vigente)[2]
+            fim = self.inicio_cauda if cauda_serializada != None else self.inicio_cauda + tamanho_cauda
+            origem = self.mm[base_vigente:base_vigente + fim]
+
+        if cauda_serializada != None and self.inicio_cauda + len(cauda_serializada) > self.capacidade:
+            # a cauda não cabe mais: recria o arquivo com cópias maiores
+            copia = bytearray(origem) + cauda_serializada
+            for campo, valor in campos.items():
+                if campo in self.fixos:
+                    self.__escreve_fixo(copia, 0, campo, valor)
+            self.__finaliza(copia, 0, len(cauda_serializada))
+            self.fecha()
+            self.__cria(2 * len(copia), bytes(copia))
+            self.__mapeia()
+            return
+
+        # valida todos os campos antes de alterar o arquivo
+        rascunho = bytearray(origem[:self.inicio_cauda])
+        for campo, valor in campos.items():
+            if campo in self.fixos:
+                self.__escreve_fixo(rascunho, 0, campo, valor)
+
+        destino = 1 if self.vigente == 0 else 0
+        base = self.__base(destino)
+        self.mm[base:base + len(origem)] = origem
+        self.mm[base:base + self.inicio_cauda] = rascunho
+        if cauda_serializada != None:
+            self.mm[base + self.inicio_cauda:base + self.inicio_cauda + len(cauda_serializada)] = cauda_serializada
+            tamanho_cauda = len(cauda_serializada)
+        else:
+            tamanho_cauda = len(origem) - self.inicio_cauda
+
+        self.__finaliza(self.mm, base, tamanho_cauda)
+        self.mm.flush()
+        self.vigente = destino
+        self.sequencia += 1
+        if cauda_serializada != None:
+            self.cauda = cauda
+
+    def __finaliza(self, destino, base: int, tamanho_cauda: int):
+        """ Grava sequência, tamanho da cauda e crc32 da cópia
+        """
+        struct.pack_into('<QxxxxI', destino, base, self.sequencia + 1, tamanho_cauda)
+        crc = zlib.crc32(destino[base + 12:base + self.inicio_cauda + tamanho_cauda])
+        struct.pack_into('<I', destino, base + 8, crc)
+
+    def fecha(self):
+        if not self.mm.closed:
+            self.mm.close()
+            self.descritor.close()
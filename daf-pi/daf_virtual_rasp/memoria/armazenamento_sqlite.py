@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from daf_virtual_rasp.memoria.armazenamento import ArmazenamentoMS, ArmazenamentoMT
+from daf_virtual_rasp.memoria.autorizacao import AutorizacaoDFE
+
+
+def _conecta(arquivo: str) -> sqlite3.Connection:
+    """ Abre o banco sqlite3 em modo WAL, com transações controladas explicitamente.
+    A conexão pode ser usada por outra thread que não a que a abriu (ex: o executor
+    do DAF); os armazenamentos serializam o acesso a ela com uma trava.
+
+    Args:
+        arquivo (str): arquivo do banco
+
+    Returns:
+        sqlite3.Connection: conexão com o banco
+    """
+    conexao = sqlite3.connect(arquivo, isolation_level=None, check_same_thread=False)
+    conexao.execute('PRAGMA journal_mode=WAL')
+    # com WAL, FULL garante que cada transação confirmada sobrevive a uma queda de energia
+    conexao.execute('PRAGMA synchronous=FULL')
+    return conexao
+
+
+class ArmazenamentoMSSQLite(ArmazenamentoMS):
+
+    def __init__(self, arquivo: str):
+        """ Memória segura em banco sqlite3 (WAL). Cada campo do registro é uma linha
+        da tabela ms, com o valor serializado em JSON.
+
+        Args:
+            arquivo (str): arquivo do banco
+        """
+        self.conexao = _conecta(arquivo)
+        self.trava = threading.Lock()
+        self.conexao.execute('CREATE TABLE IF NOT EXISTS ms (campo TEXT PRIMARY KEY, valor TEXT NOT NULL)')
+
+    def carrega(self) -> Optional[Dict[str, Any]]:
+        with self.trava:
+            linhas = self.conexao.execute('SELECT campo, valor FROM ms').fetchall()
+        if len(linhas) == 0:
+            return None
+        return {campo: json.loads(valor) for campo, valor in linhas}
+
+    def inicia(self, registro: Dict[str, Any]):
+        with self.trava, self.conexao:
+            self.conexao.execute('BEGIN IMMEDIATE')
+            self.conexao.execute('DELETE FROM ms')
+            self.__insere(registro)
+
+    def grava(self, campos: Dict[str, Any]):
+        with self.trava, self.conexao:
+            self.conexao.execute('BEGIN IMMEDIATE')
+            self.__insere(campos)
+
+    def __insere(self, campos: Dict[str, Any]):
+        self.conexao.executemany('INSERT OR REPLACE INTO ms (campo, valor) VALUES (?, ?)',
+                                 [(campo, json.dumps(valor)) for campo, valor in campos.items()])
+
+    def fecha(self):
+        with self.trava:
+            self.conexao.close()
+
+
+class ArmazenamentoMTSQLite(ArmazenamentoMT):
+
+    CAMPOS = ('daf', 'vsb', 'mop', 'pdv', 'cnt', 'aut', 'fdf', 'hdf')
+
+    def __init__(self, arquivo: str):
+        """ Memória de trabalho em banco sqlite3 (WAL), com uma autorização por linha
+        e índices únicos sobre aut, hdf e cnt. Os campos binários são gravados como BLOB.
+
+        Args:
+            arquivo (str): arquivo do banco
+        """
+        self.conexao = _conecta(arquivo)
+        self.trava = threading.Lock()
+        with self.conexao:
+            self.conexao.execute('BEGIN IMMEDIATE')
+            # vsb sem tipo declarado: a versão do SB é gravada como veio (inteiro ou texto)
+            self.conexao.execute('''CREATE TABLE IF NOT EXISTS mt (
+                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        daf TEXT, vsb, mop INTEGER, pdv TEXT,
+                                        cnt INTEGER NOT NULL, aut BLOB NOT NULL,
+                                        fdf BLOB, hdf BLOB NOT NULL)''')
+            self.conexao.execute('CREATE UNIQUE INDEX IF NOT EXISTS mt_aut ON mt (aut)')
+            self.conexao.execute('CREATE UNIQUE INDEX IF NOT EXISTS mt_hdf ON mt (hdf)')
+            self.conexao.execute('CREATE UNIQUE INDEX IF NOT EXISTS mt_cnt ON mt (cnt)')
+
+        self.sql_insere = 'INSERT INTO mt ({}) VALUES ({})'.format(', '.join(self.CAMPOS), ', '.join('?' * len(self.CAMPOS)))
+
+    def carrega(self) -> List[Tuple[int, AutorizacaoDFE]]:
+        with self.trava:
+            linhas = self.conexao.execute('SELECT id, {} FROM mt ORDER BY id'.format(', '.join(self.CAMPOS))).fetchall()
+        return [(linha[0], AutorizacaoDFE(*linha[1:], doc_id=linha[0])) for linha in linhas]
+
+    def insere(self, autorizacao: AutorizacaoDFE) -> int:
+        with self.trava, self.conexao:
+            cursor = self.conexao.execute(self.sql_insere, [getattr(autorizacao, campo) for campo in self.CAMPOS])
+        return cursor.lastrowid
+
+    def remove(self, doc_id: int):
+        with self.trava, self.conexao:
+            self.conexao.execute('DELETE FROM mt WHERE id = ?', (doc_id,))
+
+    def limpa(self):
+        with self.trava, self.conexao:
+            self.conexao.execute('DELETE FROM mt')
+
+    def fecha(self):
+        with self.trava:
+            self.conexao.close()
@@ -0,0 +1,164 @@
+import struct
+import sys
+from typing import Any, Dict, Union
+
+from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
+
+
+class AutorizacaoDFE:
+    """ Autorização de DFe retida na memória de trabalho, em representação compacta.
+
+    Os campos binários (aut, fdf e hdf) são mantidos como bytes e só são convertidos
+    para base64url quando lidos com autorizacao['campo'], ou seja, na borda do protocolo.
+    O contador e o modo de operação são inteiros e os valores repetidos em todas as
+    autorizações (idDAF, versão do SB e PDV) são internados, de modo que as autorizações
+    de um mesmo DAF compartilham uma única cópia de cada um.
+    """
+
+    __slots__ = ('doc_id', 'daf', 'vsb', 'mop', 'pdv', 'cnt', 'aut', 'fdf', 'hdf')
+
+    CAMPOS = ('daf', 'vsb', 'mop', 'pdv', 'cnt', 'aut', 'fdf', 'hdf')
+    CAMPOS_TEXTO = ('daf', 'vsb', 'pdv')
+    CAMPOS_BINARIOS = ('aut', 'fdf', 'hdf')
+
+    # contador, modo de operação, indicadores (bits) e tamanho de cada campo variável
+    CABECALHO = struct.Struct('<qhB6H')
+    VSB_INTEIRO = 1 << 3        # indicador de versão do SB inteira; os bits 0 a 2 indicam campos binários guardados como texto
+
+    CONSTANTES = {}             # valores não textuais internados
+
+    def __init__(self, daf: str, vsb: Union[int, str], mop: int, pdv: str, cnt: int, aut: Union[str, bytes], fdf: Union[str, bytes], hdf: Union[str, bytes], doc_id: int = None):
+        """
+        Args:
+            daf (str): identificador único do daf
+            vsb (Union[int, str]): versão do SB
+            mop (int): modo de operação
+            pdv (str): identificador do PDV
+            cnt (int): valor do contador
+            aut (Union[str, bytes]): identificador da autorização, em base64url ou bytes
+            fdf (Union[str, bytes]): fragmento do DFe, em base64url ou bytes
+            hdf (Union[str, bytes]): resumo do DFe, em base64url ou bytes
+            doc_id (int, optional): identificador no armazenamento. Defaults to None.
+        """
+        self.doc_id = doc_id
+        self.daf = AutorizacaoDFE.interna(daf)
+        self.vsb = AutorizacaoDFE.interna(vsb)
+        self.mop = mop
+        self.pdv = AutorizacaoDFE.interna(pdv)
+        self.cnt = cnt
+        self.aut = AutorizacaoDFE.compacta(aut)
+        self.fdf = AutorizacaoDFE.compacta(fdf)
+        self.hdf = AutorizacaoDFE.compacta(hdf)
+
+    @staticmethod
+    def interna(valor: Any) -> Any:
+        """ Retorna a cópia compartilhada de um valor repetido entre autorizações
+
+        Args:
+            valor (Any): valor
+
+        Returns:
+            Any: valor igual, compartilhado
+        """
+        if isinstance(valor, str):
+            return sys.intern(valor)
+        return AutorizacaoDFE.CONSTANTES.setdefault(valor, valor)
+
+    @staticmethod
+    def compacta(valor: Union[str, bytes]) -> Union[str, bytes]:
+        """ Representação compacta de um campo binário: os bytes de um texto em base64url.
+        Textos que não são base64url canônico (que não voltariam idênticos ao serem
+        codificados de novo) são mantidos como estão.
+
+        Args:
+            valor (Union[str, bytes]): valor em base64url ou bytes
+
+        Returns:
+            Union[str, bytes]: valor compacto
+        """
+        if isinstance(valor, str):
+            try:
+                bruto = Base64URLDAF.base64URLDecode(valor)
+            except ValueError:
+                return valor
+            if Base64URLDAF.base64URLEncode(bruto) == valor:
+                return bruto
+        return valor
+
+    def __getitem__(self, campo: str) -> Any:
+        if campo in self.CAMPOS_BINARIOS:
+            valor = getattr(self, campo)
+            return Base64URLDAF.base64URLEncode(valor) if isinstance(valor, bytes) else valor
+        if campo in self.CAMPOS:
+            return getattr(self, campo)
+        raise KeyError(campo)
+
+    def __contains__(self, campo: str) -> bool:
+        return campo in self.CAMPOS
+
+    def __repr__(self) -> str:
+        return f"AutorizacaoDFE(doc_id={self.doc_id}, cnt={self.cnt}, aut={self['aut']})"
+
+    def para_documento(self) -> Dict[str, Any]:
+        """ Autorização no formato de documento JSON, com os campos binários em base64url
+
+        Returns:
+            Dict[str, Any]: documento
+        """
+        return {campo: self[campo] for campo in self.CAMPOS}
+
+    @staticmethod
+    def de_documento(documento: Dict[str, Any], doc_id: int = None) -> 'AutorizacaoDFE':
+        """ Cria a autorização a partir de um documento com os campos de para_documento()
+
+        Args:
+            documento (Dict[str, Any]): documento
+            doc_id (int, optional): identificador no armazenamento. Defaults to None.
+
+        Returns:
+            AutorizacaoDFE: autorização
+        """
+        return AutorizacaoDFE(doc_id=doc_id, **{campo: documento[campo] for campo in AutorizacaoDFE.CAMPOS})
+
+    def empacota(self) -> bytes:
+        """ Serializa a autorização em um registro binário: cabeçalho de tamanho fixo
+        seguido dos campos de texto em UTF-8 e dos campos binários
+
+        Returns:
+            bytes: registro
+        """
+        indicadores = 0
+        if isinstance(self.vsb, int):
+            indicadores |= self.VSB_INTEIRO
+        valores = [str(getattr(self, campo)).encode('utf-8') for campo in self.CAMPOS_TEXTO]
+        for i, campo in enumerate(self.CAMPOS_BINARIOS):
+            valor = getattr(self, campo)
+            if isinstance(valor, str):
+                indicadores |= 1 << i
+                valor = valor.encode('utf-8')
+            valores.append(valor)
+        return self.CABECALHO.pack(self.cnt, self.mop, indicadores, *[len(valor) for valor in valores]) + b''.join(valores)
+
+    @staticmethod
+    def desempacota(registro: Union[bytes, memoryview], doc_id: int = None) -> 'AutorizacaoDFE':
+        """ Recria a autorização a partir de um registro de empacota()
+
+        Args:
+            registro (Union[bytes, memoryview]): registro binário
+            doc_id (int, optional): identificador no armazenamento. Defaults to None.
+
+        Returns:
+            AutorizacaoDFE: autorização
+        """
+        cnt, mop, indicadores, *tamanhos = AutorizacaoDFE.CABECALHO.unpack_from(registro)
+        posicao = AutorizacaoDFE.CABECALHO.size
+        valores = []
+        for tamanho in tamanhos:
+            valores.append(bytes(registro[posicao:posicao + tamanho]))
+            posicao += tamanho
+
+        daf, vsb, pdv = [valor.decode('utf-8') for valor in valores[:3]]
+        if indicadores & AutorizacaoDFE.VSB_INTEIRO:
+            vsb = int(vsb)
+        aut, fdf, hdf = [valor.decode('utf-8') if indicadores & (1 << i) else valor for i, valor in enumerate(valores[3:])]
+        return AutorizacaoDFE(daf, vsb, mop, pdv, cnt, aut, fdf, hdf, doc_id)
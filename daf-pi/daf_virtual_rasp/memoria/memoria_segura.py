@@ -1,33 +1,44 @@
 from daf_virtual_rasp.daf.daf_enums import Guardas, Artefatos, ParametrosAtualizacao, Estados
-from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, Certificado, ChaveCripto
-from tinydb import TinyDB, Query
+from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, Certificado, ChaveCripto, ContextoHMAC
 from typing import Union
 import os
 import json
 from daf_virtual_rasp.imagem import ImagemSB
 from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento, abre_armazenamento_ms
+from contextlib import contextmanager
+from enum import Enum
 import uuid
 
+
+class PoliticaEscrita(Enum):
+    imediata = "imediata"   # cada escrita é gravada no banco (write-through)
+    adiada = "adiada"       # escritas ficam pendentes até flush() (write-behind)
+
+
 class MemoriaSegura:
 
-    def __init__(self, path_ms: str = './ms.json'):
-        """ Classe para iniciar um banco de dados com a classe
-        TinyDB
+    def __init__(self, path_ms: str = './ms.json', path_sb: str = './daf_virtual_rasp/resources/imagem/sb', politica_escrita: PoliticaEscrita = PoliticaEscrita.imediata, armazenamento: TipoArmazenamento = TipoArmazenamento.tinydb):
+        """ Classe para iniciar o banco de dados da memória segura. O registro
+        é carregado uma única vez e as leituras são atendidas a partir da memória.
 
         Args:
-            path_ms (str, optional): caminho para o arquivo .json que representa o banco. Defaults to './ms.json'.
+            path_ms (str, optional): caminho para o arquivo que representa o banco. Defaults to './ms.json'.
+            path_sb (str, optional): partição do SB de onde são obtidos a versão e a assinatura iniciais. Defaults to './daf_virtual_rasp/resources/imagem/sb'.
+            politica_escrita (PoliticaEscrita, optional): quando as escritas são gravadas no banco. Defaults to PoliticaEscrita.imediata.
+            armazenamento (TipoArmazenamento, optional): implementação do banco. Defaults to TipoArmazenamento.tinydb.
         """
        
         self.arquivo = path_ms
-        
-        # cria pasta se não existe ainda
-        dirname = os.path.dirname(self.arquivo)
-        
-        if not os.path.isdir(dirname):
-            os.makedirs(dirname)
+        self.path_sb = path_sb
+        self.politica_escrita = politica_escrita
+        self.registro = {}          # cópia em memória do registro do banco
+        self.pendentes = {}         # escritas ainda não gravadas no banco (escrita adiada ou transação)
+        self.em_transacao = False
+        self.artefatos = {}         # certificado, chaves e contextos HMAC já decodificados, por campo do registro
 
-        self.banco = TinyDB(self.arquivo)
-        self.query = Query()
+        # cria pasta se não existe ainda e abre o banco
+        self.banco = abre_armazenamento_ms(self.arquivo, armazenamento)
      
        
         with open('daf_virtual_rasp/resources/sef-cert-ec.pem') as file:
@@ -42,7 +53,7 @@ class MemoriaSegura:
         modelo = 'daf-pi'
 
 
-        imagem = ImagemSB(path_arquivos='./daf_virtual_rasp/resources/imagem/sb')
+        imagem = ImagemSB(path_arquivos=self.path_sb)
         
         ateste = ChaveCripto(ateste)
         ateste_pub = ChaveCripto(ateste_pub)
@@ -75,7 +86,8 @@ class MemoriaSegura:
         self.iniciaBanco(daf_info)
 
     def __del__(self):
-        self.banco.close()
+        self.flush()
+        self.banco.fecha()
 
     def iniciaBanco(self, dic: dict) -> bool:
         """ Método para iniciar o banco de dados
@@ -86,24 +98,29 @@ class MemoriaSegura:
         Returns:
             bool: Sucesso ou falha na criação
         """
-        data = self.banco.all()
+        data = self.banco.carrega()
 
-        if len(data) == 0:
+        if data == None:
             try:
-                self.banco.insert(dic)
+                self.banco.inicia(dic)
+                self.registro = dict(dic)
+                self.artefatos.clear()
                 return True
             except:
                 return False
 
+        self.registro = data
+        self.artefatos.clear()
+
     def reinicia_memoria(self) -> bool:
-        """ Método para reiniciar o banco
+        """ Método para reiniciar o banco. Dentro de uma transação, o registro reiniciado
+        é gravado junto com as demais escritas ao final dela (ou descartado, se ela falhar).
 
         Returns:
             bool: Sucesso ou falha na operação
         """
        
         iddaf = self.leitura(Artefatos.IDDAF)
-        self.banco.truncate()
         
         if not iddaf:
             iddaf = Base64URLDAF.base64URLEncode(uuid.uuid4().bytes)
@@ -121,7 +138,7 @@ class MemoriaSegura:
         modelo = 'daf-pi'
 
 
-        imagem = ImagemSB(path_arquivos='./daf_virtual_rasp/resources/imagem/sb')
+        imagem = ImagemSB(path_arquivos=self.path_sb)
         
         ateste = ChaveCripto(ateste)
         ateste_pub = ChaveCripto(ateste_pub)
@@ -152,7 +169,25 @@ class MemoriaSegura:
             ParametrosAtualizacao.falhasAtualizacao.value: 0
         }
 
-        return self.iniciaBanco(daf_info)
+        if self.em_transacao:
+            # todos os campos do registro entram nas escritas da transação
+            try:
+                self.banco.valida(daf_info)
+            except:
+                return False
+            self.pendentes.update(daf_info)
+            self.registro = dict(daf_info)
+            self.artefatos.clear()
+            return True
+
+        try:
+            self.banco.inicia(daf_info)
+            self.pendentes.clear()
+            self.registro = dict(daf_info)
+            self.artefatos.clear()
+            return True
+        except:
+            return False
 
     def leitura(self, obj: Union[Artefatos, Guardas, ParametrosAtualizacao]) -> Union[Certificado, ChaveCripto, bytes, str]:
         """ Método para fazer a leitura de uma informação armazenada no banco
@@ -163,20 +198,126 @@ class MemoriaSegura:
         Returns:
             Union[Certificado, ChaveCripto, bytes]: Informação obtida do banco
         """
-        banco_inteiro = self.banco.all()
+        registro = self.registro
         if obj == Artefatos.certificado:
-            return Certificado(banco_inteiro[0][obj.value])
+            return self.__artefato(obj.value, Certificado)
 
         if obj == Artefatos.chavePrivada or obj == Artefatos.chavePublica or obj == Artefatos.chaveAteste or obj == Artefatos.chaveAtestePublica:
-            return ChaveCripto(banco_inteiro[0][obj.value])
+            return self.__artefato(obj.value, ChaveCripto)
 
         if obj == Artefatos.chaveSEF or obj == Artefatos.chavePAF:
-            return bytes.fromhex(banco_inteiro[0][obj.value])
+            return self.contexto_HMAC(obj).chave
         if obj == ParametrosAtualizacao.versaoSB:
-            return int(banco_inteiro[0][obj.value],16)
+            return int(registro[obj.value],16)
         if obj == ParametrosAtualizacao.assinaturaSEF:
-            return str(banco_inteiro[0][obj.value])
-        return banco_inteiro[0][obj.value]
+            return str(registro[obj.value])
+        return registro[obj.value]
+
+    def contexto_HMAC(self, obj: Artefatos) -> ContextoHMAC:
+        """ Contexto HMAC-SHA256 da chave SEF ou PAF, criado na primeira leitura após a
+        última escrita da chave e reaproveitado pelas operações seguintes
+
+        Args:
+            obj (Artefatos): Artefatos.chaveSEF ou Artefatos.chavePAF
+
+        Returns:
+            ContextoHMAC: contexto da chave
+        """
+        contexto = self.artefatos.get(obj.value)
+        if contexto == None:
+            contexto = ContextoHMAC(bytes.fromhex(self.registro[obj.value]))
+            self.artefatos[obj.value] = contexto
+        return contexto
+
+    def __artefato(self, chave: str, classe: type) -> Union[Certificado, ChaveCripto]:
+        """ Retorna o certificado ou a chave do registro já decodificado, decodificando-o
+        apenas na primeira leitura após a última escrita do campo
+
+        Args:
+            chave (str): campo do registro
+            classe (type): Certificado ou ChaveCripto
+
+        Returns:
+            Union[Certificado, ChaveCripto]: artefato decodificado
+        """
+        artefato = self.artefatos.get(chave)
+        if artefato == None:
+            artefato = classe(self.registro[chave])
+            self.artefatos[chave] = artefato
+        return artefato
+
+    def __grava(self, chave: str, valor: Union[int, str, bool]):
+        """ Atualiza o registro em memória e o grava no banco conforme a política de escrita
+
+        Args:
+            chave (str): campo do registro
+            valor (Union[int, str, bool]): valor já serializado do campo
+        """
+        if self.politica_escrita == PoliticaEscrita.imediata and not self.em_transacao:
+            # grava antes de alterar a memória: se o banco recusar o valor, o registro não muda
+            self.banco.grava({chave: valor})
+        else:
+            # a gravação fica para depois, mas um valor que o banco não aceita é recusado já
+            self.banco.valida({chave: valor})
+            self.pendentes[chave] = valor
+        self.registro[chave] = valor
+        self.artefatos.pop(chave, None)
+
+    def flush(self) -> bool:
+        """ Grava no banco, de uma só vez, as escritas pendentes da política de escrita adiada
+
+        Returns:
+            bool: Sucesso ou falha na operação
+        """
+        if not self.pendentes:
+            return True
+        try:
+            self.banco.grava(self.pendentes)
+            self.pendentes = {}
+            return True
+        except:
+            return False
+
+    @contextmanager
+    def transacao(self):
+        """ Agrupa as escritas feitas dentro do bloco with em uma única gravação
+        atômica do banco, feita ao final do bloco. Se o bloco terminar com uma exceção,
+        ou se a gravação falhar, o registro em memória volta ao estado anterior e nada
+        é gravado. Transações aninhadas fazem parte da transação mais externa.
+
+        Exemplo:
+            with ms.transacao():
+                ms.escrita(Artefatos.contador, 0)
+                ms.escrita(Guardas.NumDFe, 0)
+
+        Raises:
+            IOError: se o banco não aceitar a gravação das escritas da transação
+        """
+        if self.em_transacao:
+            yield self
+            return
+
+        registro = dict(self.registro)
+        pendentes = dict(self.pendentes)
+        self.em_transacao = True
+        try:
+            yield self
+        except:
+            self.__desfaz(registro, pendentes)
+            raise
+        finally:
+            self.em_transacao = False
+
+        if not self.flush():
+            self.__desfaz(registro, pendentes)
+            raise IOError("Falha ao gravar a transação da memória segura")
+
+    def __desfaz(self, registro: dict, pendentes: dict):
+        """ Volta o registro em memória e as escritas pendentes ao estado do início da transação
+        """
+        self.registro = registro
+        self.pendentes = pendentes
+        self.artefatos.clear()
 
     def escrita(self, obj: Union[Artefatos, Guardas, ParametrosAtualizacao], valor: Union[int, str, bool, bytes, Certificado, ChaveCripto]) -> bool:
         """ Método para armazenar/atualizar uma informação do banco
@@ -192,7 +333,7 @@ class MemoriaSegura:
             if obj == Artefatos.certificado:
                 if isinstance(valor, Certificado):
                     try:
-                        self.banco.update({obj.value: valor.certificado_str})
+                        self.__grava(obj.value, valor.certificado_str)
                         return True
                     except:
                         return False
@@ -201,7 +342,7 @@ class MemoriaSegura:
             elif obj == Artefatos.IDDAF:
                 if isinstance(valor, str):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -210,7 +351,9 @@ class MemoriaSegura:
             elif obj == Artefatos.chavePrivada or obj == Artefatos.chavePublica:
                 if isinstance(valor, ChaveCripto):
                     try:
-                        self.banco.update({obj.value: valor.chave_str})
+                        self.__grava(obj.value, valor.chave_str)
+                        # a própria chave escrita passa a ser o artefato decodificado do campo
+                        self.artefatos[obj.value] = valor
                         return True
                     except:
                         return False
@@ -220,7 +363,7 @@ class MemoriaSegura:
             elif obj == Artefatos.chavePAF or obj == Artefatos.chaveSEF:
                 if isinstance(valor, bytes):
                     try:
-                        self.banco.update({obj.value: valor.hex()})
+                        self.__grava(obj.value, valor.hex())
                         return True
                     except:
                         return False
@@ -229,7 +372,7 @@ class MemoriaSegura:
             elif obj == Artefatos.contador or obj == Artefatos.modoOperacao:
                 if isinstance(valor, int):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -241,7 +384,7 @@ class MemoriaSegura:
             if obj == Guardas.Estado:
                 if isinstance(valor, str):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -250,7 +393,7 @@ class MemoriaSegura:
             elif obj == Guardas.MaxDFe or obj == Guardas.NumDFe or obj == Guardas.MaxDFeModel:
                 if isinstance(valor, int):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -259,7 +402,7 @@ class MemoriaSegura:
             else:
                 if isinstance(valor, bool):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -269,7 +412,7 @@ class MemoriaSegura:
             if obj == ParametrosAtualizacao.versaoSB:
                 if isinstance(valor, str):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
@@ -278,7 +421,7 @@ class MemoriaSegura:
             elif obj == ParametrosAtualizacao.assinaturaSEF:
                 if isinstance(valor, bytes):
                     try:
-                        self.banco.update({obj.value: Base64URLDAF.base64URLEncode(valor)})
+                        self.__grava(obj.value, Base64URLDAF.base64URLEncode(valor))
                         return True
                     except:
                         return False
@@ -287,7 +430,7 @@ class MemoriaSegura:
             elif obj == ParametrosAtualizacao.falhasAtualizacao:
                 if isinstance(valor, int):
                     try:
-                        self.banco.update({obj.value: valor})
+                        self.__grava(obj.value, valor)
                         return True
                     except:
                         return False
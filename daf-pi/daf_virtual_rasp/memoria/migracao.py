@@ -0,0 +1,80 @@
+import argparse
+import os
+
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento, abre_armazenamento_ms, abre_armazenamento_mt
+
+EXTENSOES = {TipoArmazenamento.tinydb: '.json', TipoArmazenamento.sqlite: '.db', TipoArmazenamento.log: '.log', TipoArmazenamento.mmap: '.bin'}
+
+
+def migra_ms(origem: str, destino: str, tipo_origem: TipoArmazenamento = TipoArmazenamento.tinydb, tipo_destino: TipoArmazenamento = TipoArmazenamento.sqlite) -> bool:
+    """ Copia o registro da memória segura de um armazenamento para outro
+
+    Args:
+        origem (str): arquivo da memória segura existente
+        destino (str): arquivo da nova memória segura
+        tipo_origem (TipoArmazenamento, optional): implementação do banco de origem. Defaults to TipoArmazenamento.tinydb.
+        tipo_destino (TipoArmazenamento, optional): implementação do banco de destino. Defaults to TipoArmazenamento.sqlite.
+
+    Returns:
+        bool: Falso se a origem estiver vazia
+    """
+    entrada = abre_armazenamento_ms(origem, tipo_origem)
+    registro = entrada.carrega()
+    entrada.fecha()
+    if registro == None:
+        return False
+
+    saida = abre_armazenamento_ms(destino, tipo_destino)
+    saida.inicia(registro)
+    saida.fecha()
+    return True
+
+
+def migra_mt(origem: str, destino: str, tipo_origem: TipoArmazenamento = TipoArmazenamento.tinydb, tipo_destino: TipoArmazenamento = TipoArmazenamento.sqlite) -> int:
+    """ Copia as autorizações da memória de trabalho de um armazenamento para outro,
+    preservando a ordem de inserção. O destino é esvaziado antes da cópia.
+
+    Args:
+        origem (str): arquivo da memória de trabalho existente
+        destino (str): arquivo da nova memória de trabalho
+        tipo_origem (TipoArmazenamento, optional): implementação do banco de origem. Defaults to TipoArmazenamento.tinydb.
+        tipo_destino (TipoArmazenamento, optional): implementação do banco de destino. Defaults to TipoArmazenamento.sqlite.
+
+    Returns:
+        int: número de autorizações copiadas
+    """
+    entrada = abre_armazenamento_mt(origem, tipo_origem)
+    documentos = entrada.carrega()
+    entrada.fecha()
+
+    saida = abre_armazenamento_mt(destino, tipo_destino)
+    saida.limpa()
+    for _, documento in documentos:
+        saida.insere(documento)
+    saida.fecha()
+    return len(documentos)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migra as memórias segura e de trabalho de um DAF virtual entre implementações de armazenamento.')
+    parser.add_argument('--ms', help='memória segura existente (ex: ./ms.json)')
+    parser.add_argument('--mt', help='memória de trabalho existente (ex: ./mt.json)')
+    parser.add_argument('--ms-destino', help='nova memória segura. Padrão: --ms com a extensão do destino (.db para sqlite, .bin para mmap)')
+    parser.add_argument('--mt-destino', help='nova memória de trabalho. Padrão: --mt com a extensão do destino (.db para sqlite, .log para log)')
+    parser.add_argument('--de', default=TipoArmazenamento.tinydb.value, choices=[t.value for t in TipoArmazenamento])
+    parser.add_argument('--para', default=TipoArmazenamento.sqlite.value, choices=[t.value for t in TipoArmazenamento])
+    args = parser.parse_args()
+
+    de = TipoArmazenamento(args.de)
+    para = TipoArmazenamento(args.para)
+
+    if args.ms != None:
+        destino = args.ms_destino if args.ms_destino != None else os.path.splitext(args.ms)[0] + EXTENSOES[para]
+        if migra_ms(args.ms, destino, de, para):
+            print(f"Memória segura copiada para {destino}")
+        else:
+            print(f"Memória segura {args.ms} está vazia")
+
+    if args.mt != None:
+        destino = args.mt_destino if args.mt_destino != None else os.path.splitext(args.mt)[0] + EXTENSOES[para]
+        print(f"{migra_mt(args.mt, destino, de, para)} autorizações copiadas para {destino}")
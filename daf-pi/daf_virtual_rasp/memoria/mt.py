@@ -1,132 +1,183 @@
-from typing import Dict, List, Union
-from tinydb import TinyDB, Query
-import os
+from typing import Dict, Iterator, List, Union
+import bisect
 
-from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento, abre_armazenamento_mt
+from daf_virtual_rasp.memoria.autorizacao import AutorizacaoDFE
 
 class MemoriaDeTrabalho:
     """Classe que deve ser usada para gerenciar as autorizações de DFes na memória do DAF Virtual.
     """
 
-    def __init__(self, arquivo : str = './mt.json'):
+    CAMPOS_INDEXADOS = ('aut', 'hdf', 'cnt')
+
+    def __init__(self, arquivo : str = './mt.json', armazenamento : TipoArmazenamento = TipoArmazenamento.tinydb, opcoes_armazenamento : dict = None):
         """Inicializa a memória de trabalho, criando arquivo do banco de dados caso não exista.
 
         Args:
             arquivo (str, optional): Nome do arquivo onde será salvo o banco de dados. Defaults to './mt.json'.
+            armazenamento (TipoArmazenamento, optional): implementação do banco. Defaults to TipoArmazenamento.tinydb.
+            opcoes_armazenamento (dict, optional): argumentos do construtor do armazenamento. Defaults to None.
         """
         self.arquivo = arquivo
 
-        # cria pasta se não existe ainda
-        dirname = os.path.dirname(self.arquivo)
-        if not os.path.isdir(dirname):
-            os.makedirs(dirname)
+        # cria pasta se não existe ainda e abre o banco
+        self.banco = abre_armazenamento_mt(self.arquivo, armazenamento, **(opcoes_armazenamento or {}))
 
-        self.banco = TinyDB(self.arquivo)
-        self.query = Query()
+        # autorizações em memória (doc_id -> AutorizacaoDFE) e índices campo -> valor compacto -> doc_id
+        self.documentos = {}
+        self.ordem = []             # doc_ids em ordem de inserção
+        self.indices = {campo: {} for campo in self.CAMPOS_INDEXADOS}
+        for doc_id, autorizacao in self.banco.carrega():
+            autorizacao.doc_id = doc_id
+            self.__indexa(autorizacao)
 
     def __del__(self):
 
-        self.banco.close()
+        self.banco.fecha()
+
+    def sincroniza(self):
+        """ Sincroniza com o disco as alterações que o armazenamento ainda não gravou (ex: o
+        lote em aberto do log com registros_por_sync > 1)
+        """
+        self.banco.sincroniza()
+
+    def __indexa(self, autorizacao: AutorizacaoDFE):
+        self.documentos[autorizacao.doc_id] = autorizacao
+        bisect.insort(self.ordem, autorizacao.doc_id)
+        for campo, indice in self.indices.items():
+            indice[getattr(autorizacao, campo)] = autorizacao.doc_id
+
+    def __desindexa(self, autorizacao: AutorizacaoDFE):
+        del self.documentos[autorizacao.doc_id]
+        del self.ordem[bisect.bisect_left(self.ordem, autorizacao.doc_id)]
+        for campo, indice in self.indices.items():
+            if indice.get(getattr(autorizacao, campo)) == autorizacao.doc_id:
+                del indice[getattr(autorizacao, campo)]
+
+    def __busca(self, info: Union[str, bytes, int], campo: str) -> List[AutorizacaoDFE]:
+        """ Busca as autorizações com o valor informado no campo, pelo índice quando o campo é indexado
+
+        Args:
+            info (Union[str, bytes, int]): conteúdo da informação buscada (campos binários em base64url ou bytes)
+            campo (str): o campo que deve ser usado na busca
 
-    def existe_autorizacao_DFE(self, info : str, campo : str) -> bool:
+        Returns:
+            List[AutorizacaoDFE]: autorizações encontradas
+        """
+        if not campo in AutorizacaoDFE.CAMPOS:
+            return []
+        if campo in AutorizacaoDFE.CAMPOS_BINARIOS:
+            info = AutorizacaoDFE.compacta(info)
+
+        if campo in self.indices:
+            doc_id = self.indices[campo].get(info)
+            if doc_id == None:
+                return []
+            return [self.documentos[doc_id]]
+
+        return [autorizacao for autorizacao in self.documentos.values() if getattr(autorizacao, campo) == info]
+
+    def existe_autorizacao_DFE(self, info : Union[str, bytes], campo : str) -> bool:
         """Verifica se existe autorização na memória de trabalho (MT)
 
         Args:
-            info (str): conteúdo da informação que deve ser verificada.
+            info (Union[str, bytes]): conteúdo da informação que deve ser verificada.
             campo (str): o campo que deve ser usado para verificar a info
 
         Returns:
             bool: existe a autorização?
         """
-        busca = self.query[campo]
-        
-        result = self.banco.search(busca == info)
+        result = self.__busca(info, campo)
 
         if len(result) == 1:
             return True
         else:
             return False
             
-    def remove_autorizacao_DFE(self, idAut : str) -> bool:
+    def remove_autorizacao_DFE(self, idAut : Union[str, bytes]) -> bool:
         """ Remove uma autorização do banco
 
         Args:
-            idAut (str): Identificador da autorização
+            idAut (Union[str, bytes]): Identificador da autorização, em base64url ou bytes
 
         Returns:
             bool: Resultado do processo
         """
         
-        result = self.banco.remove(self.query.aut == idAut)
-
-        if len(result) == 1:
-            return True
-        else:
+        doc_id = self.indices['aut'].get(AutorizacaoDFE.compacta(idAut))
+        if doc_id == None:
             return False
 
+        self.banco.remove(doc_id)
+        self.__desindexa(self.documentos[doc_id])
+        return True
+
     def get_numero_de_autorizacoes_DFE(self) -> int:
-        return len(self.banco.all())
+        return len(self.documentos)
     
-    def add_autorizacao_DFE(self, idDAF : str, mop:int, pdv:str,versaoSB : str, cont : int, idAut : str, fragDFE : str, hashDFE : str) -> bool:
+    def add_autorizacao_DFE(self, idDAF : str, mop:int, pdv:str,versaoSB : str, cont : int, idAut : Union[str, bytes], fragDFE : Union[str, bytes], hashDFE : Union[str, bytes]) -> bool:
         """ Adiciona uma autorização no banco
 
         Args:
             idDAF (str): identificador único do daf
             versaoSB (str): versão do SB
             cont (int): valor do contador
-            idAut (str): Identificador da autorização
-            fragDFE (str): Fragmento com informações essenciais do DFe
-            hashDFE (str): Resumo do DFe
+            idAut (Union[str, bytes]): Identificador da autorização, em base64url ou bytes
+            fragDFE (Union[str, bytes]): Fragmento com informações essenciais do DFe, em base64url ou bytes
+            hashDFE (Union[str, bytes]): Resumo do DFe, em base64url ou bytes
 
         Returns:
             bool: resultado do processo
         """
 
-        documento = {
-            "daf"        : idDAF,
-            "vsb"     : versaoSB,
-            "mop"          : mop,
-            "pdv"          : pdv,
-            "cnt"         : cont,
-            "aut"        : idAut,
-            "fdf"      : fragDFE,
-            "hdf"      : hashDFE
-        }
+        autorizacao = AutorizacaoDFE(idDAF, versaoSB, mop, pdv, cont, idAut, fragDFE, hashDFE)
 
         # verifica se existe autorizacao com mesmo idAut, cont ou hash
-        result = self.banco.search((self.query.idAut == documento['aut']) | (self.query.cont == documento['cnt']) | (self.query.hashDFE == documento['hdf']))
-
-        # se existir, nao adiciona autorizacao!
-        if len(result) > 0:
-            return False
+        for campo in ('aut', 'cnt', 'hdf'):
+            # se existir, nao adiciona autorizacao!
+            if getattr(autorizacao, campo) in self.indices[campo]:
+                return False
 
-        self.banco.insert(documento)
+        autorizacao.doc_id = self.banco.insere(autorizacao)
+        self.__indexa(autorizacao)
         return True
 
-    def get_autorizacoes_DFE(self) -> list:
+    def get_autorizacoes_DFE(self) -> List[AutorizacaoDFE]:
         """ Método para obter todas as autorizações gravadas
 
         Returns:
-            list: Autorizações
+            List[AutorizacaoDFE]: Autorizações
         """
 
-        autorizacoes = self.banco.all()
+        autorizacoes = [self.documentos[doc_id] for doc_id in self.ordem]
 
         return autorizacoes
 
-    def get_autorizacao_DFE(self, info : str, campo:str ) -> Union[dict, None]:
+    def itera_autorizacoes_DFE(self, ini: int, fim: int) -> Iterator[AutorizacaoDFE]:
+        """ Método para percorrer as autorizações gravadas da posição ini até a posição fim,
+        na ordem em que foram inseridas, sem carregar as demais
+
+        Args:
+            ini (int): posição da primeira autorização (a partir de 1)
+            fim (int): posição da última autorização (inclusive)
+
+        Returns:
+            Iterator[AutorizacaoDFE]: Autorizações no intervalo
+        """
+        for doc_id in self.ordem[max(ini, 1)-1:fim]:
+            yield self.documentos[doc_id]
+
+    def get_autorizacao_DFE(self, info : Union[str, bytes], campo:str ) -> Union[AutorizacaoDFE, None]:
         """ Método para obter autorização
         
         Args:
-            info (str): conteúdo da informação que deve ser verificada.
+            info (Union[str, bytes]): conteúdo da informação que deve ser verificada.
             campo (str): o campo que deve ser usado para verificar a info
 
         Returns:
-            Union[dict, None]: autorização
+            Union[AutorizacaoDFE, None]: autorização, cujos campos são lidos com autorizacao['campo']
         """
-        busca = self.query[campo]
-
-        result = self.banco.search(busca == info)
+        result = self.__busca(info, campo)
 
         if len(result) == 0:
             return None
@@ -134,4 +185,8 @@ class MemoriaDeTrabalho:
         return result[0]
     
     def reinicia_memoria(self):
-        self.banco.truncate()
\ No newline at end of file
+        self.banco.limpa()
+        self.documentos.clear()
+        self.ordem.clear()
+        for indice in self.indices.values():
+            indice.clear()
\ No newline at end of file
@@ -0,0 +1,142 @@
+import argparse
+import mmap
+import os
+import shutil
+import struct
+from typing import BinaryIO, Dict, Union
+
+
+class ParticaoEmpacotada:
+
+    EXTENSAO = '.sb'
+    MAGICO = b'DAFSB\x00\x00\x01'
+    CABECALHO = struct.Struct('<8sI4x')         # mágico, número de campos
+    ENTRADA = struct.Struct('<QQ')              # posição e tamanho de cada campo
+
+    # campos da imagem, na ordem da tabela de posições
+    CAMPOS = ('versao', 'maxdfe', 'hash', 'assinatura', 'assinatura_ateste', 'codigo')
+
+    # arquivos de cada campo na partição em diretório
+    ARQUIVOS = {
+        'versao': 'versao.str',
+        'maxdfe': 'maxdfe.str',
+        'hash': 'hash.bin',
+        'assinatura': 'assinatura.bin',
+        'assinatura_ateste': 'assinatura_ateste.bin',
+        'codigo': 'codigo.bin'
+    }
+
+    def __init__(self, arquivo: str):
+        """ Partição do SB em um único arquivo: um cabeçalho, uma tabela com a posição e o
+        tamanho de cada campo e, em seguida, os campos. O arquivo é aberto uma única vez e
+        mapeado em memória; cada campo é uma fatia (memoryview) do mapeamento, sem cópia.
+
+        Args:
+            arquivo (str): arquivo da partição
+
+        Raises:
+            ValueError: se o arquivo não for uma partição empacotada válida
+        """
+        self.arquivo = arquivo
+        with open(arquivo, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.CABECALHO.size:
+                raise ValueError(f"{arquivo} não é uma partição do SB empacotada")
+            # o mapeamento continua válido depois que o arquivo é fechado (ou substituído)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magico, num_campos = self.CABECALHO.unpack_from(self.mm, 0)
+        if magico != self.MAGICO or num_campos != len(self.CAMPOS):
+            raise ValueError(f"{arquivo} não é uma partição do SB empacotada")
+
+        visao = memoryview(self.mm)
+        self.campos = {}
+        for i, campo in enumerate(self.CAMPOS):
+            posicao, tamanho = self.ENTRADA.unpack_from(self.mm, self.CABECALHO.size + i * self.ENTRADA.size)
+            if posicao + tamanho > len(self.mm):
+                raise ValueError(f"Campo {campo} fora dos limites de {arquivo}")
+            self.campos[campo] = visao[posicao:posicao + tamanho]
+
+    def campo(self, nome: str) -> memoryview:
+        """ Campo da imagem, como fatia do arquivo mapeado
+
+        Args:
+            nome (str): campo (ver CAMPOS)
+
+        Returns:
+            memoryview: conteúdo do campo
+        """
+        return self.campos[nome]
+
+    @staticmethod
+    def eh_empacotada(caminho: str) -> bool:
+        """ Indica se a partição informada é (ou deve ser criada como) um arquivo empacotado
+
+        Args:
+            caminho (str): partição do SB
+
+        Returns:
+            bool: Verdadeiro para um arquivo, ou para um caminho inexistente com a extensão EXTENSAO
+        """
+        if os.path.isdir(caminho):
+            return False
+        return os.path.isfile(caminho) or caminho.endswith(ParticaoEmpacotada.EXTENSAO)
+
+    @staticmethod
+    def grava(arquivo: str, campos: Dict[str, Union[bytes, BinaryIO]]):
+        """ Grava (ou substitui atomicamente) uma partição empacotada
+
+        Args:
+            arquivo (str): arquivo da partição
+            campos (Dict[str, Union[bytes, BinaryIO]]): conteúdo de cada campo. Arquivos abertos são copiados em blocos
+        """
+        tamanhos = []
+        for campo in ParticaoEmpacotada.CAMPOS:
+            valor = campos[campo]
+            tamanhos.append(os.fstat(valor.fileno()).st_size - valor.tell() if hasattr(valor, 'read') else len(valor))
+
+        diretorio = os.path.dirname(arquivo)
+        if diretorio and not os.path.isdir(diretorio):
+            os.makedirs(diretorio)
+
+        temporario = arquivo + '.novo'
+        with open(temporario, 'wb') as f:
+            f.write(ParticaoEmpacotada.CABECALHO.pack(ParticaoEmpacotada.MAGICO, len(ParticaoEmpacotada.CAMPOS)))
+            posicao = ParticaoEmpacotada.CABECALHO.size + len(ParticaoEmpacotada.CAMPOS) * ParticaoEmpacotada.ENTRADA.size
+            for tamanho in tamanhos:
+                f.write(ParticaoEmpacotada.ENTRADA.pack(posicao, tamanho))
+                posicao += tamanho
+            for campo in ParticaoEmpacotada.CAMPOS:
+                valor = campos[campo]
+                if hasattr(valor, 'read'):
+                    shutil.copyfileobj(valor, f)
+                else:
+                    f.write(valor)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, arquivo)
+
+
+def converte_particao(origem: str, destino: str):
+    """ Converte uma partição do SB em diretório (um arquivo por campo) para um arquivo empacotado
+
+    Args:
+        origem (str): diretório da partição existente
+        destino (str): arquivo da partição empacotada
+    """
+    arquivos = {campo: open(os.path.join(origem, nome), 'rb') for campo, nome in ParticaoEmpacotada.ARQUIVOS.items()}
+    try:
+        ParticaoEmpacotada.grava(destino, arquivos)
+    finally:
+        for arquivo in arquivos.values():
+            arquivo.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converte a partição do SB de um DAF virtual de diretório para um único arquivo empacotado.')
+    parser.add_argument('origem', help='diretório da partição existente (ex: ./daf_virtual_rasp/resources/imagem/sb)')
+    parser.add_argument('destino', nargs='?', help='arquivo da partição empacotada. Padrão: a origem com a extensão .sb')
+    args = parser.parse_args()
+
+    destino = args.destino if args.destino != None else args.origem.rstrip('/') + ParticaoEmpacotada.EXTENSAO
+    converte_particao(args.origem, destino)
+    print(f"Partição {args.origem} convertida para {destino}")
@@ -0,0 +1,197 @@
+import unittest
+import unittest.mock
+import json
+import os
+import tempfile
+
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento, abre_armazenamento_mt
+from daf_virtual_rasp.memoria.armazenamento_log import ArmazenamentoMTLog
+from daf_virtual_rasp.memoria.armazenamento_mmap import ArmazenamentoMSMmap
+from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura
+from daf_virtual_rasp.memoria.mt import MemoriaDeTrabalho
+from daf_virtual_rasp.memoria.migracao import migra_ms, migra_mt
+from daf_virtual_rasp.daf.daf_enums import Artefatos, Guardas, ParametrosAtualizacao
+from daf_virtual_rasp.daf.daf import DAF
+
+
+class TestaArmazenamento(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def arquivo(self, nome):
+        return os.path.join(self.dir.name, nome)
+
+    def preenche(self, ms, mt):
+        with ms.transacao():
+            ms.escrita(Artefatos.contador, 3)
+            ms.escrita(Guardas.NumDFe, 2)
+        for cont in range(1, 4):
+            mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", cont, 'aut%d' % cont, 'fdf%d' % cont, 'hdf%d' % cont)
+        mt.remove_autorizacao_DFE('aut2')
+
+    def confere(self, ms, mt):
+        self.assertEqual(ms.leitura(Artefatos.contador), 3)
+        self.assertEqual(ms.leitura(Guardas.NumDFe), 2)
+        self.assertEqual([aut['aut'] for aut in mt.get_autorizacoes_DFE()], ['aut1', 'aut3'])
+        self.assertEqual(mt.get_autorizacao_DFE('hdf3', 'hdf')['fdf'], 'fdf3')
+
+    def testa_implementacoes(self):
+        for tipo in TipoArmazenamento:
+            with self.subTest(tipo=tipo):
+                arquivo_ms = self.arquivo('ms-' + tipo.value)
+                arquivo_mt = self.arquivo('mt-' + tipo.value)
+                tipo_ms = tipo if tipo != TipoArmazenamento.log else TipoArmazenamento.tinydb
+                tipo_mt = tipo if tipo != TipoArmazenamento.mmap else TipoArmazenamento.tinydb
+                ms = MemoriaSegura(arquivo_ms, armazenamento=tipo_ms)
+                mt = MemoriaDeTrabalho(arquivo_mt, armazenamento=tipo_mt)
+                iddaf = ms.leitura(Artefatos.IDDAF)
+                self.preenche(ms, mt)
+                self.confere(ms, mt)
+
+                # reabre os bancos
+                mt.banco.fecha()
+                ms = MemoriaSegura(arquivo_ms, armazenamento=tipo_ms)
+                mt = MemoriaDeTrabalho(arquivo_mt, armazenamento=tipo_mt)
+                self.confere(ms, mt)
+
+                self.assertTrue(ms.reinicia_memoria())
+                mt.reinicia_memoria()
+                mt.banco.fecha()
+                ms = MemoriaSegura(arquivo_ms, armazenamento=tipo_ms)
+                mt = MemoriaDeTrabalho(arquivo_mt, armazenamento=tipo_mt)
+                self.assertEqual(ms.leitura(Artefatos.contador), 0)
+                self.assertEqual(ms.leitura(Artefatos.IDDAF), iddaf)
+                self.assertEqual(mt.get_numero_de_autorizacoes_DFE(), 0)
+
+    def testa_migracao(self):
+        ms = MemoriaSegura(self.arquivo('ms.json'))
+        mt = MemoriaDeTrabalho(self.arquivo('mt.json'))
+        self.preenche(ms, mt)
+
+        self.assertTrue(migra_ms(self.arquivo('ms.json'), self.arquivo('ms.db')))
+        self.assertEqual(migra_mt(self.arquivo('mt.json'), self.arquivo('mt.db')), 2)
+
+        ms = MemoriaSegura(self.arquivo('ms.db'), armazenamento=TipoArmazenamento.sqlite)
+        mt = MemoriaDeTrabalho(self.arquivo('mt.db'), armazenamento=TipoArmazenamento.sqlite)
+        self.confere(ms, mt)
+
+    def testa_tipos_sqlite(self):
+        arquivo = self.arquivo('mt.db')
+        mt = MemoriaDeTrabalho(arquivo, armazenamento=TipoArmazenamento.sqlite)
+        mt.add_autorizacao_DFE("iddaf", 0, "pdv", 1, 1, 'aut1', 'fdf1', 'hdf1')
+        mt.add_autorizacao_DFE("iddaf", 0, "pdv", "2", 2, 'aut2', 'fdf2', 'hdf2')
+
+        # a versão do SB volta com o tipo em que foi gravada
+        mt = MemoriaDeTrabalho(arquivo, armazenamento=TipoArmazenamento.sqlite)
+        self.assertEqual([aut['vsb'] for aut in mt.get_autorizacoes_DFE()], [1, "2"])
+        self.assertIsInstance(mt.get_autorizacao_DFE('aut1', 'aut')['vsb'], int)
+
+    def testa_log_com_escrita_interrompida(self):
+        arquivo = self.arquivo('mt.log')
+        mt = MemoriaDeTrabalho(arquivo, TipoArmazenamento.log)
+        self.preenche(MemoriaSegura(self.arquivo('ms.json')), mt)
+        mt.banco.fecha()
+
+        with open(arquivo, 'ab') as log:
+            log.write(ArmazenamentoMTLog.CABECALHO.pack(b'+', 4, 120) + b'\x00' * 30)
+
+        mt = MemoriaDeTrabalho(arquivo, TipoArmazenamento.log)
+        self.assertEqual([aut['aut'] for aut in mt.get_autorizacoes_DFE()], ['aut1', 'aut3'])
+        self.assertTrue(mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", 4, 'aut4', 'fdf4', 'hdf4'))
+        mt.banco.fecha()
+
+        mt = MemoriaDeTrabalho(arquivo, TipoArmazenamento.log)
+        self.assertEqual([aut['aut'] for aut in mt.get_autorizacoes_DFE()], ['aut1', 'aut3', 'aut4'])
+        mt.banco.fecha()
+
+    def testa_compactacao_do_log(self):
+        arquivo = self.arquivo('mt.log')
+        opcoes = {'registros_por_sync': 8, 'minimo_compactacao': 20}
+        mt = MemoriaDeTrabalho(arquivo, TipoArmazenamento.log, opcoes)
+        for cont in range(1, 101):
+            mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", cont, 'aut%d' % cont, 'fdf', 'hdf%d' % cont)
+            if cont % 10 != 0:
+                mt.remove_autorizacao_DFE('aut%d' % cont)
+
+        # compactações automáticas mantêm o log perto do número de autorizações vivas
+        mt.banco.compacta()
+        self.assertEqual(mt.banco.registros, 10)
+
+        self.assertTrue(mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", 101, 'aut101', 'fdf', 'hdf101'))
+        mt.banco.fecha()
+
+        # o arquivo compactado contém apenas as autorizações vivas
+        mt = MemoriaDeTrabalho(arquivo, TipoArmazenamento.log)
+        self.assertEqual(mt.banco.registros, 11)
+        self.assertEqual([aut['cnt'] for aut in mt.get_autorizacoes_DFE()], list(range(10, 101, 10)) + [101])
+        self.assertIsInstance(mt.banco, ArmazenamentoMTLog)
+        mt.banco.fecha()
+
+        # apenas o log aceita opções
+        for tipo in (TipoArmazenamento.tinydb, TipoArmazenamento.sqlite):
+            with self.assertRaises(ValueError):
+                abre_armazenamento_mt(self.arquivo('mt-' + tipo.value), tipo, **opcoes)
+
+    def testa_log_sincronizado_antes_da_resposta(self):
+        daf = DAF(self.arquivo('ms.json'), self.arquivo('mt.log'), armazenamento_mt=TipoArmazenamento.log,
+                  opcoes_armazenamento_mt={'registros_por_sync': 8})
+        daf.set_inferior(unittest.mock.Mock())
+        self.assertEqual(daf.mt.banco.registros_por_sync, 8)
+
+        daf.mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", 1, 'aut1', 'fdf1', 'hdf1')
+        self.assertEqual(daf.mt.banco.nao_sincronizados, 1)
+
+        # o lote em aberto é sincronizado quando a transação do pedido termina, antes da resposta
+        daf.notifica(b'\x01', json.dumps({'msg': 8}))
+        self.assertEqual(daf.mt.banco.nao_sincronizados, 0)
+        daf.inferior.envia.assert_called_once()
+        daf.mt.banco.fecha()
+
+    def testa_mmap(self):
+        arquivo = self.arquivo('ms.bin')
+        ms = MemoriaSegura(arquivo, armazenamento=TipoArmazenamento.mmap)
+        certificado = ms.leitura(Artefatos.certificado).certificado_str
+        with ms.transacao():
+            ms.escrita(Artefatos.contador, 7)
+            ms.escrita(Guardas.Estado, 'ATIVO')
+        self.assertEqual(ms.banco.le(Artefatos.contador.value), 7)
+        self.assertEqual(ms.banco.le(Guardas.Estado.value), 'ATIVO')
+
+        # valor que não cabe no campo fixo é recusado sem alterar o registro
+        self.assertFalse(ms.escrita(Artefatos.IDDAF, 'x' * 40))
+        self.assertNotEqual(ms.leitura(Artefatos.IDDAF), 'x' * 40)
+
+        # dentro de uma transação o valor também é recusado na escrita, e a transação segue gravável
+        with ms.transacao():
+            self.assertFalse(ms.escrita(Guardas.Estado, 'x' * 17))
+            self.assertTrue(ms.escrita(Guardas.NumDFe, 42))
+        self.assertEqual(ms.banco.le(Guardas.NumDFe.value), 42)
+        self.assertEqual(ms.banco.le(Guardas.Estado.value), 'ATIVO')
+
+        # a cauda cresce além da capacidade inicial
+        self.assertTrue(ms.escrita(ParametrosAtualizacao.assinaturaSEF, b'a' * 20000))
+        assinatura = ms.leitura(ParametrosAtualizacao.assinaturaSEF)
+        self.assertTrue(ms.escrita(Artefatos.contador, 8))
+        ms.banco.fecha()
+
+        # uma gravação interrompida (cópia corrompida) mantém a versão anterior
+        banco = ArmazenamentoMSMmap(arquivo)
+        vigente = banco.vigente
+        banco.fecha()
+        with open(arquivo, 'r+b') as arq:
+            arq.seek(ArmazenamentoMSMmap.CABECALHO.size + vigente * banco.capacidade + banco.inicio_cauda)
+            arq.write(b'\xff' * 8)
+
+        ms = MemoriaSegura(arquivo, armazenamento=TipoArmazenamento.mmap)
+        self.assertEqual(ms.leitura(Artefatos.contador), 7)
+        self.assertEqual(ms.leitura(ParametrosAtualizacao.assinaturaSEF), assinatura)
+        self.assertEqual(ms.leitura(Artefatos.certificado).certificado_str, certificado)
+        ms.banco.fecha()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
-from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, ChaveCripto, Certificado
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, ChaveCripto, Certificado, ContextoHMAC
 
 
 class TestaCriptoDAF(unittest.TestCase):
@@ -57,6 +59,53 @@ class TestaCriptoDAF(unittest.TestCase):
         self.assertFalse(CriptoDAF.verifica_HMAC_SHA256(
             b'chave', self.msg, b'outro-resumo'))
 
+    def testa_contextoHMAC(self):
+
+        contexto = ContextoHMAC(b'chave')
+        self.assertEqual(contexto.gera(self.msg), self.msg_hmac)
+        self.assertEqual(contexto.gera(self.msg), self.msg_hmac)
+        self.assertTrue(contexto.verifica(self.msg, self.msg_hmac))
+        self.assertFalse(contexto.verifica(self.msg, b'outro-resumo'))
+        self.assertEqual(CriptoDAF.gera_HMAC_SHA256(contexto, self.msg), self.msg_hmac)
+        self.assertTrue(CriptoDAF.verifica_HMAC_SHA256(contexto, self.msg, self.msg_hmac))
+
+    def testa_cacheVerificacaoEC_P384(self):
+
+        chave = ec.generate_private_key(ec.SECP384R1())
+        pem = chave.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
+        assinatura = chave.sign(self.msg, ec.ECDSA(hashes.SHA384()))
+        consultas = CriptoDAF.consultas_verificacoes_EC
+
+        faltas = consultas['faltas']
+        self.assertTrue(CriptoDAF.verifica_assinatura_EC_P384(self.msg, assinatura, ChaveCripto(pem)))
+        self.assertEqual(consultas['faltas'], faltas + 1)
+
+        # a mesma verificação, com outra instância da chave, vem do cache
+        acertos = consultas['acertos']
+        outra = ChaveCripto(pem)
+        self.assertTrue(CriptoDAF.verifica_assinatura_EC_P384(self.msg, assinatura, outra))
+        self.assertEqual(consultas['acertos'], acertos + 1)
+        self.assertEqual(consultas['faltas'], faltas + 1)
+
+        # falhas não são guardadas
+        for _ in range(2):
+            self.assertFalse(CriptoDAF.verifica_assinatura_EC_P384(self.msg + b'!', assinatura, outra))
+        self.assertEqual(consultas['faltas'], faltas + 3)
+        self.assertFalse(CriptoDAF.verifica_assinatura_EC_P384(self.msg, assinatura, CriptoDAF.gera_chave_EC_p256()[1]))
+
+        for i in range(CriptoDAF.LIMITE_VERIFICACOES_EC + 1):
+            msg = b'%d' % i
+            self.assertTrue(CriptoDAF.verifica_assinatura_EC_P384(msg, chave.sign(msg, ec.ECDSA(hashes.SHA384())), outra))
+        self.assertEqual(len(CriptoDAF.VERIFICACOES_EC), CriptoDAF.LIMITE_VERIFICACOES_EC)
+        faltas = consultas['faltas']
+        self.assertTrue(CriptoDAF.verifica_assinatura_EC_P384(self.msg, assinatura, outra))
+        self.assertEqual(consultas['faltas'], faltas + 1)
+
+        # a chave decodificada na verificação é a mesma usada pelo JWTDAF, também a partir do PEM em bytes
+        acertos = CriptoDAF.consultas_chaves['acertos']
+        self.assertIs(CriptoDAF.chave_carregada(pem.encode('utf-8')), CriptoDAF.chave_carregada(outra))
+        self.assertEqual(CriptoDAF.consultas_chaves['acertos'], acertos + 2)
+
     def testa_geraResumoSHA256(self):
 
         self.assertTrue(len(CriptoDAF.gera_resumo_SHA256(self.msg)) == 32)
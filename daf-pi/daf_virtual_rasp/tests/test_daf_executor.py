@@ -0,0 +1,95 @@
+import unittest
+import json
+import os
+import tempfile
+import threading
+import unittest.mock
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+
+from daf_virtual_rasp.daf.daf import DAF
+from daf_virtual_rasp.daf.daf_enums import Artefatos
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento
+from daf_virtual_rasp.com.layer import Layer
+from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.particao_sb import ParticaoEmpacotada
+
+
+class CamadaInferiorFalsa(Layer):
+
+    def __init__(self):
+        Layer.__init__(self, None, 0)
+        self.disable_timeout()
+        self.enviados = []
+
+    def envia(self, dados, tipo):
+        self.enviados.append((json.loads(bytes(dados)), threading.get_ident()))
+
+
+class TestaDAFComExecutor(unittest.TestCase):
+
+    def setUp(self):
+        with open('daf_virtual_rasp/resources/sef-priv-ec.pem', 'rb') as arquivo:
+            self.chave_sef = arquivo.read()
+
+    def testa_pedidos_no_executor(self):
+        for tipo in (TipoArmazenamento.tinydb, TipoArmazenamento.sqlite):
+            with self.subTest(armazenamento=tipo.value), tempfile.TemporaryDirectory() as diretorio, ThreadPoolExecutor(1) as executor:
+                daf = DAF(os.path.join(diretorio, 'ms.json'), os.path.join(diretorio, 'mt.json'), armazenamento=tipo, executor=executor)
+                inferior = CamadaInferiorFalsa()
+                daf.set_inferior(inferior)
+                pol = Poller()
+                pol.adiciona(daf)
+                pol.adiciona(inferior)
+
+                # o registro grava o novo par de chaves na memória segura a partir da thread do executor
+                daf.notifica(b'\x01', json.dumps({'msg': 1, 'jwt': jwt.encode({'nnc': 'abc'}, self.chave_sef, algorithm='ES384')}))
+                daf.notifica(b'\x01', json.dumps({'msg': 14}))
+                pol.despache()
+
+                self.assertEqual([resposta['res'] for resposta, _ in inferior.enviados], [0, 0])
+                self.assertTrue(all(thread == threading.get_ident() for _, thread in inferior.enviados))
+                self.assertEqual(daf.ms.leitura(Artefatos.chavePublica).chave_str,
+                                 DAF(os.path.join(diretorio, 'ms.json'), os.path.join(diretorio, 'mt.json'), armazenamento=tipo).ms.leitura(Artefatos.chavePublica).chave_str)
+
+
+class TestaAtualizacaoSB(unittest.TestCase):
+
+    def testa_particao_empacotada_gravada_fora_do_laco(self):
+        particao = 'daf_virtual_rasp/resources/outra-imagem/sb/'
+        imagem = b''
+        for arquivo in ('versao.str', 'maxdfe.str', 'hash.bin', 'assinatura.bin', 'assinatura_ateste.bin', 'codigo.bin'):
+            with open(particao + arquivo, 'rb') as f:
+                imagem += f.read()
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            candidata = os.path.join(diretorio, 'candidata.sb')
+            daf = DAF(os.path.join(diretorio, 'ms.json'), os.path.join(diretorio, 'mt.json'), path_sb_candidato=candidata)
+            inferior = CamadaInferiorFalsa()
+            daf.set_inferior(inferior)
+            pol = Poller()
+            pol.adiciona(daf)
+            pol.adiciona(inferior)
+
+            recepcao = daf.nova_recepcao_sb()
+            recepcao.adiciona(imagem)
+            recepcao.conclui()
+
+            # o código recebido é copiado para o arquivo da partição na thread dos resumos
+            gravacoes = []
+            grava = ParticaoEmpacotada.grava
+            with unittest.mock.patch.object(ParticaoEmpacotada, 'grava', side_effect=lambda *args: gravacoes.append(threading.get_ident()) or grava(*args)):
+                daf.notifica(b'\x02', recepcao)
+                self.assertEqual(gravacoes, [])
+                pol.despache()
+
+            self.assertEqual(len(gravacoes), 1)
+            self.assertNotEqual(gravacoes[0], threading.get_ident())
+            self.assertEqual(len(inferior.enviados), 1)
+            self.assertTrue(os.path.isfile(candidata))
+            self.assertFalse(os.path.exists(recepcao.arquivo_codigo))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+import unittest.mock
+import io
+import os
+import hashlib
+import secrets
+import socket
+import tempfile
+import threading
+import time
+
+from daf_virtual_rasp.com.enquadramento import Enquadramento
+from daf_virtual_rasp.com.enq_enum import TIPO_t
+from daf_virtual_rasp.com.arq import Arq
+from daf_virtual_rasp.com.arq_enum import CONTROLE_t
+from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.imagem import RecepcaoImagemSB
+
+
+class SerialFalsa(io.BytesIO):
+
+    @property
+    def in_waiting(self):
+        return len(self.getbuffer()) - self.tell()
+
+
+class CamadaSuperiorFalsa:
+
+    def __init__(self):
+        self.quadros = []
+
+    def notifica(self, controle, dados, tipo):
+        self.quadros.append((controle, bytes(dados), tipo))
+
+
+class ReceptorFalso:
+
+    def __init__(self):
+        self.blocos = []
+        self.tamanho = 0
+        self.concluido = False
+        self.descartado = False
+
+    def adiciona(self, bloco):
+        self.blocos.append(bytes(bloco))
+        self.tamanho += len(bloco)
+
+    def conclui(self):
+        self.concluido = True
+
+    def descarta(self):
+        self.descartado = True
+
+    def pausa_leitura(self, retomada, final=False):
+        return False
+
+
+class TestaEnquadramento(unittest.TestCase):
+
+    def setUp(self):
+        msg = b'\x00' + b'{"msg":8}'
+        binario = b'\x08' + bytes(range(256)) * 40
+        self.fluxo = b'\xff' + TIPO_t.ENVIARMSG.value + len(msg).to_bytes(2, 'big') + msg \
+            + TIPO_t.ENVIARBINARIO.value + len(binario).to_bytes(4, 'big') + binario \
+            + TIPO_t.PING.value + (2).to_bytes(2, 'big') + b'\x00\x01'
+
+    def __cria(self, leitura_em_bloco):
+        superior = CamadaSuperiorFalsa()
+        e = Enquadramento(SerialFalsa(self.fluxo), 0.5, leitura_em_bloco)
+        e.set_superior(superior)
+        return e, superior
+
+    def testa_leitura_em_bloco_igual_byte_a_byte(self):
+        e_byte, sup_byte = self.__cria(False)
+        for _ in range(len(self.fluxo)):
+            e_byte.handle()
+
+        e_bloco, sup_bloco = self.__cria(True)
+        e_bloco.handle()
+
+        self.assertEqual(len(sup_bloco.quadros), 3)
+        self.assertEqual(sup_bloco.quadros, sup_byte.quadros)
+        self.assertTrue(e_bloco.is_ping())
+        self.assertFalse(e_bloco.timeout_enabled)
+
+    def testa_quadro_dividido_entre_blocos(self):
+        e, superior = self.__cria(True)
+        for i in range(0, len(self.fluxo), 7):
+            e.handle_bloco(self.fluxo[i:i+7])
+
+        self.assertEqual(len(superior.quadros), 3)
+        self.assertEqual(superior.quadros[1][0], 0x08)
+        self.assertEqual(superior.quadros[1][1], bytes(range(256)) * 40)
+        self.assertEqual(superior.quadros[1][2], TIPO_t.ENVIARBINARIO.value)
+
+    def testa_binario_recebido_em_blocos(self):
+        for leitura_em_bloco in (True, False):
+            superior = CamadaSuperiorFalsa()
+            receptores = []
+            e = Enquadramento(SerialFalsa(self.fluxo), 0.5, leitura_em_bloco, receptor_binario=lambda: receptores.append(ReceptorFalso()) or receptores[-1])
+            e.set_superior(superior)
+            superior.notifica = lambda controle, dados, tipo: superior.quadros.append((controle, dados, tipo))
+            if leitura_em_bloco:
+                for i in range(0, len(self.fluxo), 1000):
+                    e.handle_bloco(self.fluxo[i:i+1000])
+            else:
+                for _ in range(len(self.fluxo)):
+                    e.handle()
+
+            self.assertEqual(len(superior.quadros), 3)
+            controle, receptor, tipo = superior.quadros[1]
+            self.assertEqual((controle, tipo), (0x08, TIPO_t.ENVIARBINARIO.value))
+            self.assertEqual(receptores, [receptor])
+            self.assertTrue(receptor.concluido)
+            self.assertEqual(b''.join(receptor.blocos), bytes(range(256)) * 40)
+            self.assertLessEqual(max(len(b) for b in receptor.blocos), 1000)
+            # as mensagens continuam sendo acumuladas
+            self.assertEqual(bytes(superior.quadros[0][1]), b'{"msg":8}')
+            self.assertIsNone(e.recepcao)
+            self.assertFalse(receptor.descartado)
+
+    def testa_binario_descartado(self):
+        # quadro interrompido: o timeout descarta a recepção
+        receptores = []
+        e = Enquadramento(SerialFalsa(), 0.5, True, receptor_binario=lambda: receptores.append(ReceptorFalso()) or receptores[-1])
+        e.set_superior(CamadaSuperiorFalsa())
+        e.handle_bloco(TIPO_t.ENVIARBINARIO.value + (5000).to_bytes(4, 'big') + b'\x00' + bytes(1000))
+        e.handle_timeout()
+        self.assertTrue(receptores[0].descartado)
+        self.assertIsNone(e.recepcao)
+
+        # quadro repetido: o ARQ não o entrega e descarta a recepção
+        arq = Arq(3, 1)
+        inferior = unittest.mock.Mock()
+        inferior.is_ping.return_value = False
+        arq.set_inferior(inferior)
+        arq.set_superior(unittest.mock.Mock())
+        primeiro, repetido = ReceptorFalso(), ReceptorFalso()
+        arq.notifica(CONTROLE_t.DATA_0.value, primeiro, TIPO_t.ENVIARBINARIO.value)
+        arq.notifica(CONTROLE_t.DATA_0.value, repetido, TIPO_t.ENVIARBINARIO.value)
+        arq.superior.notifica.assert_called_once_with(TIPO_t.ENVIARBINARIO.value, primeiro)
+        self.assertFalse(primeiro.descartado)
+        self.assertTrue(repetido.descartado)
+
+    def testa_leitura_suspensa_pelo_receptor(self):
+        versao, maxdfe, codigo = b'\x00\x03', b'\x03\xe8', secrets.token_bytes(200000)
+        resumo = hashlib.sha256(versao + codigo + maxdfe).digest()
+        binario = b'\x08' + versao + maxdfe + resumo + secrets.token_bytes(206) + codigo
+        msg = b'\x00' + b'{"msg":8}'
+        fluxo = TIPO_t.ENVIARBINARIO.value + len(binario).to_bytes(4, 'big') + binario + TIPO_t.ENVIARMSG.value + len(msg).to_bytes(2, 'big') + msg
+
+        processa = RecepcaoImagemSB._RecepcaoImagemSB__processa
+        def processa_devagar(resumo, arquivo, bloco):
+            time.sleep(0.002)
+            processa(resumo, arquivo, bloco)
+
+        with tempfile.TemporaryDirectory() as dir, \
+                unittest.mock.patch.object(RecepcaoImagemSB, 'BLOCO_ENVIO', 4096), \
+                unittest.mock.patch.object(RecepcaoImagemSB, 'LIMITE_PENDENTES', 2), \
+                unittest.mock.patch.object(RecepcaoImagemSB, '_RecepcaoImagemSB__processa', staticmethod(processa_devagar)):
+            leitura, escrita = socket.socketpair()
+            poller = Poller()
+            superior = CamadaSuperiorFalsa()
+            superior.notifica = lambda controle, dados, tipo: superior.quadros.append((controle, dados, tipo))
+            e = Enquadramento(leitura.makefile('rb', buffering=0), 1, True, receptor_binario=lambda: RecepcaoImagemSB(os.path.join(dir, 'recebida'), poller))
+            e.set_superior(superior)
+            poller.adiciona(e)
+
+            envio = threading.Thread(target=escrita.sendall, args=(fluxo,))
+            envio.start()
+            pausas = 0
+            limite = time.monotonic() + 10
+            while len(superior.quadros) < 2 and time.monotonic() < limite:
+                poller.despache_simples()
+                pausas += e.pausada
+            envio.join()
+
+            # a leitura foi suspensa enquanto a thread dos resumos estava atrasada, sem perder bytes
+            self.assertGreater(pausas, 0)
+            self.assertEqual(len(superior.quadros), 2)
+            recepcao = superior.quadros[0][1]
+            self.assertEqual(recepcao.resumo_imagem, resumo)
+            with open(recepcao.arquivo_codigo, 'rb') as arquivo:
+                self.assertEqual(arquivo.read(), codigo)
+            self.assertEqual(bytes(superior.quadros[1][1]), b'{"msg":8}')
+            self.assertFalse(e.pausada)
+
+            recepcao.descarta()
+            poller.fecha()
+            leitura.close()
+            escrita.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import unittest.mock
+import json
+import os
+import sys
+import tempfile
+import time
+
+from daf_virtual_rasp.frota import FrotaDAF
+from daf_virtual_rasp.hospedeiro import EspecificacaoDAF
+
+
+def trabalhador_roteirizado(especificacoes, *parametros):
+    """ Substitui executa_trabalhador: cada execução segue o próximo passo do roteiro
+    gravado ao lado da MS do primeiro DAF, uma lista de [duração (s), código de saída]
+    """
+    diretorio = os.path.dirname(especificacoes[0]['ms'])
+    with open(os.path.join(diretorio, 'execucoes'), 'a+') as execucoes:
+        execucoes.seek(0)
+        passo = len(execucoes.readlines())
+        execucoes.write(f"{time.monotonic()}\n")
+    with open(os.path.join(diretorio, 'roteiro.json')) as roteiro:
+        duracao, codigo = json.load(roteiro)[passo]
+    time.sleep(duracao)
+    sys.exit(codigo)
+
+
+class TestaFrotaDAF(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def especificacoes(self, quantidade):
+        return [EspecificacaoDAF(os.path.join(self.dir.name, f'ms-{i}.json'), os.path.join(self.dir.name, f'mt-{i}.json'),
+                                 os.path.join(self.dir.name, f'sb-{i}'), socket=os.path.join(self.dir.name, f'daf-{i}.sock'))
+                for i in range(quantidade)]
+
+    def executa(self, roteiro):
+        """ Executa uma frota de um processo que segue o roteiro e devolve os instantes em que ele foi iniciado
+        """
+        with open(os.path.join(self.dir.name, 'roteiro.json'), 'w') as arquivo:
+            json.dump(roteiro, arquivo)
+        frota = FrotaDAF(self.especificacoes(1), 1)
+        with unittest.mock.patch('daf_virtual_rasp.frota.executa_trabalhador', trabalhador_roteirizado):
+            frota.executa()
+        with open(os.path.join(self.dir.name, 'execucoes')) as execucoes:
+            return frota, [float(linha) for linha in execucoes]
+
+    def testa_reparte(self):
+        especificacoes = self.especificacoes(5)
+        self.assertEqual(FrotaDAF.reparte(especificacoes, 2), [especificacoes[0::2], especificacoes[1::2]])
+        self.assertEqual(FrotaDAF.reparte(especificacoes, 1), [especificacoes])
+
+        # nunca há mais processos que DAFs, e cada DAF fica em exatamente um processo
+        frota = FrotaDAF(especificacoes, 8)
+        self.assertEqual(len(frota.parcelas), 5)
+        frota = FrotaDAF(especificacoes, 3)
+        self.assertEqual([len(parcela) for parcela in frota.parcelas], [2, 2, 1])
+        self.assertEqual(sorted(espec.nome for parcela in frota.parcelas for espec in parcela), sorted(espec.nome for espec in especificacoes))
+
+        with self.assertRaises(ValueError):
+            FrotaDAF(especificacoes + especificacoes[:1], 2)
+
+    @unittest.mock.patch.object(FrotaDAF, 'INTERVALO_REINICIO', 0.05)
+    @unittest.mock.patch.object(FrotaDAF, 'INTERVALO_REINICIO_MAX', 0.15)
+    def testa_reinicio_com_espera_crescente(self):
+        frota, inicios = self.executa([[0, 1], [0, 1], [0, 1], [0, 1], [0, 0]])
+
+        # a espera dobra a cada falha seguida, até o máximo
+        self.assertEqual(len(inicios), 5)
+        intervalos = [depois - antes for antes, depois in zip(inicios, inicios[1:])]
+        for intervalo, espera in zip(intervalos, [0.05, 0.1, 0.15, 0.15]):
+            self.assertGreaterEqual(intervalo, espera)
+        self.assertEqual(frota.espera[0], 0.15)
+        self.assertEqual(frota.trabalhadores, [None])
+
+    @unittest.mock.patch.object(FrotaDAF, 'INTERVALO_REINICIO', 0.05)
+    @unittest.mock.patch.object(FrotaDAF, 'INTERVALO_REINICIO_MAX', 10.0)
+    @unittest.mock.patch.object(FrotaDAF, 'TEMPO_ESTAVEL', 0.3)
+    def testa_espera_zerada_apos_execucao_estavel(self):
+        frota, inicios = self.executa([[0, 1], [0, 1], [0.4, 1], [0, 0]])
+
+        # a terceira execução passou do TEMPO_ESTAVEL: o reinício seguinte volta à espera inicial
+        self.assertEqual(len(inicios), 4)
+        self.assertGreaterEqual(inicios[2] - inicios[1], 0.1)
+        self.assertLess(inicios[3] - inicios[2], 0.4 + 0.1)
+        self.assertEqual(frota.espera[0], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+import json
+import os
+import select
+import socket
+import tempfile
+import time
+
+from daf_virtual_rasp.hospedeiro import EspecificacaoDAF, PilhaDAF, HospedeiroDAF
+from daf_virtual_rasp.memoria.armazenamento import TipoArmazenamento
+from daf_virtual_rasp.com.enq_enum import TIPO_t
+from daf_virtual_rasp.com.arq_enum import CONTROLE_t
+from daf_virtual_rasp.com.poller import Poller
+
+
+class TestaEspecificacaoDAF(unittest.TestCase):
+
+    def testa_de_dicionario(self):
+        espec = EspecificacaoDAF.de_dicionario({
+            'ms': 'dafs/daf-1/ms.db',
+            'mt': 'dafs/daf-1/mt.log',
+            'sb': 'dafs/daf-1/sb.sb',
+            'socket': '/tmp/daf-1.sock',
+            'armazenamento': 'sqlite',
+            'armazenamento_mt': 'log',
+            'opcoes_armazenamento_mt': {'registros_por_sync': 8}
+        })
+        self.assertEqual(espec.armazenamento, TipoArmazenamento.sqlite)
+        self.assertEqual(espec.armazenamento_mt, TipoArmazenamento.log)
+        self.assertEqual(espec.sb_candidato, 'dafs/daf-1/sb-candidato.sb')
+        self.assertEqual(espec.nome, '/tmp/daf-1.sock')
+        self.assertIsNone(espec.porta)
+        self.assertEqual(EspecificacaoDAF.de_dicionario(espec.para_dicionario()).para_dicionario(), espec.para_dicionario())
+
+        # valores padrão
+        espec = EspecificacaoDAF.de_dicionario({'ms': 'ms.json', 'mt': 'mt.json', 'sb': 'dafs/sb/', 'porta': '/dev/pts/2'})
+        self.assertEqual(espec.armazenamento, TipoArmazenamento.tinydb)
+        self.assertIsNone(espec.armazenamento_mt)
+        self.assertEqual(espec.sb_candidato, 'dafs/sb-candidato')
+        self.assertEqual(espec.nome, '/dev/pts/2')
+
+        invalidas = [
+            {'porta': '/dev/pts/2', 'socket': '/tmp/daf.sock'},
+            {},
+            {'porta': '/dev/pts/2', 'armazenamento': 'csv'},
+            {'porta': '/dev/pts/2', 'opcoes_armazenamento_mt': {'registros_por_sync': 8}}
+        ]
+        for extras in invalidas:
+            with self.subTest(extras=extras), self.assertRaises(ValueError):
+                EspecificacaoDAF.de_dicionario(dict({'ms': 'ms.json', 'mt': 'mt.json', 'sb': 'sb'}, **extras))
+
+
+class TestaHospedeiroDAF(unittest.TestCase):
+
+    def especificacao(self, i, **extras):
+        dic = {'ms': f'dafs/daf-{i}/ms.json', 'mt': f'dafs/daf-{i}/mt.json', 'sb': f'dafs/daf-{i}/sb', 'socket': f'/tmp/daf-{i}.sock'}
+        dic.update(extras)
+        return EspecificacaoDAF.de_dicionario(dic)
+
+    def testa_verifica_isolamento(self):
+        HospedeiroDAF.verifica_isolamento([self.especificacao(1), self.especificacao(2)])
+
+        compartilhados = {
+            'porta': (self.especificacao(1, socket=None, porta='/dev/pts/2'), self.especificacao(2, socket=None, porta='/dev/pts/2')),
+            'socket': (self.especificacao(1), self.especificacao(2, socket='/tmp/daf-1.sock')),
+            'ms': (self.especificacao(1), self.especificacao(2, ms='dafs/daf-1/ms.json')),
+            'mt': (self.especificacao(1), self.especificacao(2, mt='dafs/daf-1/mt.json')),
+            'sb': (self.especificacao(1), self.especificacao(2, sb='dafs/daf-1/sb', sb_candidato='dafs/daf-2/sb-candidato')),
+            'sb_candidato': (self.especificacao(1), self.especificacao(2, sb='dafs/daf-1/sb-candidato'))
+        }
+        for recurso, especificacoes in compartilhados.items():
+            with self.subTest(recurso=recurso), self.assertRaises(ValueError):
+                HospedeiroDAF.verifica_isolamento(especificacoes)
+
+
+class TestaPilhaDAF(unittest.TestCase):
+
+    def recebe_quadros(self, pol, conexao, quantidade):
+        """ Despacha a pilha até que o outro lado da conexão receba a quantidade de quadros
+        """
+        quadros = []
+        recebido = b''
+        limite = time.monotonic() + 5
+        while len(quadros) < quantidade and time.monotonic() < limite:
+            pol.despache_simples()
+            while select.select([conexao], [], [], 0)[0]:
+                recebido += conexao.recv(4096)
+            while len(recebido) >= 3 and len(recebido) >= 3 + int.from_bytes(recebido[1:3], 'big'):
+                tamanho = int.from_bytes(recebido[1:3], 'big')
+                quadros.append(recebido[3: 3 + tamanho])
+                recebido = recebido[3 + tamanho:]
+        return quadros
+
+    def testa_pedido_pelo_socket(self):
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'daf.sock')
+            servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            servidor.bind(caminho)
+            servidor.listen(1)
+
+            espec = EspecificacaoDAF(os.path.join(diretorio, 'ms.json'), os.path.join(diretorio, 'mt.json'), os.path.join(diretorio, 'sb'), socket=caminho)
+            pilha = PilhaDAF(espec)
+            conexao, _ = servidor.accept()
+            pol = Poller()
+            pilha.adiciona(pol)
+
+            # a partição do SB é criada a partir da imagem de fábrica
+            self.assertTrue(os.path.isfile(os.path.join(diretorio, 'sb', 'codigo.bin')))
+
+            dados = bytes([CONTROLE_t.DATA_0.value]) + b'{"msg":8}'
+            conexao.sendall(TIPO_t.ENVIARMSG.value + len(dados).to_bytes(2, 'big') + dados)
+            ack, resposta = self.recebe_quadros(pol, conexao, 2)
+            self.assertEqual(ack, bytes([CONTROLE_t.ACK_0.value]))
+            self.assertEqual(resposta[0], CONTROLE_t.DATA_0.value)
+            self.assertEqual(json.loads(resposta[1:])['est'], 'INATIVO')
+
+            conexao.sendall(TIPO_t.ENVIARMSG.value + (1).to_bytes(2, 'big') + bytes([CONTROLE_t.ACK_0.value]))
+            pol.despache_simples()
+
+            pilha.fecha()
+            pol.fecha()
+            conexao.close()
+            servidor.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
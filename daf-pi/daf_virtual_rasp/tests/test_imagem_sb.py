@@ -1,5 +1,9 @@
 import unittest
+import unittest.mock
 import secrets
+import hashlib
+import os
+import tempfile
 from unittest.case import TestCase
 
 from daf_virtual_rasp.utils.cripto_daf import ChaveCripto, CriptoDAF, Certificado
@@ -7,7 +11,7 @@ from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura
 from daf_virtual_rasp.daf.daf_enums import Artefatos, Guardas
 
 from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
-from daf_virtual_rasp.imagem import ImagemSB, ImagemSBCandidato
+from daf_virtual_rasp.imagem import ImagemSB, ImagemSBCandidato, RecepcaoImagemSB
 from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura
 
 class TestaImagem(unittest.TestCase):
@@ -43,3 +47,83 @@ class TestaImagem(unittest.TestCase):
         
         #sb.remove_particao()
 
+
+
+class TestaRecepcaoImagem(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        versao, maxdfe, codigo = b'\x00\x03', b'\x03\xe8', secrets.token_bytes(100000)
+        resumo = hashlib.sha256(versao + codigo + maxdfe).digest()
+        self.imagem = versao + maxdfe + resumo + secrets.token_bytes(103) + secrets.token_bytes(103) + codigo
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def __recebe(self, imagem, tamanho_bloco):
+        recepcao = RecepcaoImagemSB(os.path.join(self.dir.name, 'recebida'))
+        for i in range(0, len(imagem), tamanho_bloco):
+            recepcao.adiciona(memoryview(imagem)[i:i + tamanho_bloco])
+        recepcao.conclui()
+        return recepcao
+
+    def testa_recepcao_em_blocos(self):
+        esperada = ImagemSBCandidato(self.imagem, os.path.join(self.dir.name, 'inteira'))
+        for tamanho_bloco in (1, 7, 4096):
+            recepcao = self.__recebe(self.imagem, tamanho_bloco)
+            self.assertEqual(recepcao.resumo_imagem, esperada.get_hash_SB())
+
+            candidata = ImagemSBCandidato(recepcao, os.path.join(self.dir.name, 'recebida'))
+            self.assertTrue(candidata.esta_integro())
+            for campo in ('get_versao_SB', 'get_maxdfe', 'get_hash_SB', 'get_assinatura', 'get_assinatura_ateste', 'get_codigo'):
+                self.assertEqual(getattr(candidata, campo)(), getattr(esperada, campo)())
+            self.assertEqual(sorted(os.listdir(os.path.join(self.dir.name, 'recebida'))), sorted(os.listdir(os.path.join(self.dir.name, 'inteira'))))
+
+    def testa_recepcao_alterada_ou_descartada(self):
+        alterada = bytearray(self.imagem)
+        alterada[-1] ^= 1
+        candidata = ImagemSBCandidato(self.__recebe(bytes(alterada), 4096), os.path.join(self.dir.name, 'recebida'))
+        self.assertFalse(candidata.esta_integro())
+
+        # truncada no cabeçalho: mesmo resultado que a imagem inteira
+        self.assertEqual(self.__recebe(self.imagem[:3], 1).resumo_imagem, hashlib.sha256(self.imagem[:2] + self.imagem[2:3]).digest())
+
+        # uma recepção descartada não deixa o arquivo temporário na partição
+        recepcao = self.__recebe(self.imagem, 4096)
+        arquivo = recepcao.arquivo_codigo
+        self.assertTrue(os.path.exists(arquivo))
+        del recepcao
+        self.assertFalse(os.path.exists(arquivo))
+
+
+class TestaResumoImagem(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        versao, maxdfe, self.codigo = b'\x00\x03', b'\x03\xe8', secrets.token_bytes(300000)
+        self.resumo = hashlib.sha256(versao + self.codigo + maxdfe).digest()
+        self.imagem = versao + maxdfe + self.resumo + secrets.token_bytes(206) + self.codigo
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testa_resumo_em_blocos(self):
+        # blocos menores que o código, com um último bloco parcial
+        with unittest.mock.patch.object(ImagemSB, 'BLOCO_RESUMO', 4096):
+            for particao in ('sb', 'sb.sb'):
+                imagem = ImagemSB(self.imagem, os.path.join(self.dir.name, particao))
+                self.assertEqual(imagem.resumo_SHA256(), self.resumo)
+                self.assertEqual(max(len(bloco) for bloco in imagem._blocos_codigo()), 4096)
+                self.assertEqual(sum(len(bloco) for bloco in imagem._blocos_codigo()), len(self.codigo))
+
+                self.assertTrue(ImagemSB.resumidor().submit(imagem.esta_integro).result())
+
+                imagem._set_maxdfe(b'\x03\xe9')
+                self.assertFalse(imagem.esta_integro())
+
+    def testa_recepcao_descartada_com_blocos_pendentes(self):
+        recepcao = RecepcaoImagemSB(os.path.join(self.dir.name, 'recebida'))
+        for i in range(0, len(self.imagem), 1000):
+            recepcao.adiciona(self.imagem[i:i + 1000])
+        recepcao.descarta()
+        self.assertEqual(os.listdir(os.path.join(self.dir.name, 'recebida')), [])
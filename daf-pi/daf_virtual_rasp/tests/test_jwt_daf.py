@@ -0,0 +1,69 @@
+import unittest
+import secrets
+import jwt
+
+from daf_virtual_rasp.utils.jwt_daf import JWTDAF
+from daf_virtual_rasp.utils.cripto_daf import ContextoHMAC, ChaveCripto, CriptoDAF
+from authlib.jose import jwk
+
+
+class TestaJWTDAF(unittest.TestCase):
+
+    def setUp(self):
+        self.chave = secrets.token_bytes(32)
+        self.payloads = [
+            {'daf': 'bWVuc2FnZW0tb3JpZ2luYWw', 'vsb': 256, 'mop': 0, 'pdv': 'pdv-1', 'cnt': 12, 'aut': 'WRlz0bTCoQ8T_cxaO-yzmDJjb8Ax2XPNIfwEPN-P2Kg'},
+            {'nnc': 'x', 'lista': [1, 2.5, None, True], 'texto': 'ação "aspas" \\ barra', 'vazio': {}},
+            {}
+        ]
+
+    def testa_geraJWT_HS256_identico_ao_pyjwt(self):
+        contexto = ContextoHMAC(self.chave)
+        for payload in self.payloads:
+            esperado = jwt.encode(payload, self.chave, algorithm='HS256', headers={'typ': 'JWT', 'alg': 'HS256'})
+            self.assertEqual(JWTDAF.geraJWT_HS256(payload, contexto), esperado)
+            self.assertEqual(JWTDAF.geraJWT_HS256(payload, self.chave), esperado)
+            self.assertEqual(JWTDAF.geraJWT(payload, 'HS256', contexto), esperado)
+
+    def testa_verificaJWT_HS256(self):
+        contexto = ContextoHMAC(self.chave)
+        token = JWTDAF.geraJWT(self.payloads[0], 'HS256', contexto)
+        self.assertEqual(JWTDAF.verificaJWT(token, contexto, 'HS256'), self.payloads[0])
+        self.assertEqual(JWTDAF.verificaJWT(token, self.chave, 'HS256'), self.payloads[0])
+        self.assertFalse(JWTDAF.verificaJWT(token, secrets.token_bytes(32), 'HS256'))
+
+    def testa_chaves_preparadas(self):
+        priv, pub = CriptoDAF.gera_chave_EC_p256()
+        token = JWTDAF.geraJWT(self.payloads[0], 'ES256', priv, pub)
+        cabecalho = JWTDAF.getJWTHeader(token)
+        self.assertEqual(cabecalho['jwk'], jwk.dumps(pub.chave_bytes, kty='EC'))
+
+        # outras instâncias da mesma chave reaproveitam o objeto decodificado e o jwk
+        acertos = CriptoDAF.consultas_chaves['acertos']
+        copia_priv, copia_pub = ChaveCripto(priv.chave_str), ChaveCripto(pub.chave_str)
+        token = JWTDAF.geraJWT(self.payloads[1], 'ES256', copia_priv, copia_pub)
+        self.assertIs(CriptoDAF.chave_carregada(copia_pub), pub.chave_carregada)
+        self.assertGreater(CriptoDAF.consultas_chaves['acertos'], acertos)
+        self.assertEqual(JWTDAF.getJWTHeader(token), cabecalho)
+
+        self.assertEqual(JWTDAF.verificaJWT(token, pub.chave_bytes, 'ES256'), self.payloads[1])
+        self.assertEqual(JWTDAF.verificaJWT(token, copia_pub, 'ES256'), self.payloads[1])
+        self.assertFalse(JWTDAF.verificaJWT(token, CriptoDAF.gera_chave_EC_p256()[1], 'ES256'))
+
+        # uma chave PEM malformada é tratada como falha de verificação
+        self.assertFalse(JWTDAF.verificaJWT(token, b'-----BEGIN PUBLIC KEY-----\nxyz\n-----END PUBLIC KEY-----\n', 'ES256'))
+        self.assertFalse(JWTDAF.verificaJWT(token, ChaveCripto('chave'), 'ES256'))
+
+        # o cabeçalho devolvido é uma cópia
+        JWTDAF.cabecalho_jwk(pub, 'EC')['x'] = ''
+        self.assertEqual(JWTDAF.cabecalho_jwk(pub, 'EC'), cabecalho['jwk'])
+
+    def testa_limite_do_cache(self):
+        for _ in range(JWTDAF.LIMITE_CACHE + 4):
+            JWTDAF.cabecalho_jwk(CriptoDAF.gera_chave_EC_p256()[1], 'EC')
+        self.assertLessEqual(len(CriptoDAF.CHAVES), CriptoDAF.LIMITE_CHAVES)
+        self.assertLessEqual(len(JWTDAF.CABECALHOS_JWK), JWTDAF.LIMITE_CACHE)
+
+
+if __name__ == '__main__':
+    unittest.main()
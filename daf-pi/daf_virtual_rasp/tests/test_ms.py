@@ -1,8 +1,11 @@
 import unittest
-from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura
+import unittest.mock
+import os
+import tempfile
+from daf_virtual_rasp.memoria.memoria_segura import MemoriaSegura, PoliticaEscrita
 from daf_virtual_rasp.daf.daf_enums import Artefatos, Guardas, Estados, ParametrosAtualizacao
 from daf_virtual_rasp.daf.daf import DAF
-from daf_virtual_rasp.utils.cripto_daf import Certificado, ChaveCripto
+from daf_virtual_rasp.utils.cripto_daf import CriptoDAF, Certificado, ChaveCripto
 
 
 class TestaMemoriaSegura(unittest.TestCase):
@@ -105,3 +108,120 @@ class TestaMemoriaSegura(unittest.TestCase):
             ParametrosAtualizacao.versaoSB, 'versao'))
         self.assertFalse(self.ms_reg.escrita(
             ParametrosAtualizacao.versaoSB, 0))
+
+
+class TestaPoliticaEscrita(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.dir.name, 'ms.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testa_escrita_imediata(self):
+        ms = MemoriaSegura(self.arquivo)
+        self.assertTrue(ms.escrita(Artefatos.contador, 7))
+        self.assertEqual(ms.leitura(Artefatos.contador), 7)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 7)
+
+    def testa_escrita_adiada(self):
+        ms = MemoriaSegura(self.arquivo, politica_escrita=PoliticaEscrita.adiada)
+        self.assertTrue(ms.escrita(Artefatos.contador, 7))
+        self.assertTrue(ms.escrita(Guardas.NumDFe, 3))
+
+        # leituras vêm da memória; o banco só muda após o flush
+        self.assertEqual(ms.leitura(Artefatos.contador), 7)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 0)
+
+        self.assertTrue(ms.flush())
+        outra = MemoriaSegura(self.arquivo)
+        self.assertEqual(outra.leitura(Artefatos.contador), 7)
+        self.assertEqual(outra.leitura(Guardas.NumDFe), 3)
+
+    def testa_transacao(self):
+        ms = MemoriaSegura(self.arquivo)
+        with ms.transacao():
+            self.assertTrue(ms.escrita(Artefatos.contador, 5))
+            self.assertTrue(ms.escrita(Guardas.NumDFe, 2))
+            self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 0)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Guardas.NumDFe), 2)
+
+        # exceção dentro da transação: nada é gravado e a memória volta ao estado anterior
+        with self.assertRaises(RuntimeError):
+            with ms.transacao():
+                ms.escrita(Artefatos.contador, 9)
+                raise RuntimeError()
+        self.assertEqual(ms.leitura(Artefatos.contador), 5)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 5)
+        self.assertEqual(os.listdir(self.dir.name), ['ms.json'])
+
+        # falha na gravação ao final da transação: a memória volta ao estado anterior
+        with unittest.mock.patch.object(ms.banco, 'grava', side_effect=OSError()):
+            with self.assertRaises(IOError):
+                with ms.transacao():
+                    self.assertTrue(ms.escrita(Artefatos.contador, 42))
+        self.assertEqual(ms.leitura(Artefatos.contador), 5)
+        self.assertEqual(ms.pendentes, {})
+        with ms.transacao():
+            ms.escrita(Artefatos.contador, 6)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 6)
+
+    def testa_reinicio_na_transacao(self):
+        ms = MemoriaSegura(self.arquivo)
+        iddaf = ms.leitura(Artefatos.IDDAF)
+        with ms.transacao():
+            ms.escrita(Artefatos.contador, 5)
+            ms.escrita(Guardas.REGOK, True)
+
+        # a transação desfeita também desfaz o reinício, em memória e no banco
+        with self.assertRaises(RuntimeError):
+            with ms.transacao():
+                self.assertTrue(ms.reinicia_memoria())
+                self.assertEqual(ms.leitura(Artefatos.contador), 0)
+                self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 5)
+                raise RuntimeError()
+        self.assertEqual(ms.leitura(Artefatos.contador), 5)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.contador), 5)
+
+        # confirmada, grava o registro reiniciado junto com as escritas seguintes
+        with ms.transacao():
+            self.assertTrue(ms.reinicia_memoria())
+            ms.escrita(Artefatos.contador, 1)
+        outra = MemoriaSegura(self.arquivo)
+        self.assertEqual(outra.leitura(Artefatos.contador), 1)
+        self.assertEqual(outra.leitura(Guardas.REGOK), False)
+        self.assertEqual(outra.leitura(Artefatos.IDDAF), iddaf)
+        self.assertEqual(ms.pendentes, {})
+
+    def testa_cache_de_artefatos(self):
+        ms = MemoriaSegura(self.arquivo)
+        certificado = ms.leitura(Artefatos.certificado)
+        self.assertIs(ms.leitura(Artefatos.certificado), certificado)
+
+        chave = ms.leitura(Artefatos.chaveAteste)
+        self.assertIs(ms.leitura(Artefatos.chaveAteste), chave)
+
+        # a chave escrita passa a ser o artefato decodificado do campo
+        priv, pub = CriptoDAF.gera_chave_EC_p256()
+        self.assertTrue(ms.escrita(Artefatos.chavePublica, pub))
+        self.assertIs(ms.leitura(Artefatos.chavePublica), pub)
+        self.assertEqual(MemoriaSegura(self.arquivo).leitura(Artefatos.chavePublica).chave_str, pub.chave_str)
+        self.assertIs(ms.leitura(Artefatos.chaveAteste), chave)
+
+        # o contexto HMAC é mantido até a chave ser alterada
+        self.assertTrue(ms.escrita(Artefatos.chaveSEF, b'\x01' * 32))
+        contexto = ms.contexto_HMAC(Artefatos.chaveSEF)
+        self.assertIs(ms.contexto_HMAC(Artefatos.chaveSEF), contexto)
+        self.assertEqual(ms.leitura(Artefatos.chaveSEF), b'\x01' * 32)
+        self.assertTrue(ms.escrita(Artefatos.chaveSEF, b'\x02' * 32))
+        self.assertIsNot(ms.contexto_HMAC(Artefatos.chaveSEF), contexto)
+        self.assertEqual(ms.contexto_HMAC(Artefatos.chaveSEF).chave, b'\x02' * 32)
+
+        # o cache sobrevive às transações que terminam sem erro
+        contexto = ms.contexto_HMAC(Artefatos.chaveSEF)
+        with ms.transacao():
+            ms.escrita(Artefatos.contador, 1)
+        self.assertIs(ms.leitura(Artefatos.certificado), certificado)
+        self.assertIs(ms.leitura(Artefatos.chavePublica), pub)
+        self.assertIs(ms.contexto_HMAC(Artefatos.chaveSEF), contexto)
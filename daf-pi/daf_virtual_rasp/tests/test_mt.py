@@ -2,8 +2,12 @@ from random import choice
 from string import ascii_uppercase, ascii_lowercase, digits
 import secrets
 import unittest
+import json
+import os
+import tempfile
 
 from daf_virtual_rasp.memoria.mt import MemoriaDeTrabalho
+from daf_virtual_rasp.memoria.autorizacao import AutorizacaoDFE
 from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
 
 
@@ -83,4 +87,87 @@ class TestaMT(unittest.TestCase):
         cont = cont + 1
         hashDFE = Base64URLDAF.base64URLEncode(secrets.token_bytes(256))
 
-        self.assertTrue(mt.add_autorizacao_DFE(idDAF, versaoSB, cont, idAut, fragDFE, hashDFE))
\ No newline at end of file
+        self.assertTrue(mt.add_autorizacao_DFE(idDAF, versaoSB, cont, idAut, fragDFE, hashDFE))
+
+
+class TestaIndicesMT(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.dir.name, 'mt.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def adiciona(self, mt, cont, idAut, hashDFE):
+        return mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", cont, idAut, "fdf", hashDFE)
+
+    def testa_busca_por_indice(self):
+        mt = MemoriaDeTrabalho(self.arquivo)
+        for cont in range(1, 11):
+            self.assertTrue(self.adiciona(mt, cont, 'aut%d' % cont, 'hdf%d' % cont))
+
+        self.assertTrue(mt.existe_autorizacao_DFE('aut3', 'aut'))
+        self.assertTrue(mt.existe_autorizacao_DFE('hdf3', 'hdf'))
+        self.assertTrue(mt.existe_autorizacao_DFE(3, 'cnt'))
+        self.assertFalse(mt.existe_autorizacao_DFE('aut11', 'aut'))
+        self.assertEqual(mt.get_autorizacao_DFE('hdf7', 'hdf')['aut'], 'aut7')
+        self.assertIsNone(mt.get_autorizacao_DFE('outro', 'pdv'))
+        self.assertEqual(mt.get_autorizacao_DFE('pdv', 'pdv')['cnt'], 1)
+
+        # aut, cnt ou hdf repetidos não são aceitos
+        self.assertFalse(self.adiciona(mt, 11, 'aut1', 'hdf11'))
+        self.assertFalse(self.adiciona(mt, 1, 'aut11', 'hdf11'))
+        self.assertFalse(self.adiciona(mt, 11, 'aut11', 'hdf1'))
+
+        self.assertTrue(mt.remove_autorizacao_DFE('aut5'))
+        self.assertFalse(mt.remove_autorizacao_DFE('aut5'))
+        self.assertFalse(mt.existe_autorizacao_DFE('hdf5', 'hdf'))
+        self.assertTrue(self.adiciona(mt, 5, 'aut5', 'hdf5'))
+
+        # os índices são reconstruídos ao abrir o banco
+        outra = MemoriaDeTrabalho(self.arquivo)
+        self.assertEqual(outra.get_numero_de_autorizacoes_DFE(), 10)
+        self.assertEqual(outra.get_autorizacao_DFE(5, 'cnt')['hdf'], 'hdf5')
+
+        mt.reinicia_memoria()
+        self.assertFalse(mt.existe_autorizacao_DFE('aut1', 'aut'))
+        self.assertEqual(mt.get_numero_de_autorizacoes_DFE(), 0)
+
+    def testa_intervalo(self):
+        mt = MemoriaDeTrabalho(self.arquivo)
+        for cont in range(1, 8):
+            self.adiciona(mt, cont, 'aut%d' % cont, 'hdf%d' % cont)
+        mt.remove_autorizacao_DFE('aut2')
+        self.adiciona(mt, 8, 'aut8', 'hdf8')
+
+        auts = lambda ini, fim: [aut['aut'] for aut in mt.itera_autorizacoes_DFE(ini, fim)]
+        self.assertEqual(auts(1, 3), ['aut1', 'aut3', 'aut4'])
+        self.assertEqual(auts(6, 7), ['aut7', 'aut8'])
+        self.assertEqual(auts(7, 20), ['aut8'])
+        self.assertEqual(auts(1, 7), [aut['aut'] for aut in mt.get_autorizacoes_DFE()])
+
+    def testa_representacao_compacta(self):
+        mt = MemoriaDeTrabalho(self.arquivo)
+        hashDFE = secrets.token_bytes(32)
+        idAut = secrets.token_bytes(32)
+        self.assertTrue(mt.add_autorizacao_DFE("iddaf", 0, "pdv", "1", 1, idAut, b'frag', hashDFE))
+        self.assertTrue(self.adiciona(mt, 2, Base64URLDAF.base64URLEncode(secrets.token_bytes(32)), 'hdf2'))
+
+        # campos binários em bytes, convertidos para base64url apenas na leitura
+        aut = mt.get_autorizacao_DFE(Base64URLDAF.base64URLEncode(hashDFE), 'hdf')
+        self.assertEqual(aut.hdf, hashDFE)
+        self.assertEqual(aut.aut, idAut)
+        self.assertEqual(aut['aut'], Base64URLDAF.base64URLEncode(idAut))
+        self.assertEqual(aut['fdf'], Base64URLDAF.base64URLEncode(b'frag'))
+        self.assertIs(mt.get_autorizacao_DFE(idAut, 'aut'), aut)
+
+        # textos repetidos são compartilhados entre as autorizações
+        outra = mt.get_autorizacao_DFE(2, 'cnt')
+        self.assertIs(outra.daf, aut.daf)
+        self.assertIs(outra.pdv, aut.pdv)
+
+        # o registro binário preserva todos os campos
+        copia = AutorizacaoDFE.desempacota(aut.empacota())
+        self.assertEqual(copia.para_documento(), aut.para_documento())
+        self.assertLess(len(aut.empacota()), len(json.dumps(aut.para_documento())) * 0.6)
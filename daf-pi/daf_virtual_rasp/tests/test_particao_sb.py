@@ -0,0 +1,71 @@
+import unittest
+import os
+import secrets
+import hashlib
+import tempfile
+
+from daf_virtual_rasp.imagem import ImagemSB, ImagemSBCandidato, RecepcaoImagemSB
+from daf_virtual_rasp.particao_sb import ParticaoEmpacotada, converte_particao
+
+
+class TestaParticaoEmpacotada(unittest.TestCase):
+
+    PARTICAO = './daf_virtual_rasp/resources/imagem/sb'
+    CAMPOS = ('get_versao_SB', 'get_maxdfe', 'get_hash_SB', 'get_assinatura', 'get_assinatura_ateste', 'get_codigo')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.dir.name, 'sb.sb')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testa_conversao(self):
+        converte_particao(self.PARTICAO, self.arquivo)
+        diretorio = ImagemSB(path_arquivos=self.PARTICAO)
+        empacotada = ImagemSB(path_arquivos=self.arquivo)
+
+        self.assertIsNotNone(empacotada.particao)
+        for campo in self.CAMPOS:
+            self.assertEqual(getattr(empacotada, campo)(), getattr(diretorio, campo)())
+        self.assertIsInstance(empacotada.get_codigo(), memoryview)
+        self.assertEqual(empacotada.esta_integro(), diretorio.esta_integro())
+        self.assertEqual(os.listdir(self.dir.name), ['sb.sb'])
+
+    def testa_gravacao(self):
+        versao, maxdfe, codigo = b'\x00\x03', b'\x03\xe8', secrets.token_bytes(5000)
+        resumo = hashlib.sha256(versao + codigo + maxdfe).digest()
+        assinaturas = secrets.token_bytes(206)
+        imagem = ImagemSB(versao + maxdfe + resumo + assinaturas + codigo, self.arquivo)
+
+        self.assertTrue(imagem.esta_integro())
+        self.assertEqual(imagem.get_assinatura_ateste(), assinaturas[103:])
+
+        # alterar um campo regrava o arquivo mantendo os demais
+        imagem._set_versao(b'\x00\x04')
+        reaberta = ImagemSB(path_arquivos=self.arquivo)
+        self.assertEqual(reaberta.get_versao_SB(), b'\x00\x04')
+        self.assertEqual(reaberta.get_codigo(), codigo)
+        self.assertFalse(reaberta.esta_integro())
+
+        # imagem recebida em blocos em uma partição candidata empacotada
+        candidata = os.path.join(self.dir.name, 'candidata.sb')
+        recepcao = RecepcaoImagemSB(candidata)
+        recepcao.adiciona(versao + maxdfe + resumo + assinaturas + codigo)
+        recepcao.conclui()
+        imagem = ImagemSBCandidato(recepcao, candidata)
+        self.assertTrue(imagem.esta_integro())
+        self.assertEqual(ImagemSB(path_arquivos=candidata).get_codigo(), codigo)
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['candidata.sb', 'sb.sb'])
+
+    def testa_arquivo_invalido(self):
+        with open(self.arquivo, 'wb') as f:
+            f.write(b'nao e uma particao')
+        with self.assertRaises(ValueError):
+            ImagemSB(path_arquivos=self.arquivo)
+        with self.assertRaises(ValueError):
+            ImagemSB(path_arquivos=os.path.join(self.dir.name, 'inexistente.sb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
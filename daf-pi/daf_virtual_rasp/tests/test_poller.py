@@ -0,0 +1,162 @@
+import unittest
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from daf_virtual_rasp.com.poller import Poller, Callback
+from daf_virtual_rasp.com.poller_asyncio import PollerAsyncio
+
+
+class CallbackLeitura(Callback):
+
+    def __init__(self, fd):
+        Callback.__init__(self, fd, 0)
+        self.disable_timeout()
+        self.lidos = b''
+
+    def handle(self):
+        self.lidos += os.read(self.fd, 64)
+
+
+class Timer(Callback):
+
+    def __init__(self, nome, timeout, disparos):
+        Callback.__init__(self, None, timeout)
+        self.nome = nome
+        self.disparos = disparos
+
+    def handle_timeout(self):
+        self.disparos.append(self.nome)
+        self.disable_timeout()
+
+
+def trabalho_demorado(pol, r, w, timer):
+    '''Executado fora do laço: espera o laço ler o que foi escrito no pipe e
+    rearma um timer, o que só pode ser feito pela thread do laço'''
+    os.write(w, b'abc')
+    limite = time.monotonic() + 2
+    while os.get_blocking(r) and time.monotonic() < limite:
+        time.sleep(0.001)
+    timer.enable_timeout()
+    timer.timeout = 0.005
+    return threading.get_ident()
+
+
+class TestaPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.r, self.w = os.pipe()
+        self.pol = Poller()
+
+    def tearDown(self):
+        self.pol.fecha()
+        os.close(self.r)
+        os.close(self.w)
+
+    def testa_registro_incremental(self):
+        cb = CallbackLeitura(self.r)
+        self.pol.adiciona(cb)
+        self.assertEqual(len(self.pol.sched.get_map()), 1)
+
+        os.write(self.w, b'abc')
+        self.assertTrue(self.pol.despache_simples())
+        self.assertEqual(cb.lidos, b'abc')
+
+        # desabilitado: sai do seletor e o Poller não tem mais o que fazer
+        cb.disable()
+        self.assertEqual(len(self.pol.sched.get_map()), 0)
+        self.assertFalse(self.pol.despache_simples())
+
+        cb.enable()
+        cb.enable()
+        self.assertEqual(len(self.pol.sched.get_map()), 1)
+        os.write(self.w, b'de')
+        self.assertTrue(self.pol.despache_simples())
+        self.assertEqual(cb.lidos, b'abcde')
+
+    def testa_timers_em_ordem_de_expiracao(self):
+        disparos = []
+        timers = [Timer(n, t, disparos) for n, t in (('c', 0.03), ('a', 0.01), ('b', 0.02), ('x', 0.015))]
+        for t in timers:
+            self.pol.adiciona(t)
+
+        timers[3].disable_timeout()         # cancelado antes de expirar
+        timers[0].timeout = 0.005           # reagendado para antes de todos
+
+        self.pol.despache()
+        self.assertEqual(disparos, ['c', 'a', 'b'])
+        self.assertIsNone(self.pol._timeout())
+
+    def testa_reload_adia_timeout(self):
+        disparos = []
+        t = Timer('t', 0.02, disparos)
+        self.pol.adiciona(t)
+        t.reload_timeout()
+        self.assertGreater(t.timeout, 0.01)
+        self.assertEqual(len([e for e in self.pol.timers if e[-1] is not None]), 1)
+        self.pol.despache()
+        self.assertEqual(disparos, ['t'])
+
+
+    def testa_submete(self):
+        for pol in (self.pol, PollerAsyncio()):
+            disparos = []
+            conclusoes = []
+
+            class LeUmaVez(CallbackLeitura):
+                def handle(self):
+                    CallbackLeitura.handle(self)
+                    os.set_blocking(self.fd, False)     # sinaliza a leitura ao trabalho
+                    self.disable()
+
+            os.set_blocking(self.r, True)
+            cb = LeUmaVez(self.r)
+            timer = Timer('t', 0, disparos)
+            timer.disable_timeout()
+            pol.adiciona(cb)
+            pol.adiciona(timer)
+
+            with ThreadPoolExecutor(1) as executor:
+                pol.submete(executor, trabalho_demorado, pol, self.r, self.w, timer,
+                            concluida=lambda f: conclusoes.append((f.result(), threading.get_ident())))
+                # o laço segue atendendo o descritor enquanto o trabalho executa e só termina depois dele
+                pol.despache()
+
+            self.assertEqual(cb.lidos, b'abc')
+            self.assertEqual(disparos, ['t'])
+            self.assertEqual(len(conclusoes), 1)
+            self.assertNotEqual(conclusoes[0][0], threading.get_ident())
+            self.assertEqual(conclusoes[0][1], threading.get_ident())
+            if isinstance(pol, PollerAsyncio): pol.fecha()
+
+
+class TestaPollerAsyncio(unittest.TestCase):
+
+    def testa_leitura_e_timers(self):
+        r, w = os.pipe()
+        pol = PollerAsyncio()
+        disparos = []
+
+        class LeUmaVez(CallbackLeitura):
+            def handle(self):
+                CallbackLeitura.handle(self)
+                self.disable()
+
+        cb = LeUmaVez(r)
+        pol.adiciona(cb)
+        pol.adiciona(Timer('b', 0.02, disparos))
+        pol.adiciona(Timer('a', 0.01, disparos))
+        os.write(w, b'abc')
+
+        pol.despache()
+        self.assertEqual(cb.lidos, b'abc')
+        self.assertEqual(disparos, ['a', 'b'])
+
+        pol.fecha()
+        os.close(r)
+        os.close(w)
+
+
+if __name__ == '__main__':
+    unittest.main()
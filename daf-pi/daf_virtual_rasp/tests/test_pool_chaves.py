@@ -0,0 +1,48 @@
+import unittest
+
+from daf_virtual_rasp.com.poller import Poller
+from daf_virtual_rasp.com.poller_asyncio import PollerAsyncio
+from daf_virtual_rasp.daf.pool_chaves import PoolChavesEC
+from daf_virtual_rasp.utils.cripto_daf import ChaveCripto
+
+
+class TestaPoolChavesEC(unittest.TestCase):
+
+    def testa_reposicao_no_laco_ocioso(self):
+        for pol in (Poller(), PollerAsyncio()):
+            pool = PoolChavesEC(3, lote=2, intervalo=0, nivel_reposicao=2)
+            pol.adiciona(pool)
+
+            # o despacho termina quando a reserva está cheia e o timer desarmado
+            pol.despache()
+            self.assertEqual(len(pool.chaves), 3)
+            self.assertFalse(pool.timeout_enabled)
+
+            priv, pub = pool.retira()
+            self.assertIsInstance(priv, ChaveCripto)
+            self.assertIn('PUBLIC KEY', pub.chave_str)
+            self.assertFalse(pool.timeout_enabled)     # ainda no nível de reposição
+
+            pool.retira()
+            self.assertTrue(pool.timeout_enabled)
+            pol.despache()
+            self.assertEqual(pool.estatisticas(), {'capacidade': 3, 'disponiveis': 3, 'geradas': 5, 'retiradas': 2, 'faltas': 0})
+            pol.fecha()
+
+    def testa_reserva_vazia(self):
+        pool = PoolChavesEC(2)
+        pares = [pool.retira() for _ in range(2)]
+        self.assertEqual(pool.faltas, 2)
+        self.assertNotEqual(pares[0][1].chave_str, pares[1][1].chave_str)
+
+        pool.preenche()
+        self.assertEqual(len(pool.chaves), 2)
+        self.assertNotIn(pool.retira()[1].chave_str, [pub.chave_str for _, pub in pool.chaves])
+        self.assertEqual(pool.faltas, 2)
+
+        with self.assertRaises(ValueError):
+            PoolChavesEC(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,8 @@ from cryptography import x509
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import hashes
-from typing import Tuple
+from typing import Tuple, Union
+from collections import OrderedDict
 import random
 import hmac
 import hashlib
@@ -14,14 +15,43 @@ import hashlib
 
 class ChaveCripto():
 
-    def __init__(self, chave: str):
+    def __init__(self, chave: str, chave_carregada = None):
         """ Encapsula uma chave criptográfica
 
         Args:
             chave (str): chave criptográfica na forma de string
+            chave_carregada (optional): objeto da biblioteca cryptography equivalente à chave, se já disponível. Defaults to None.
         """
         self.chave_str = chave
         self.chave_bytes = chave.encode('utf-8')
+        self.__chave_carregada = chave_carregada
+        self.__fingerprint = None
+
+    @property
+    def fingerprint_SHA256(self) -> bytes:
+        """ Resumo SHA-256 da chave PEM, usado para identificá-la em caches
+
+        Returns:
+            bytes: resumo da chave
+        """
+        if self.__fingerprint == None:
+            self.__fingerprint = hashlib.sha256(self.chave_bytes).digest()
+        return self.__fingerprint
+
+    @property
+    def chave_carregada(self):
+        """ Chave PEM decodificada pela biblioteca cryptography. A decodificação é
+        feita apenas no primeiro acesso e o objeto é reaproveitado nas operações seguintes.
+
+        Returns:
+            Objeto de chave privada ou pública da biblioteca cryptography
+        """
+        if self.__chave_carregada == None:
+            if b'PRIVATE KEY' in self.chave_bytes:
+                self.__chave_carregada = serialization.load_pem_private_key(self.chave_bytes, password=None)
+            else:
+                self.__chave_carregada = serialization.load_pem_public_key(self.chave_bytes)
+        return self.__chave_carregada
 
 
 class Certificado():
@@ -37,7 +67,8 @@ class Certificado():
 
         self.assinatura = certificado_x509.signature
 
-        self.chave_publica = ChaveCripto(certificado_x509.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8'))
+        chave_publica = certificado_x509.public_key()
+        self.chave_publica = ChaveCripto(chave_publica.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8'), chave_publica)
 
         self.certificado_str = cert
         self.certificado_bytes = certificado_x509.public_bytes(
@@ -47,11 +78,58 @@ class Certificado():
         self.fingerprint_SHA256 = certificado_x509.fingerprint(hashes.SHA256())
 
 
+class ContextoHMAC():
+
+    def __init__(self, chave: bytes):
+        """ Estado HMAC-SHA256 de uma chave. Os blocos internos e externos derivados da
+        chave são calculados uma única vez e copiados a cada mensagem.
+
+        Args:
+            chave (bytes): chave do HMAC
+        """
+        self.chave = chave
+        self.__hmac = hmac.new(chave, digestmod=hashlib.sha256)
+
+    def gera(self, msg: bytes) -> bytes:
+        """ Gera o resumo HMAC-SHA256 da mensagem
+
+        Args:
+            msg (bytes): Mensagem a ser resumida
+
+        Returns:
+            bytes: Resumo criptográfico
+        """
+        contexto = self.__hmac.copy()
+        contexto.update(msg)
+        return contexto.digest()
+
+    def verifica(self, msg: bytes, resumo: bytes) -> bool:
+        """ Verifica, em tempo constante, o resumo HMAC-SHA256 da mensagem
+
+        Args:
+            msg (bytes): Mensagem a ser resumida
+            resumo (bytes): Resumo criptográfico a ser verificado
+
+        Returns:
+            bool: Resultado da comparação
+        """
+        return hmac.compare_digest(self.gera(msg), resumo)
+
+
 class CriptoDAF:
     ''' 
         Classe para operações criptográficas do DAF Virtual
     '''
 
+    # verificações EC P-384 bem sucedidas, indexadas pelos resumos SHA-256 de (mensagem, assinatura, chave), em ordem de uso
+    VERIFICACOES_EC = OrderedDict()
+    LIMITE_VERIFICACOES_EC = 256
+    consultas_verificacoes_EC = {'acertos': 0, 'faltas': 0}
+    # chaves decodificadas (privadas e públicas), indexadas pelo resumo SHA-256 da chave PEM, em ordem de uso
+    CHAVES = OrderedDict()
+    LIMITE_CHAVES = 32
+    consultas_chaves = {'acertos': 0, 'faltas': 0}
+
     def __init__(self):
         pass
 
@@ -75,14 +153,15 @@ class CriptoDAF:
 
     @staticmethod
     def gera_chave_EC_p256():
-        private_key = ec.generate_private_key(ec.SECP256R1)
-        public_key = private_key.public_key()
-        private_key = private_key.private_bytes(encoding=serialization.Encoding.PEM,format=serialization.PrivateFormat.PKCS8,encryption_algorithm=serialization.NoEncryption())
+        chave_privada = ec.generate_private_key(ec.SECP256R1())
+        chave_publica = chave_privada.public_key()
+        private_key = chave_privada.private_bytes(encoding=serialization.Encoding.PEM,format=serialization.PrivateFormat.PKCS8,encryption_algorithm=serialization.NoEncryption())
 
-        public_key = public_key.public_bytes(encoding=serialization.Encoding.PEM,format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        public_key = chave_publica.public_bytes(encoding=serialization.Encoding.PEM,format=serialization.PublicFormat.SubjectPublicKeyInfo)
 
-        private_key = ChaveCripto(private_key.decode('utf-8'))
-        public_key = ChaveCripto(public_key.decode('utf-8'))
+        # as chaves já saem carregadas, sem precisar decodificar o PEM recém gerado
+        private_key = ChaveCripto(private_key.decode('utf-8'), chave_privada)
+        public_key = ChaveCripto(public_key.decode('utf-8'), chave_publica)
         return private_key, public_key
 
     @staticmethod
@@ -114,12 +193,57 @@ class CriptoDAF:
         """
 
         try:
-            pubkey = serialization.load_pem_public_key(pubkey.chave_bytes)
-            pubkey.verify(sig, msg, ec.ECDSA(hashes.SHA384()))
-            return True
+            verificacao = (hashlib.sha256(msg).digest(), hashlib.sha256(sig).digest(), pubkey.fingerprint_SHA256)
+            if verificacao in CriptoDAF.VERIFICACOES_EC:
+                CriptoDAF.VERIFICACOES_EC.move_to_end(verificacao)
+                CriptoDAF.consultas_verificacoes_EC['acertos'] += 1
+                return True
+            CriptoDAF.consultas_verificacoes_EC['faltas'] += 1
+
+            CriptoDAF.chave_carregada(pubkey).verify(sig, msg, ec.ECDSA(hashes.SHA384()))
         except:
             return False
 
+        # apenas verificações bem sucedidas são guardadas
+        CriptoDAF.VERIFICACOES_EC[verificacao] = True
+        if len(CriptoDAF.VERIFICACOES_EC) > CriptoDAF.LIMITE_VERIFICACOES_EC:
+            CriptoDAF.VERIFICACOES_EC.popitem(last=False)
+        return True
+
+    @staticmethod
+    def chave_carregada(chave: Union[ChaveCripto, bytes]):
+        """ Chave decodificada, pronta para assinar ou verificar. Uma chave PEM já vista
+        (mesmo em outra instância de ChaveCripto) não é decodificada novamente.
+
+        Args:
+            chave (Union[ChaveCripto, bytes]): chave, ou chave pública PEM em bytes
+
+        Returns:
+            Objeto de chave privada ou pública da biblioteca cryptography
+
+        Raises:
+            ValueError: se a chave PEM não puder ser decodificada
+        """
+        if isinstance(chave, ChaveCripto):
+            fingerprint = chave.fingerprint_SHA256
+        else:
+            fingerprint = hashlib.sha256(chave).digest()
+        carregada = CriptoDAF.CHAVES.get(fingerprint)
+        if carregada != None:
+            CriptoDAF.CHAVES.move_to_end(fingerprint)
+            CriptoDAF.consultas_chaves['acertos'] += 1
+            return carregada
+
+        CriptoDAF.consultas_chaves['faltas'] += 1
+        if isinstance(chave, ChaveCripto):
+            carregada = chave.chave_carregada
+        else:
+            carregada = serialization.load_pem_public_key(chave)
+        CriptoDAF.CHAVES[fingerprint] = carregada
+        if len(CriptoDAF.CHAVES) > CriptoDAF.LIMITE_CHAVES:
+            CriptoDAF.CHAVES.popitem(last=False)
+        return carregada
+
 
     @staticmethod
     def verifica_assinatura_RSA_PKCS1_V1_5(msg: bytes, sig: bytes, pubkey: ChaveCripto) -> bool:
@@ -175,31 +299,33 @@ class CriptoDAF:
         return cipher.decrypt(msg)
 
     @staticmethod
-    def gera_HMAC_SHA256(key: bytes, msg: bytes) -> bytes:
+    def gera_HMAC_SHA256(key: Union[bytes, ContextoHMAC], msg: bytes) -> bytes:
         """ Método para geração de resumo HMAC-SHA256
 
         Args:
-            key (bytes): Chave para a geração do resumo
+            key (Union[bytes, ContextoHMAC]): Chave para a geração do resumo, ou seu contexto HMAC
             msg (bytes): Mensagem a ser resumida
 
         Returns:
             bytes: Resumo criptográfico
         """
+        if isinstance(key, ContextoHMAC):
+            return key.gera(msg)
         return hmac.new(key, msg, hashlib.sha256).digest()
 
     @staticmethod
-    def verifica_HMAC_SHA256(key: bytes, msg: bytes, resumo: bytes) -> bool:
-        """ Método para verificação de HMAC-SHA256
+    def verifica_HMAC_SHA256(key: Union[bytes, ContextoHMAC], msg: bytes, resumo: bytes) -> bool:
+        """ Método para verificação de HMAC-SHA256, com comparação em tempo constante
 
         Args:
-            key (bytes): Chave para o resumo criptográfico
+            key (Union[bytes, ContextoHMAC]): Chave para o resumo criptográfico, ou seu contexto HMAC
             msg (bytes): Mensagem a ser resumida
             resumo (bytes): Resumo criptográfico a ser verificado
 
         Returns:
             bool: Resultado da comparação
         """
-        return CriptoDAF.gera_HMAC_SHA256(key, msg) == resumo
+        return hmac.compare_digest(CriptoDAF.gera_HMAC_SHA256(key, msg), resumo)
 
     @staticmethod
     def gera_resumo_SHA256(msg: bytes) -> bytes:
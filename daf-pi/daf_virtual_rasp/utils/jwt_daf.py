@@ -1,22 +1,32 @@
-from daf_virtual_rasp.utils.cripto_daf import ChaveCripto
+from daf_virtual_rasp.utils.cripto_daf import ChaveCripto, ContextoHMAC, CriptoDAF
+from daf_virtual_rasp.utils.base64URL_daf import Base64URLDAF
 from authlib.jose import jwk
 import jwt
+import json
 from typing import Union
 
 
 class JWTDAF:
 
+    # segmento do cabeçalho HS256, idêntico ao gerado pelo PyJWT para headers={'typ': 'JWT', 'alg': 'HS256'}
+    CABECALHO_HS256 = Base64URLDAF.base64URLEncode(json.dumps({'typ': 'JWT', 'alg': 'HS256'}, separators=(',', ':')).encode()) + '.'
+
+    # cabeçalhos jwk já calculados, indexados pelo resumo SHA-256 da chave PEM
+    # (as chaves decodificadas ficam no cache de CriptoDAF.chave_carregada)
+    CABECALHOS_JWK = {}
+    LIMITE_CACHE = 32
+
     def __init__(self):
         pass
 
     @staticmethod
-    def geraJWT(payload: dict, alg: str, privkey: Union[ChaveCripto, bytes], pubkey: ChaveCripto = None) -> str:
+    def geraJWT(payload: dict, alg: str, privkey: Union[ChaveCripto, bytes, ContextoHMAC], pubkey: ChaveCripto = None) -> str:
         """ Método para geração de tokens JWT
 
         Args:
             payload (dict): Dicionário python com as chaves e valores do Payload do token
             alg (str): Algoritmo de assinatura digital
-            privkey (bytes): Chave privada para geração da assinatura digital no formato PEM
+            privkey (bytes): Chave privada para geração da assinatura digital no formato PEM (ou chave/contexto HMAC para HS256)
             pubkey (bytes, optional): Chave pública para geração do header do token no formato PEM. Se não for passado, tem None com padrão.
 
         Returns:
@@ -27,41 +37,84 @@ class JWTDAF:
             if alg == 'RS256':
                 header = {'typ': 'JWT', 'alg': alg}
                 tokenJWT = jwt.encode(
-                    payload, privkey.chave_bytes, algorithm=alg, headers=header)
+                    payload, CriptoDAF.chave_carregada(privkey), algorithm=alg, headers=header)
                 
             elif alg == 'HS256':
-                header = {'typ': 'JWT', 'alg': alg}
-                tokenJWT = jwt.encode(
-                    payload, privkey, algorithm=alg, headers=header)
+                tokenJWT = JWTDAF.geraJWT_HS256(payload, privkey)
             elif alg=='ES384':
                 header = {'typ': 'JWT', 'alg': alg}
                 tokenJWT = jwt.encode(
-                    payload, privkey.chave_bytes, algorithm=alg, headers=header)
+                    payload, CriptoDAF.chave_carregada(privkey), algorithm=alg, headers=header)
             elif alg == 'ES256':
                 header = {'typ': 'JWT', 'alg': alg}
-                tokenJWT = jwt.encode(payload, privkey.chave_bytes, algorithm='ES256',headers=header)
+                tokenJWT = jwt.encode(payload, CriptoDAF.chave_carregada(privkey), algorithm='ES256',headers=header)
             else:
                 raise Exception(
                     "Algoritmo de assinatura digital não suportado")
         else:
             if alg == 'RS256':
-                key_jwk = jwk.dumps(pubkey.chave_bytes, kty='RSA')
+                key_jwk = JWTDAF.cabecalho_jwk(pubkey, 'RSA')
                 header = {'jwk': key_jwk}
                 tokenJWT = jwt.encode(
-                    payload, privkey.chave_bytes, algorithm='RS256', headers=header)
+                    payload, CriptoDAF.chave_carregada(privkey), algorithm='RS256', headers=header)
             elif alg == 'ES256':
-                key_jwk = jwk.dumps(pubkey.chave_bytes, kty = 'EC')
+                key_jwk = JWTDAF.cabecalho_jwk(pubkey, 'EC')
                 header = {'jwk': key_jwk}
-                tokenJWT = jwt.encode(payload, privkey.chave_bytes, algorithm='ES256',headers=header)
+                tokenJWT = jwt.encode(payload, CriptoDAF.chave_carregada(privkey), algorithm='ES256',headers=header)
             elif alg == 'ES384':
-                key_jwk = jwk.dumps(pubkey.chave_bytes, kty = 'EC')
+                key_jwk = JWTDAF.cabecalho_jwk(pubkey, 'EC')
                 header = {'jwk': key_jwk}
-                tokenJWT = jwt.encode(payload, privkey.chave_bytes, algorithm='ES384',headers=header)
+                tokenJWT = jwt.encode(payload, CriptoDAF.chave_carregada(privkey), algorithm='ES384',headers=header)
             else:
                 raise Exception(
                     "Algoritmo de assinatura digital não suportado")
         return tokenJWT
 
+    @staticmethod
+    def __guarda(cache: dict, fingerprint: bytes, valor):
+        """ Guarda um valor em um dos caches, descartando o mais antigo quando está cheio
+        """
+        if len(cache) >= JWTDAF.LIMITE_CACHE:
+            del cache[next(iter(cache))]
+        cache[fingerprint] = valor
+
+    @staticmethod
+    def cabecalho_jwk(chave: ChaveCripto, kty: str) -> dict:
+        """ Chave pública no formato jwk, para o cabeçalho do token. É calculada uma
+        única vez por chave; cada chamada recebe uma cópia do dicionário.
+
+        Args:
+            chave (ChaveCripto): chave pública
+            kty (str): tipo da chave ('EC' ou 'RSA')
+
+        Returns:
+            dict: chave pública em jwk
+        """
+        fingerprint = chave.fingerprint_SHA256
+        key_jwk = JWTDAF.CABECALHOS_JWK.get(fingerprint)
+        if key_jwk == None:
+            key_jwk = jwk.dumps(CriptoDAF.chave_carregada(chave), kty=kty)
+            JWTDAF.__guarda(JWTDAF.CABECALHOS_JWK, fingerprint, key_jwk)
+        return dict(key_jwk)
+
+    @staticmethod
+    def geraJWT_HS256(payload: dict, chave: Union[bytes, ContextoHMAC]) -> str:
+        """ Gera um token JWT HS256 sem passar pelo PyJWT: o cabeçalho já vem serializado
+        e o HMAC parte do estado pré-calculado da chave. O token é idêntico, byte a byte,
+        ao de jwt.encode(payload, chave, algorithm='HS256', headers={'typ': 'JWT', 'alg': 'HS256'})
+
+        Args:
+            payload (dict): Dicionário python com as chaves e valores do Payload do token
+            chave (Union[bytes, ContextoHMAC]): chave HMAC, ou seu contexto
+
+        Returns:
+            str: Token JWT gerado
+        """
+        if not isinstance(chave, ContextoHMAC):
+            chave = ContextoHMAC(chave)
+        entrada = JWTDAF.CABECALHO_HS256 + Base64URLDAF.base64URLEncode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        return entrada + '.' + Base64URLDAF.base64URLEncode(chave.gera(entrada.encode('ascii')))
+
     @staticmethod
     def getJWTHeader(token: str) -> dict:
         """ Método para retorno do header do token JWT
@@ -82,18 +135,21 @@ class JWTDAF:
 
         Args:
             tokenJWT (str): Token JWT a ser verificado
-            pubkey (bytes): Chave pública par da chave privada que gerou a assinatura do token JWT
+            pubkey (bytes): Chave pública par da chave privada que gerou a assinatura do token JWT (ou chave/contexto HMAC para HS256)
             alg (str): Algoritmo de assinatura digital
 
         Returns:
             dict: Payload do token JWT
         """
         chave = None
-        if isinstance(pubkey, bytes):
-            chave = pubkey
-        if isinstance(pubkey, ChaveCripto):
-            chave = pubkey.chave_bytes
         try:
+            # uma chave PEM malformada é uma falha de verificação, como uma assinatura inválida
+            if isinstance(pubkey, bytes):
+                chave = pubkey if alg.startswith('HS') else CriptoDAF.chave_carregada(pubkey)
+            if isinstance(pubkey, ContextoHMAC):
+                chave = pubkey.chave
+            if isinstance(pubkey, ChaveCripto):
+                chave = pubkey.chave_bytes if alg.startswith('HS') else CriptoDAF.chave_carregada(pubkey)
             payload = jwt.decode(tokenJWT, chave,
                                  algorithms=alg, verify=True)
             return payload
@@ -101,3 +157,5 @@ class JWTDAF:
             return False
         except jwt.exceptions.InvalidAlgorithmError:
             return False
+        except ValueError:
+            return False